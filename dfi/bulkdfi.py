@@ -1,18 +1,178 @@
-import dfi
+from __future__ import print_function
+import os
 import glob
+import contextlib
+import multiprocessing
+import dfi
+import dfi.pdbio as pdbio
+import dfi.covario as covario
 from six.moves import zip
 
+# in order of preference when a window has more than one format
+covar_exts = ['.npy', '.npz', '.f64', '.f32', '.bin', '.raw', '.dat']
+blas_envs = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+_ATOMS = None  # the parsed pdb of a worker
+
+
+def _threadpoolctl():
+    """Returns threadpoolctl.threadpool_limits, None if not installed"""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits
+
+
+@contextlib.contextmanager
+def _blasenv(blasthreads):
+    """Sets the BLAS thread variables for processes started inside"""
+    saved = dict((env, os.environ.get(env)) for env in blas_envs)
+    os.environ.update((env, str(blasthreads)) for env in blas_envs)
+    try:
+        yield
+    finally:
+        for env, value in saved.items():
+            if value is None:
+                os.environ.pop(env, None)
+            else:
+                os.environ[env] = value
+
+
+def _covar_files():
+    """
+    Globs the _mwcovarmat covariance matrices of the directory, one per
+    window: the binary one when it was also converted from ascii
+    """
+    covar_files = {}
+    for ext in covar_exts:
+        for covar in glob.glob('*_mwcovarmat' + ext):
+            covar_files.setdefault(covar.rsplit('_mwcovarmat', 1)[0], covar)
+    return [covar_files[stem] for stem in sorted(covar_files)]
+
+
+def _initblas(blasthreads, initializer=None, initargs=()):
+    """Pool initializer: caps the BLAS threads and runs initializer"""
+    threadpool_limits = _threadpoolctl()
+    if blasthreads and threadpool_limits is not None:
+        threadpool_limits(limits=blasthreads)
+    if initializer is not None:
+        initializer(*initargs)
+
 
-def bulk_dfi(pdbfile, Verbose=False):
+def blas_pool(nprocs=None, blasthreads=1, initializer=None, initargs=()):
+    """
+    Pool of processes that use at most blasthreads BLAS threads each,
+    so that nprocs processes do not oversubscribe the cores.
+
+    Input
+    -----
+    nprocs: int
+       number of processes, None for all cores
+    blasthreads: int
+       BLAS threads per process, with threadpoolctl if it is installed
+       and otherwise through the environment of freshly spawned
+       processes
+    initializer, initargs:
+       run in every process, see multiprocessing.Pool
+
+    Output
+    ------
+    pool: multiprocessing.Pool
+    """
+    if _threadpoolctl() is not None:
+        return multiprocessing.Pool(nprocs, initializer=_initblas,
+                                    initargs=(blasthreads, initializer,
+                                              initargs))
+    with _blasenv(blasthreads):
+        return multiprocessing.get_context('spawn').Pool(
+            nprocs, initializer=_initblas,
+            initargs=(None, initializer, initargs))
+
+
+def _initworker(ATOMS):
+    """Pool initializer: keeps the parsed pdb"""
+    global _ATOMS
+    _ATOMS = ATOMS
+
+
+def _bulkworker(args):
+    """DFI of one covariance matrix, written out like calc_dfi does"""
+    covar, dfi_fil = args
+    invHrs = covario.covar_reader(covar)
+    model = dfi.dfi_calc.DFIModel(_ATOMS, invHrs)
+    dfival, reldfi, pctdfi, zscoredfi = dfi.dfi_calc.dfianal(
+        model.dfi, Array=True)
+    dfi.dfi_calc.outputToDF(_ATOMS, dfival, pctdfi, outfile=dfi_fil,
+                            writetofile=True)
+    return covar, dfi_fil
+
+
+def bulk_dfi_iter(pdbfile, covar_files, dfi_files, nprocs=None,
+                  blasthreads=1):
+    """
+    Calculates dfi for a list of covariance matrices of the same pdb.
+    The pdb is parsed once and the covariance matrices are fanned out
+    to a pool of processes; the results come back as they finish.
+
+    Input
+    -----
+    pdbfile: fname
+       Name of pdbfile to be used in DFI calculations
+    covar_files: ls
+       covariance matrices, see covario.covar_reader
+    dfi_files: ls
+       -dfianalysis.csv file to write for each covariance matrix
+    nprocs: int
+       number of processes, None for all cores and 1 to run serially
+       in this process
+    blasthreads: int
+       BLAS threads per process, see blas_pool
+
+    Output
+    ------
+    covar, dfi_fil: str
+       each covariance matrix and its output file, in the order they
+       finish
+    """
+    ATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=True, noalc=True,
+                                     chainA=False, Verbose=False)
+    tasks = list(zip(covar_files, dfi_files))
+    if nprocs == 1:
+        _initworker(ATOMS)
+        for task in tasks:
+            yield _bulkworker(task)
+        return
+
+    pool = blas_pool(nprocs, blasthreads, initializer=_initworker,
+                     initargs=(ATOMS,))
+    try:
+        for result in pool.imap_unordered(_bulkworker, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def bulk_dfi(pdbfile, Verbose=False, nprocs=None, blasthreads=1):
     """
     Calculates dfi for all covariance matrices.
-    Globs all covariance matrices with _mwcovarmat.dat
-    and replaces with -dfianalysis.csv for the output files.
+    Globs all covariance matrices with _mwcovarmat.dat (or the binary
+    _mwcovarmat.npy, .npz, .bin, .raw, .f32 and .f64, see dfi.covario)
+    and replaces with -dfianalysis.csv for the output files. A window
+    with more than one format is only computed once.
 
     Input
     -----
     pdbfile: fname
        Name of pdbfile to be used in DFI calculations
+    Verbose: bool
+       print every matrix as it finishes
+    nprocs: int
+       number of processes, None for all cores, see bulk_dfi_iter
+    blasthreads: int
+       BLAS threads per process
 
     Output
     ------
@@ -20,9 +180,45 @@ def bulk_dfi(pdbfile, Verbose=False):
        Writes out to file
     """
 
-    covar_files = glob.glob('*_mwcovarmat.dat')
-    dfi_files = map(lambda x: x.replace(
-        '_mwcovarmat.dat', '-dfianalysis.csv'), covar_files)
-    for covar, dfi_fil in zip(covar_files, dfi_files):
-        dfi.calc_dfi(pdbfile, covar=covar,
-                     writetofile=True, dfianalfile=dfi_fil)
+    covar_files = _covar_files()
+    dfi_files = [covar.rsplit('_mwcovarmat', 1)[0] + '-dfianalysis.csv'
+                 for covar in covar_files]
+    for ndone, (covar, dfi_fil) in enumerate(bulk_dfi_iter(
+            pdbfile, covar_files, dfi_files, nprocs=nprocs,
+            blasthreads=blasthreads)):
+        if(Verbose):
+            print("%d/%d %s -> %s" % (ndone + 1, len(covar_files), covar,
+                                      dfi_fil))
+
+
+def bulk_dfi_stack(pdbfile, ls_reschain=[], outfile='bulk-stackdfi.csv',
+                   memlimit=None):
+    """
+    Calculates dfi for all covariance matrices (see bulk_dfi) as one
+    stack and writes a single tidy file instead of one -dfianalysis.csv
+    per matrix, see dfi_calc.calc_dfi_stack.
+
+    Input
+    -----
+    pdbfile: fname
+       Name of pdbfile to be used in DFI calculations
+    ls_reschain: ls
+       list of f-dfi residues by chain and index (e.g., ['A19','A20']
+    outfile: fname
+       tidy output, with the prefix of each covariance matrix in the
+       window column
+    memlimit: float
+       memory budget in MB for a batch of matrices
+
+    Output
+    ------
+    stack: DFIStack
+       (W,N) arrays of the dfi profiles
+    """
+    covar_files = _covar_files()
+    labels = [covar.rsplit('_mwcovarmat', 1)[0] for covar in covar_files]
+    return dfi.dfi_calc.calc_dfi_stack(pdbfile, covar_files,
+                                       ls_reschain=ls_reschain,
+                                       labels=labels, writetofile=True,
+                                       dfianalfile=outfile,
+                                       memlimit=memlimit)
@@ -41,6 +41,9 @@ def colorbydfi(CSVFIL, PDBFIL, Verbose=False, colorbyparam='pctdfi',
     This program reads in a pdb and the dfi analysis of the pdb and then color
     the CA accordingly to the dfi. It will then write out to a DFI file
 
+    Every atom gets the value of its residue, looked up by chain and
+    residue index in one join; atoms of residues without a value get 0.
+
     Usage
     ------
     ```
@@ -52,54 +55,89 @@ def colorbydfi(CSVFIL, PDBFIL, Verbose=False, colorbyparam='pctdfi',
     -----
 
     CSVFIL: file
-       DFI CSV FILE
+       DFI CSV FILE or the DataFrame of the dfi analysis
     PDBFIL: file
-       Corresponding PDB FILE
-    colorbyparam: str
-       paramter to use for coloring 'pctdfi' (Default)
+       Corresponding PDB FILE, or its already read ATOMS
+    colorbyparam: str or ls
+       paramter to use for coloring 'pctdfi' (Default), any column of
+       the dfi analysis works. A list of them (e.g., ['pctdfi',
+       'pctfdfi']) writes one colored pdb per column in one pass.
     Verbose: bool
        Boolean for debugging
-    outfile: str
+    outfile: str or ls
        Name of file to output Default is
-       pdbid-dficolor.pdb
+       pdbid-dficolor.pdb, a list of names for a list of colorbyparam.
+       With a DataFrame pdbid is taken from the name of PDBFIL, so
+       outfile is needed when PDBFIL is not a file name.
+
+    Output
+    ------
+    ATOMS: AtomArray
+       ATOMS of the pdb with colorbyparam as temp_factor, a list of
+       them for a list of colorbyparam
     """
 
+    import os
+    import numpy as np
     import pandas as pd
     import dfi.pdbio as io
 
-    if type(CSVFIL) == str:
+    if isinstance(CSVFIL, str):
         data = pd.read_csv(CSVFIL)
         pdbid = CSVFIL.split('-')[0]
-    else:
+    elif isinstance(PDBFIL, str):
         data = CSVFIL
-        pdbid = outfile.split('-')[0]
+        pdbid = PDBFIL
+        for ext in ['.gz', '.bz2', '.xz']:
+            if pdbid.endswith(ext):
+                pdbid = pdbid[:-len(ext)]
+        pdbid = os.path.splitext(pdbid)[0]
+    elif(outfile):
+        data = CSVFIL
+        pdbid = None
+    else:
+        raise ValueError('outfile is needed to color a DataFrame onto '
+                         'ATOMS or a stream')
 
     if(Verbose):
-        print("CSVFIL: %s" % (CSVFIL))
-        print("PDBFIL: %s" % (PDBFIL))
-        print("pdbid: %s" % (pdbid))
+        if(pdbid):
+            print("pdbid: %s" % (pdbid))
         print(data[:10])
-        print("Reading in: %s" % (CSVFIL))
-
-    ATOMS = []
-    ATOMS = io.pdb_reader(PDBFIL, ATOMS)
-
-    for i in range(len(ATOMS)):
-        if True:
-            resind = ATOMS[i].res_index
-            chainind = ATOMS[i].chainID
-            resmask = (data.ResI == int(resind))
-            chainmask = (data.ChainID == chainind)
-            val = data[resmask & chainmask][colorbyparam].values[0]
-            if Verbose:
-                print(ATOMS[i].res_index, ATOMS[i].temp_factor, val)
-            ATOMS[i]._replace(temp_factor=val)
-        else:
-            ATOMS[i]._replace(temp_factor=0.)
-    if(outfile):
-        io.pdb_writer(ATOMS, filename=outfile)
+
+    if isinstance(PDBFIL, (list, io.AtomArray)):
+        ATOMS = io.AtomArray.from_atoms(PDBFIL)
     else:
-        io.pdb_writer(ATOMS, filename=pdbid + '-dficolor.pdb')
+        ATOMS = io.pdb_reader_columns(PDBFIL)
+
+    # (chain, residue) -> row of data, a later row wins like in chainresmap
+    reskey = data.ChainID.astype(str) + ':' + \
+        data.ResI.astype(str).str.strip()
+    rows = pd.Series(np.arange(len(data)), index=reskey.values)
+    rows = rows[~rows.index.duplicated(keep='last')]
+    atomkey = np.char.add(np.char.add(ATOMS.chainID.astype(str), ':'),
+                          np.char.strip(ATOMS.res_index.astype(str)))
+    ind = rows.index.get_indexer(atomkey)
+    matched = ind >= 0
+    ind = rows.values[ind]
+    if(Verbose):
+        print("%d of %d atoms colored" % (np.sum(matched), len(ATOMS)))
+
+    params = [colorbyparam] if isinstance(colorbyparam, str) else \
+        list(colorbyparam)
+    if not(outfile):
+        outfile = pdbid + '-dficolor.pdb'
+    outfiles = [outfile] if isinstance(outfile, str) else list(outfile)
+    colorings = []
+    for param, fname in zip(params, outfiles):
+        values = np.asarray(data[param].values, dtype=float)
+        colorings.append((fname, np.where(matched, values[ind], 0.)))
+    io.pdb_writer_colored(ATOMS, colorings)
+
+    COLORED = [ATOMS.copy(temp_factor=temp_factor)
+               for fname, temp_factor in colorings]
+    if isinstance(colorbyparam, str):
+        return COLORED[0]
+    return COLORED
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Covariance IO
+=============
+
+Description
+-----------
+Reading and writing of 3Nx3N covariance matrices. Besides the ascii
+matrices that np.loadtxt reads, binary .npy, .npz and raw float32/float64
+files are opened as memory maps, so nothing is parsed or copied
+up front.
+
+Usage
+-----
+```
+covario.py COVARFILE [OUTFILE] [--dtype float32]
+```
+
+Converts an ascii covariance matrix into a binary one (.npy by default)
+one row at a time.
+"""
+from __future__ import print_function
+import sys
+import struct
+import argparse
+import zipfile
+import numpy as np
+
+
+if __name__ == "__main__" and len(sys.argv) < 2:
+    print(__doc__)
+    exit()
+
+rawext = {'.bin': None, '.raw': None, '.f32': np.float32,
+          '.f64': np.float64}
+
+
+def _ext(fname):
+    """Returns the lower case extension of fname (e.g., '.npy')"""
+    dot = fname.rfind('.')
+    return fname[dot:].lower() if dot >= 0 else ''
+
+
+def _npz_member(fname, key=None):
+    """
+    Memory map an array stored uncompressed in a .npz file. Returns
+    None when the member is compressed and has to be read in.
+    """
+    with zipfile.ZipFile(fname) as archive:
+        names = archive.namelist()
+        member = key + '.npy' if key else names[0]
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(fname, 'rb') as infile:
+        # local file header: 30 fixed bytes, the name and the extra field
+        infile.seek(info.header_offset + 26)
+        namelen, extralen = struct.unpack('<HH', infile.read(4))
+        infile.seek(info.header_offset + 30 + namelen + extralen)
+        version = np.lib.format.read_magic(infile)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(infile)
+        else:
+            header = np.lib.format.read_array_header_2_0(infile)
+        shape, fortran_order, dtype = header
+        offset = infile.tell()
+    return np.memmap(fname, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
+
+
+def covar_reader(fname, dtype=None, key=None):
+    """
+    Reads in a 3Nx3N covariance matrix. Binary formats are memory
+    mapped read-only.
+
+    Input
+    -----
+    fname: str or numpy
+       covariance file; .npy, .npz, raw binary (.bin, .raw, .f32,
+       .f64) or anything else is read as ascii. An array is returned
+       as is.
+    dtype: numpy dtype
+       dtype of a raw .bin/.raw file (default float64)
+    key: str
+       name of the array in a .npz file (default the first one)
+
+    Output
+    ------
+    invHrs: numpy
+       (3N,3N) covariance matrix
+    """
+    if isinstance(fname, np.ndarray):
+        return fname
+
+    ext = _ext(fname)
+    if ext == '.npy':
+        return np.load(fname, mmap_mode='r')
+    elif ext == '.npz':
+        covar = _npz_member(fname, key=key)
+        if covar is None:
+            with np.load(fname) as archive:
+                covar = archive[key if key else archive.files[0]]
+        return covar
+    elif ext in rawext:
+        dtype = np.dtype(rawext[ext] or dtype or np.float64)
+        covar = np.memmap(fname, dtype=dtype, mode='r')
+        ncoords = int(round(np.sqrt(len(covar))))
+        if ncoords * ncoords != len(covar):
+            raise ValueError('%s does not hold a square matrix' % fname)
+        return covar.reshape((ncoords, ncoords))
+    else:
+        return np.loadtxt(fname)
+
+
+def _datalines(ascii):
+    """Lines of an ascii matrix without # comments and blank lines"""
+    for line in ascii:
+        line = line.split('#', 1)[0]
+        if line.strip():
+            yield line
+
+
+def covar_converter(infile, outfile, dtype=np.float64, Verbose=False):
+    """
+    Converts an ascii covariance matrix to a binary file, one row at a
+    time so that the text is never held in memory.
+
+    Input
+    -----
+    infile: str
+       ascii covariance matrix, one row of the matrix per line; #
+       comments (e.g., the header of np.savetxt) and blank lines are
+       skipped as by np.loadtxt
+    outfile: str
+       .npy file or raw binary file (any other extension)
+    dtype: numpy dtype
+       dtype to store the matrix as (default float64)
+    Verbose: bool
+       flag for debugging
+
+    Output
+    ------
+    outfile: file
+       binary covariance matrix
+    """
+    dtype = np.dtype(dtype)
+    with open(infile, 'r') as ascii:
+        lines = _datalines(ascii)
+        first = next(lines, None)
+        if first is None:
+            raise ValueError('%s has no rows' % infile)
+        first = np.array(first.split(), dtype=dtype)
+        ncoords = len(first)
+        shape = (ncoords, ncoords)
+        if _ext(outfile) == '.npy':
+            covar = np.lib.format.open_memmap(outfile, mode='w+',
+                                              dtype=dtype, shape=shape)
+        else:
+            covar = np.memmap(outfile, dtype=dtype, mode='w+', shape=shape)
+
+        covar[0] = first
+        nrows = 1
+        for line in lines:
+            row = np.array(line.split(), dtype=dtype)
+            if len(row) != ncoords or nrows == ncoords:
+                raise ValueError('%s is not a %dx%d matrix' %
+                                 (infile, ncoords, ncoords))
+            covar[nrows] = row
+            nrows += 1
+    if nrows != ncoords:
+        raise ValueError('%s is not a %dx%d matrix' %
+                         (infile, ncoords, ncoords))
+    covar.flush()
+    if(Verbose):
+        print("Wrote out %dx%d matrix to %s" % (ncoords, ncoords, outfile))
+
+
+def check_args(args=None):
+    """
+    Parse command lines input
+
+    Output
+    ------
+    infile: str
+       ascii covariance matrix
+    outfile: str
+       name of the binary file
+    dtype: str
+       dtype to store the matrix as
+    """
+    parser = argparse.ArgumentParser(
+        description='Convert an ascii covariance matrix to binary')
+    parser.add_argument('infile',
+                        help='ascii 3Nx3N covariance matrix')
+    parser.add_argument('outfile',
+                        help='.npy or raw binary output file',
+                        nargs='?')
+    parser.add_argument('--dtype',
+                        help='float32 or float64 (default float64)',
+                        default='float64')
+
+    results = parser.parse_args(args)
+    outfile = results.outfile
+    if not(outfile):
+        outfile = results.infile.rsplit('.', 1)[0] + '.npy'
+    return results.infile, outfile, results.dtype
+
+
+if __name__ == "__main__":
+    infile, outfile, dtype = check_args(sys.argv[1:])
+    covar_converter(infile, outfile, dtype=dtype, Verbose=True)
@@ -1,6 +1,7 @@
 from pkg_resources import resource_filename
 
 example_pdb = resource_filename(__name__, 'data/1l2y.pdb')
+example_cif = resource_filename(__name__, 'data/1l2y.cif')
 unipro_pdb = resource_filename(__name__, 'data/unipropdb.csv')
 xyz_npy = resource_filename(__name__, 'data/xyz.npy')
 example_covar = resource_filename(__name__, 'data/1l2y_covar.dat')
@@ -12,18 +12,33 @@ of a protein.
 
 Usage
 -----
-dfi_calc.py --pdb PDBFILE [--covar COVARFILE --chain CHAINID --fdfi RESNUMS]
+dfi_calc.py --pdb PDBFILE [--covar COVARFILE --chain CHAINID --fdfi RESNUMS
+            --fdfifile SETSFILE --ensemble --traj TRAJFILE --massweight
+            --window WINDOW --stride STRIDE --cache CACHEDIR
+            --cutoff CUTOFF --nmodes NMODES]
 
 Input
 -----
 PDBFILE:     PDBFILE
 COVARFILE:    Covariance (Inverse Hessian) Matrix in a [NxN] ascii format
+             or binary .npy/.npz/.bin/.f32/.f64 (see covario.py)
 RESNUMS:     Chain + Residues number in the pdb, e.g. A15 B21
+SETSFILE:    f-DFI residue sets, one set of RESNUMS per line
+TRAJFILE:    CA trajectory ((F,N,3) .npy or multi-model pdb) to
+             compute the covariance matrix from (see trajcovar.py)
+CACHEDIR:    directory to cache the matrices of a structure in, so that
+             it is only computed once (see dficache.py)
+CUTOFF:      distance cutoff of the Hessian in Angstrom, which is then
+             solved as a sparse matrix
+NMODES:      number of the softest modes of a low-rank covariance
 
 Output
 ------
 * Structure used for DFI: -dficolor.pdb
 * Master DFI: -dfianalysis.csv
+* f-DFI of every set in SETSFILE: -fdfisets.csv
+* With --ensemble, DFI mean and spread over all models: -ensembledfi.csv
+* With --traj and --window, %DFI of every window: -windowdfi.csv
 
 Example
 -------
@@ -32,21 +47,35 @@ Example
 ```
 """
 from __future__ import print_function, division
+import os
 import sys
 import argparse
+from collections import namedtuple
 import numpy as np
 import pandas as pd
 from scipy import linalg as LA
+from scipy import sparse as sps
 from scipy import stats
+from scipy.sparse.linalg import eigsh
+from scipy.spatial import cKDTree
 from six.moves import range
 import dfi.pdbio as pdbio
+import dfi.covario as covario
+import dfi.trajcovar as trajcovar
 import dfi.colordfi as colordfi
+import dfi.dficache as dficache
+import dfi.bulkdfi as bulkdfi
 
 
 if __name__ == "__main__" and len(sys.argv) < 2:
     print(__doc__)
     exit()
 
+# covariance kept as factor.dot(factor.T) over the softest normal modes
+LowRankCovariance = namedtuple('LowRankCovariance',
+                               ['factor', 'evals', 'truncerr'])
+DFIStack = namedtuple('DFIStack', ['dfi', 'pctdfi', 'fdfi', 'pctfdfi'])
+
 
 def getcoords(ATOMS, Verbose=False):
     """
@@ -55,7 +84,7 @@ def getcoords(ATOMS, Verbose=False):
 
     Input
     -----
-    ATOMS: ATOM object
+    ATOMS: ATOM object or AtomArray
        Object for holding ATOM entries of pdb file
     Verbose: bool:
        Flag for Verbose Output
@@ -66,20 +95,19 @@ def getcoords(ATOMS, Verbose=False):
        numpy arrays of x,y,z
 
     """
-    x = np.array(
-        [atom.x for atom in ATOMS if atom.atom_name.strip() == 'CA'],
-        dtype=float)
-    y = np.array(
-        [atom.y for atom in ATOMS if atom.atom_name.strip() == 'CA'],
-        dtype=float)
-    z = np.array(
-        [atom.z for atom in ATOMS if atom.atom_name.strip() == 'CA'],
-        dtype=float)
+    ATOMS = pdbio.AtomArray.from_atoms(ATOMS)
+    if len(ATOMS) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    ca = np.char.strip(ATOMS.atom_name) == 'CA'
+    x = np.array(ATOMS.x[ca], dtype=float)
+    y = np.array(ATOMS.y[ca], dtype=float)
+    z = np.array(ATOMS.z[ca], dtype=float)
 
     return x, y, z
 
 
-def calchessian(resnum, x, y, z, gamma, cutoff=None, Verbose=False):
+def calchessian(resnum, x, y, z, gamma, cutoff=None, Verbose=False,
+                sparse=False):
     """
     Calculates the hessian and retuns the result
 
@@ -95,85 +123,136 @@ def calchessian(resnum, x, y, z, gamma, cutoff=None, Verbose=False):
        value of cutoff when using a distance based Hessian (default None)
     Verbose: bool
        Verbose Output for debug mode (default False).
+    sparse: bool
+       Build a sparse Hessian from a neighbor list instead of the
+       dense one; requires a cutoff (default False).
 
     Output
     ------
     hess: numpy
        numpy array of the Hessian 3Nx3N shape
     """
+    if(sparse):
+        return calchessian_sparse(resnum, x, y, z, gamma, cutoff)
+
     numresthree = 3 * resnum
     hess = np.zeros((numresthree, numresthree))
 
+    # pairwise displacements, squared distances and spring constants
+    # for every (i, j) pair at once. The self pairs get r = inf so that
+    # their spring constant and all of their block terms come out as 0.
+    x_ij = x[:, None] - x[None, :]
+    y_ij = y[:, None] - y[None, :]
+    z_ij = z[:, None] - z[None, :]
+    r = x_ij * x_ij + y_ij * y_ij + z_ij * z_ij
+    np.fill_diagonal(r, np.inf)
+    sprngcnst = (gamma * gamma * gamma) / (r * r * r)
+    if(cutoff):
+        sprngcnst[np.sqrt(r) > cutoff] = 0.
+
     if(Verbose):
         print("i,j,x1,y1,z1,x2,y2,z2,x_ij,y_ij,z_ij,r,k,g,cut")
-    for i in range(resnum):
-        for j in range(resnum):
-            if i == j:
-                continue
-            x_i = x[i]
-            y_i = y[i]
-            z_i = z[i]
-            x_j = x[j]
-            y_j = y[j]
-            z_j = z[j]
-            x_ij = x_i - x_j
-            y_ij = y_i - y_j
-            z_ij = z_i - z_j
-            r = x_ij * x_ij + y_ij * y_ij + z_ij * z_ij
-            sprngcnst = (gamma * gamma * gamma) / (r * r * r)
-            if(cutoff):
-                if np.sqrt(r) > cutoff:
-                    sprngcnst = 0.
-            if(Verbose):
-                print(','.join(np.array([i, j, x_i, y_i, z_i, x_j, y_j,
-                                         z_j, x_ij, y_ij, z_ij, r,
-                                         sprngcnst, gamma, cutoff],
+        for i in range(resnum):
+            for j in range(resnum):
+                if i == j:
+                    continue
+                print(','.join(np.array([i, j, x[i], y[i], z[i], x[j], y[j],
+                                         z[j], x_ij[i, j], y_ij[i, j],
+                                         z_ij[i, j], r[i, j],
+                                         sprngcnst[i, j], gamma, cutoff],
                                         dtype=str)))
 
-            # creation of Hii
-            hess[3 * i, 3 * i] += sprngcnst * (x_ij * x_ij / r)
-            hess[3 * i + 1, 3 * i + 1] += sprngcnst * (y_ij * y_ij / r)
-            hess[3 * i + 2, 3 * i + 2] += sprngcnst * (z_ij * z_ij / r)
+    # creation of Hij, written straight into the (N,3,N,3) view of hess
+    hess4 = hess.reshape((resnum, 3, resnum, 3))
+    disp = (x_ij, y_ij, z_ij)
+    for a in range(3):
+        for b in range(a, 3):
+            hess4[:, a, :, b] = -(sprngcnst * (disp[a] * disp[b] / r))
+            if a != b:
+                hess4[:, b, :, a] = hess4[:, a, :, b]
+
+    # creation of Hii, the sum over j is accumulated in the same order
+    # as the original pair loop so the diagonal stays bit-identical
+    diag = -hess4.sum(axis=2)
+    ind = np.arange(resnum)
+    hess4[ind, :, ind, :] = diag
 
-            hess[3 * i, 3 * i + 1] += sprngcnst * (x_ij * y_ij / r)
-            hess[3 * i, 3 * i + 2] += sprngcnst * (x_ij * z_ij / r)
-            hess[3 * i + 1, 3 * i] += sprngcnst * (y_ij * x_ij / r)
+    return hess
 
-            hess[3 * i + 1, 3 * i + 2] += sprngcnst * (y_ij * z_ij / r)
-            hess[3 * i + 2, 3 * i] += sprngcnst * (x_ij * z_ij / r)
-            hess[3 * i + 2, 3 * i + 1] += sprngcnst * (y_ij * z_ij / r)
 
-            # creation of Hij
-            hess[3 * i, 3 * j] -= sprngcnst * (x_ij * x_ij / r)
-            hess[3 * i + 1, 3 * j + 1] -= sprngcnst * (y_ij * y_ij / r)
-            hess[3 * i + 2, 3 * j + 2] -= sprngcnst * (z_ij * z_ij / r)
+def calchessian_sparse(resnum, x, y, z, gamma, cutoff):
+    """
+    Calculates a cutoff based hessian in sparse 3x3 block storage.
 
-            hess[3 * i, 3 * j + 1] -= sprngcnst * (x_ij * y_ij / r)
-            hess[3 * i, 3 * j + 2] -= sprngcnst * (x_ij * z_ij / r)
-            hess[3 * i + 1, 3 * j] -= sprngcnst * (y_ij * x_ij / r)
+    The contacts are found with a KD-tree over the coordinates, so the
+    cost scales with the number of pairs within the cutoff instead of
+    with N^2, and only the non-zero 3x3 blocks are ever stored.
 
-            hess[3 * i + 1, 3 * j + 2] -= sprngcnst * (y_ij * z_ij / r)
-            hess[3 * i + 2, 3 * j] -= sprngcnst * (x_ij * z_ij / r)
-            hess[3 * i + 2, 3 * j + 1] -= sprngcnst * (y_ij * z_ij / r)
+    Input
+    ------
+    resnum: int
+       Number of residues
+    x,y,z: numpy arrays
+       Numpy array of coordinates
+    gamma: int
+       Value of spring constant
+    cutoff: float
+       value of cutoff for the distance based Hessian
 
-    return hess
+    Output
+    ------
+    hess: scipy.sparse.bsr_matrix
+       sparse Hessian of shape 3Nx3N with 3x3 blocks
+    """
+    if not(cutoff):
+        raise ValueError('A cutoff is needed for a sparse Hessian')
+
+    xyz = np.column_stack((x, y, z))
+    pairs = cKDTree(xyz).query_pairs(cutoff, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    r_ij = xyz[i] - xyz[j]
+    r = np.sum(r_ij * r_ij, axis=1)
+    sprngcnst = (gamma * gamma * gamma) / (r * r * r)
+    blocks = (sprngcnst / r)[:, None, None] * \
+        (r_ij[:, :, None] * r_ij[:, None, :])
+
+    # Hii is the sum of the blocks of every contact of i
+    diag = np.zeros((resnum, 3, 3))
+    np.add.at(diag, i, blocks)
+    np.add.at(diag, j, blocks)
+
+    ind = np.arange(resnum)
+    rows = np.concatenate((ind, i, j))
+    cols = np.concatenate((ind, j, i))
+    data = np.concatenate((diag, -blocks, -blocks))
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(resnum + 1, dtype=int)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=resnum))
+    return sps.bsr_matrix((data[order], cols[order], indptr),
+                          shape=(3 * resnum, 3 * resnum))
 
 
 def flatandwrite(matrix, outfile):
     """Flattens out a matrix to a Nx1 column and write out to a file. """
-    np.savetext(outfile, matrix.flatten())
+    np.savetxt(outfile, matrix.flatten())
 
 
 def dfianal(fname, Array=False):
-    """Calculate various dfi quantities and then output"""
+    """
+    Calculate various dfi quantities and then output
+
+    A 2-D array is taken as one profile per row and the relative,
+    percentile and z-score values are computed for every row in one
+    pass.
+    """
     if not(Array):
         with open(fname, 'r') as infile:
             dfi = np.array([x.strip('\n') for x in infile], dtype=float)
     else:
         dfi = fname
 
-    dfirel = dfi / np.mean(dfi)
-    dfizscore = stats.zscore(dfi)
+    dfirel = dfi / np.mean(dfi, axis=-1, keepdims=True)
+    dfizscore = stats.zscore(dfi, axis=-1)
     dfiperc = pctrank(dfi)
     return dfi, dfirel, dfiperc, dfizscore
 
@@ -182,6 +261,11 @@ def pctrank(dfi, inverse=False):
     """
     Calculate %rank of DFI values
 
+    The fraction of values <= (or >= when inverse) each value is its
+    max (min) rank, so the ranking is a sort instead of a comparison
+    against the whole array per element. A 2-D array is ranked row by
+    row.
+
     Input
     -----
     dfi: numpy
@@ -192,25 +276,30 @@ def pctrank(dfi, inverse=False):
     if type(dfi).__module__ != 'numpy':
         raise ValueError('Input needs to be a numpy array')
 
-    dfiperc = []
-    lendfi = float(len(dfi))
+    lendfi = float(np.shape(dfi)[-1])
+    if inverse:
+        amt = lendfi + 1 - stats.rankdata(dfi, method='min', axis=-1)
+    else:
+        amt = stats.rankdata(dfi, method='max', axis=-1)
+    return np.asarray(amt / lendfi, dtype=float)
 
-    for m in dfi:
-        if inverse:
-            amt = np.sum(dfi >= m)
-        else:
-            amt = np.sum(dfi <= m)
-        dfiperc.append(amt / lendfi)
-    return np.array(dfiperc, dtype=float)
 
+def perturbdirections():
+    """Returns the 7 normalized perturbation directions used for DFI"""
+    directions = np.vstack(([1, 0, 0], [0, 1, 0], [0, 0, 1], [
+                           1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]))
+    normL = np.linalg.norm(directions, axis=1)
+    return directions / normL[:, None]
 
-def calcperturbMat(invHrs, direct, resnum, Normalize=True):
+
+def calcperturbMat(invHrs, direct, resnum, Normalize=True, outfile=None,
+                   memlimit=None):
     """
     Caclulates perturbation matrix used for dfi calculation.
 
     Input
     -----
-    invHRS: numpy matrix
+    invHRS: numpy matrix or LowRankCovariance
        covariance matrix (3N,3N), where N is the number of residues
     direct: numpy matrix
        matrix of peturbation directions
@@ -218,6 +307,11 @@ def calcperturbMat(invHrs, direct, resnum, Normalize=True):
        number of residues in protein
     Normalize: bool
        Normalize peturbation matrix
+    outfile: str
+       build the matrix block by block in this .npy memory map
+       (default None)
+    memlimit: float
+       memory budget in MB for the blocks when using outfile
 
     Output
     ------
@@ -225,16 +319,26 @@ def calcperturbMat(invHrs, direct, resnum, Normalize=True):
        NxN peturbation matrix where N is the number of residues
 
     """
+    if(outfile):
+        return _perturbMat_tofile(invHrs, direct, resnum, outfile,
+                                  Normalize=Normalize, memlimit=memlimit)
+
     perturbMat = np.zeros((resnum, resnum))
-    for k in range(len(direct)):
-        peturbDir = direct[k, :]
-        for j in range(int(resnum)):
-            delforce = np.zeros(3 * resnum)
-            delforce[3 * j:3 * j + 3] = peturbDir
-            delXperbVex = np.dot(invHrs, delforce)
-            delXperbMat = delXperbVex.reshape((resnum, 3))
-            delRperbVec = np.sqrt(np.sum(delXperbMat * delXperbMat, axis=1))
-            perturbMat[:, j] += delRperbVec[:]
+    if isinstance(invHrs, LowRankCovariance):
+        # the response to a force on j in direction d is
+        # F.(F_j^T.d), where F_j is the 3 row block of j
+        factor = invHrs.factor.reshape((resnum, 3, -1))
+        for peturbDir in direct:
+            coeffs = np.dot(peturbDir, factor)
+            delXperbMat = np.dot(factor, coeffs.T)
+            perturbMat += np.sqrt(np.sum(delXperbMat * delXperbMat, axis=1))
+    else:
+        # a force on j only touches the j-th 3 row block, so the
+        # response is the (N,3,3) block column of j times the direction
+        blocks = invHrs.reshape((resnum, 3, resnum, 3))
+        for peturbDir in direct.astype(blocks.dtype):
+            delXperbMat = np.dot(blocks, peturbDir)
+            perturbMat += np.sqrt(np.sum(delXperbMat * delXperbMat, axis=1))
     perturbMat /= 7
 
     if(Normalize):
@@ -246,19 +350,176 @@ def calcperturbMat(invHrs, direct, resnum, Normalize=True):
     return nrmlperturbMat
 
 
+def _perturbcols(invHrs, direct, resnum, start, stop):
+    """
+    Perturbation matrix columns start:stop, summed over the directions
+    and not normalized.
+
+    The covariance is symmetric, so the block column of residue j is
+    read as its (contiguous) 3 row block.
+    """
+    if isinstance(invHrs, LowRankCovariance):
+        factor = invHrs.factor.reshape((resnum, 3, -1))
+        rows = factor[start:stop]
+        cols = np.zeros((resnum, stop - start))
+        for peturbDir in direct:
+            coeffs = np.dot(peturbDir, rows)
+            delXperbMat = np.dot(factor, coeffs.T)
+            cols += np.sqrt(np.sum(delXperbMat * delXperbMat, axis=1))
+        return cols
+
+    rows = np.asarray(invHrs[3 * start:3 * stop])
+    rows = rows.reshape((stop - start, 3, resnum, 3))
+    cols = np.zeros((stop - start, resnum))
+    for peturbDir in direct.astype(rows.dtype):
+        delXperbMat = np.tensordot(peturbDir, rows, axes=(0, 1))
+        cols += np.sqrt(np.sum(delXperbMat * delXperbMat, axis=2))
+    return cols.T
+
+
+def _perturbMat_tofile(invHrs, direct, resnum, outfile, Normalize=True,
+                       memlimit=None):
+    """
+    calcperturbMat for matrices that do not fit in memory.
+
+    The columns are computed in blocks from the covariance row slabs
+    and stored in a Fortran ordered .npy memory map, so both the reads
+    of the covariance and the writes of the perturbation matrix are
+    sequential. The normalization is a second sequential pass.
+    """
+    perturbMat = np.lib.format.open_memmap(outfile, mode='w+', dtype=float,
+                                           shape=(resnum, resnum),
+                                           fortran_order=True)
+    blocksize = _blocksize(resnum, memlimit)
+    total = 0.
+    for start in range(0, resnum, blocksize):
+        stop = min(start + blocksize, resnum)
+        cols = _perturbcols(invHrs, direct, resnum, start, stop) / 7
+        perturbMat[:, start:stop] = cols
+        total += np.sum(cols)
+
+    if(Normalize):
+        for start in range(0, resnum, blocksize):
+            perturbMat[:, start:start + blocksize] /= total
+    else:
+        print("WARNING: The perturbation matrix is not NORMALIZED")
+    perturbMat.flush()
+    return perturbMat
+
+
+def calcperturbSums(invHrs, direct, resnum, fdfires=None, blocksize=256,
+                    memlimit=None):
+    """
+    Calculates the dfi and f-dfi sums of the normalized perturbation
+    matrix without ever building the NxN matrix.
+
+    The perturbation matrix is computed blocksize columns at a time
+    and only its row sums, its total and the sums over the f-dfi
+    columns are kept, so the memory on top of the covariance is
+    O(N * blocksize).
+
+    Input
+    -----
+    invHRS: numpy matrix or LowRankCovariance
+       covariance matrix (3N,3N), where N is the number of residues
+    direct: numpy matrix
+       matrix of peturbation directions
+    resnum: int
+       number of residues in protein
+    fdfires: numpy
+       indices of the f-dfi residues (default None)
+    blocksize: int
+       number of residues per block
+    memlimit: float
+       memory budget in MB, overrides blocksize (default None)
+
+    Output
+    ------
+    dfi: numpy
+       row sums of the normalized perturbation matrix
+    fdfisum: numpy
+       sums over the f-dfi columns of the normalized perturbation
+       matrix, None without fdfires
+    """
+    dfi = np.zeros(resnum)
+    fdfisum = None
+    if fdfires is not None:
+        fdfires = np.asarray(fdfires, dtype=int)
+        fdfisum = np.zeros(resnum)
+
+    blocksize = _blocksize(resnum, memlimit, default=blocksize)
+    for start in range(0, resnum, blocksize):
+        stop = min(start + blocksize, resnum)
+        cols = _perturbcols(invHrs, direct, resnum, start, stop)
+        dfi += np.sum(cols, axis=1)
+        if fdfires is not None:
+            inblock = fdfires[(fdfires >= start) & (fdfires < stop)]
+            fdfisum += np.sum(cols[:, inblock - start], axis=1)
+
+    total = np.sum(dfi)
+    dfi /= total
+    if fdfires is not None:
+        fdfisum /= total
+    return dfi, fdfisum
+
+
+def calcperturbMat_stack(covars, direct, resnum, Normalize=True):
+    """
+    Calculates the perturbation matrices of a stack of covariance
+    matrices of the same protein at once, see calcperturbMat.
+
+    Input
+    -----
+    covars: numpy
+       (W,3N,3N) stack of covariance matrices
+    direct: numpy matrix
+       matrix of peturbation directions
+    resnum: int
+       number of residues in protein
+    Normalize: bool
+       Normalize every peturbation matrix
+
+    Output
+    ------
+    peturbMats: numpy
+       (W,N,N) peturbation matrices
+    """
+    blocks = np.asarray(covars).reshape((-1, resnum, 3, resnum, 3))
+    perturbMats = np.zeros((len(blocks), resnum, resnum))
+    for peturbDir in direct.astype(blocks.dtype):
+        delXperbMat = np.dot(blocks, peturbDir)
+        perturbMats += np.sqrt(np.sum(delXperbMat * delXperbMat, axis=2))
+    perturbMats /= 7
+
+    if(Normalize):
+        perturbMats /= np.sum(perturbMats, axis=(1, 2))[:, None, None]
+    return perturbMats
+
+
+def _stacksize(resnum, memlimit, default=16):
+    """
+    Number of covariance matrices per batch that fits in memlimit MB:
+    the covariance, the responses and the perturbation matrix come to
+    about 120*N^2 bytes per matrix.
+    """
+    if not(memlimit):
+        return default
+    return int(max(1, memlimit * 2**20 // (120 * resnum * resnum)))
+
+
 def chainresmap(ATOMS, Verbose=False):
     """
     Returns a dict object with the chainResNum as the key and the index
     of the atom
     """
-    table = {}
-    for i in range(len(ATOMS)):
-        if ATOMS[i].chainID == ' ':
-            entry = ATOMS[i].res_index
-        else:
-            # str(ATOMS[i].res_index)
-            entry = ATOMS[i].chainID + ATOMS[i].res_index
-        table[entry] = i
+    ATOMS = pdbio.AtomArray.from_atoms(ATOMS)
+    if len(ATOMS) == 0:
+        return {}
+    res_index = ATOMS.res_index.astype(str)
+    entries = np.where(ATOMS.chainID == ' ', res_index,
+                       np.char.add(ATOMS.chainID.astype(str), res_index))
+    # later atoms win for repeated entries
+    table = dict(zip(entries.tolist(), range(len(entries))))
     if(Verbose):
         print(table)
     return table
@@ -323,7 +584,7 @@ def outputToDF(ATOMS, dfi, pctdfi, fdfi=None, pctfdfi=None, ls_ravg=None,
 
     Input
     -----
-    ATOMS: ATOM object
+    ATOMS: ATOM object or AtomArray
        Object to hold ATOM entries of PDB files
     dfi: numpy
        numpy array of dfi values
@@ -374,12 +635,13 @@ def outputToDF(ATOMS, dfi, pctdfi, fdfi=None, pctfdfi=None, ls_ravg=None,
               'TYR': 'Y',
               'VAL': 'V',
               'MSE': 'M'}
+    ATOMS = pdbio.AtomArray.from_atoms(ATOMS)
     dfx = pd.DataFrame()
-    dfx['ResI'] = [ATOMS[i].res_index.strip(' ') for i in range(len(ATOMS))]
+    dfx['ResI'] = np.char.strip(ATOMS.res_index.astype(str)).tolist()
     dfx['dfi'] = dfi
     dfx['pctdfi'] = pctdfi
-    dfx['ChainID'] = [ATOMS[i].chainID for i in range(len(ATOMS))]
-    dfx['Res'] = [ATOMS[i].res_name for i in range(len(ATOMS))]
+    dfx['ChainID'] = ATOMS.chainID.tolist()
+    dfx['Res'] = ATOMS.res_name.tolist()
     dfx['R'] = dfx['Res'].map(mapres)
 
     if type(fdfi).__module__ == 'numpy':
@@ -435,22 +697,75 @@ def check_args(args=None):
        list of chain to select (Depracated)
 
     """
+    results = _argparser().parse_args(args)
+    pdbid = results.pdb.split('.')[0]
+    return results.pdb, pdbid, results.covar, results.fdfi, results.chain
+
+
+def _argparser():
+    """Returns the argument parser of the DFI CLI"""
     parser = argparse.ArgumentParser(
         description='DFI CLI')
     parser.add_argument('--pdb',
                         help='PDB File to run DFI',
                         required=True)
     parser.add_argument('--covar',
-                        help='3Nx3N covariance matrix')
+                        help='3Nx3N covariance matrix (ascii, .npy, .npz, '
+                        '.bin, .f32 or .f64)')
     parser.add_argument('--chain',
                         help='port of the web server')
     parser.add_argument('--fdfi',
                         help='f-DFI residues',
                         nargs='+')
+    parser.add_argument('--fdfifile',
+                        help='file of f-DFI residue sets, one set per line')
+    parser.add_argument('--ensemble',
+                        help='DFI mean and spread over all NMR models',
+                        action='store_true')
+    parser.add_argument('--traj',
+                        help='trajectory ((F,N,3) .npy coordinates or '
+                        'multi-model pdb) to take the covariance matrix from')
+    parser.add_argument('--massweight',
+                        help='mass weight the covariance of --traj with '
+                        'the residue masses',
+                        action='store_true')
+    parser.add_argument('--window',
+                        help='DFI of every window of WINDOW frames of --traj',
+                        type=int)
+    parser.add_argument('--stride',
+                        help='frames between the starts of windows',
+                        type=int)
+    parser.add_argument('--cache',
+                        help='cache directory of the covariance and '
+                        'perturbation matrices')
+    parser.add_argument('--cutoff',
+                        help='distance cutoff of the Hessian',
+                        type=float)
+    parser.add_argument('--nmodes',
+                        help='low-rank covariance of the NMODES softest '
+                        'modes',
+                        type=int)
+    return parser
+
+
+def read_fdfisets(fname):
+    """
+    Reads in f-dfi residue sets, one set per line with the residues
+    separated by spaces or commas (e.g., A19 A20). Empty lines and lines
+    starting with # are skipped.
 
-    results = parser.parse_args(args)
-    pdbid = results.pdb.split('.')[0]
-    return results.pdb, pdbid, results.covar, results.fdfi, results.chain
+    Output
+    ------
+    fdfisets: ls
+       list of lists of f-dfi residues
+    """
+    fdfisets = []
+    with open(fname, 'r') as infile:
+        for line in infile:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fdfisets.append(line.replace(',', ' ').split())
+    return fdfisets
 
 
 def _writeout_eigevalues(e_vals, eigenfile):
@@ -468,13 +783,62 @@ def _writeout_eigevalues(e_vals, eigenfile):
             outfile.write("%d\t%f\n" % (i, np.real(val)))
 
 
+def _blocksize(resnum, memlimit, default=256):
+    """
+    Number of residues per block of perturbation columns that fits in
+    memlimit MB: a 3 row covariance slab, the responses and the columns
+    come to about 160*N bytes per residue.
+    """
+    if not(memlimit):
+        return default
+    return int(max(1, memlimit * 2**20 // (160 * resnum)))
+
+
+def _tilesize(ncoords, memlimit, default=256):
+    """
+    Number of covariance rows per tile that fits in memlimit MB: the
+    scaled rows of V and the rows of the product come to about
+    16*3N bytes per row.
+    """
+    if not(memlimit):
+        return default
+    return int(max(1, memlimit * 2**20 // (16 * ncoords)))
+
+
+def _covariance_tofile(outfile, V, scale, memlimit):
+    """
+    Writes V.diag(scale).V^T (or V.V^T when scale is None) to a .npy
+    memory map, one block of rows at a time from the top so that the
+    file is written sequentially. Only the tiles are bounded by
+    memlimit, V itself is held in memory.
+    """
+    ncoords = len(V)
+    invHrs = np.lib.format.open_memmap(outfile, mode='w+', dtype=float,
+                                       shape=(ncoords, ncoords))
+    tile = _tilesize(ncoords, memlimit)
+    for start in range(0, ncoords, tile):
+        rows = V[start:start + tile]
+        if scale is not None:
+            rows = rows * scale
+        invHrs[start:start + tile] = np.dot(rows, V.T)
+    invHrs.flush()
+    return invHrs
+
+
 def calc_covariance(numres, x, y, z, invhessfile=None, Verbose=False,
-                    eigenfile=None):
+                    eigenfile=None, cutoff=None, check=False, nmodes=None,
+                    outfile=None, memlimit=None, sparse=None):
     """
     Calculates the covariance matrix by first
     calculating the hessian from coordinates and then
     inverting it.
 
+    The Hessian is symmetric, so the pseudo-inverse is built from its
+    eigendecomposition (eigh) with a single matrix product, skipping
+    the near-zero eigenvalues of the six rigid-body modes. A cutoff
+    Hessian is solved as a sparse matrix instead, see
+    calc_covariance_sparse.
+
     Input
     -----
     numres: int
@@ -484,6 +848,28 @@ def calc_covariance(numres, x, y, z, invhessfile=None, Verbose=False,
     Verbose: bool
        flag for debugging and writing out contents
        of covariance or the inverse Hessian
+    cutoff: float
+       distance cutoff for the Hessian (default None)
+    check: bool
+       verify the pseudo-inverse (H.invH.H = H) on a random probe
+       vector, which only costs a few mat-vecs (default False)
+    nmodes: int
+       only keep the nmodes softest non-trivial modes and return a
+       LowRankCovariance instead of the dense matrix (default None)
+    outfile: str
+       write the covariance to this .npy file in row tiles and return
+       it as a memory map; with nmodes the dense covariance is
+       expanded from the low-rank factor (default None). Without
+       nmodes the Hessian and its eigenvectors, two dense 3Nx3N
+       matrices, are still held in memory for the eigendecomposition,
+       so only nmodes keeps a covariance larger than memory out of it.
+    memlimit: float
+       memory budget in MB for the tiles written to outfile (default
+       tiles of 256 rows)
+    sparse: bool
+       solve the cutoff Hessian as a sparse matrix (default when a
+       cutoff is given, unless Verbose dumps the eigendecomposition or
+       the covariance goes to outfile)
 
     Output
     ------
@@ -492,29 +878,47 @@ def calc_covariance(numres, x, y, z, invhessfile=None, Verbose=False,
 
     """
     gamma = 100
-    hess = calchessian(numres, x, y, z, gamma, Verbose)
+    if(nmodes):
+        lowrank = calc_covariance_lowrank(numres, x, y, z, nmodes,
+                                          cutoff=cutoff, Verbose=Verbose)
+        if(outfile):
+            return _covariance_tofile(outfile, lowrank.factor, None,
+                                      memlimit)
+        return lowrank
+    if sparse is None:
+        sparse = bool(cutoff) and not(Verbose or outfile)
+    if(sparse):
+        return calc_covariance_sparse(numres, x, y, z, cutoff, check=check)
+    hess = calchessian(numres, x, y, z, gamma, cutoff=cutoff, Verbose=Verbose)
     if(Verbose):
         print("Hessian")
         print(hess)
         flatandwrite(hess, 'hesspy.debug')
-        e_vals, e_vecs = LA.eig(hess)
-        _writeout_eigevalues(e_vals, eigenfile)
 
-    U, w, Vt = LA.svd(hess, full_matrices=False)
-    S = LA.diagsvd(w, len(w), len(w))
-    assert np.allclose(hess, np.dot(U, np.dot(S, Vt))), "SVD didn't go well"
+    # the hessian is only needed again for the check, otherwise
+    # LAPACK can work in its memory
+    w, V = LA.eigh(hess, overwrite_a=not(check or Verbose),
+                   check_finite=False)
     if(Verbose):
-        flatandwrite(U, 'Upy-test.debug')
+        _writeout_eigevalues(w, eigenfile)
+        flatandwrite(V, 'Vpy-test.debug')
         flatandwrite(w, 'wpy-test.debug')
-        flatandwrite(Vt, 'Vtpy-test.debug')
 
     # the near zero eigenvalues blowup the inversion so
     # we will truncate them and add a small amount of bias
     tol = 1e-6
-    singular = w < tol
-    invw = 1 / w
-    invw[singular] = 0.
-    invHrs = np.dot(np.dot(U, np.diag(invw)), Vt)
+    singular = np.abs(w) < tol
+    invw = np.zeros_like(w)
+    invw[~singular] = 1 / w[~singular]
+    if(outfile):
+        invHrs = _covariance_tofile(outfile, V, invw, memlimit)
+    else:
+        invHrs = np.dot(V * invw, V.T)
+    if(check):
+        probe = np.random.RandomState(0).standard_normal(len(w))
+        hprobe = np.dot(hess, probe)
+        assert np.allclose(np.dot(hess, np.dot(invHrs, hprobe)), hprobe), \
+            "Eigendecomposition didn't go well"
     if(Verbose):
         flatandwrite(invHrs, invhessfile)
     assert np.sum(
@@ -522,19 +926,627 @@ def calc_covariance(numres, x, y, z, invhessfile=None, Verbose=False,
     return invHrs
 
 
+def _rigidmodes(x, y, z):
+    """(3N,6) orthonormal basis of the rigid-body translations and rotations"""
+    xyz = np.column_stack((x, y, z))
+    xyz = xyz - xyz.mean(axis=0)
+    modes = np.zeros((len(xyz), 3, 6))
+    for a in range(3):
+        modes[:, a, a] = 1.
+        modes[:, :, 3 + a] = np.cross(np.eye(3)[a], xyz)
+    return np.linalg.qr(modes.reshape((-1, 6)))[0]
+
+
+def calc_covariance_sparse(numres, x, y, z, cutoff, check=False):
+    """
+    Calculates the covariance matrix of a cutoff Hessian without an
+    eigendecomposition.
+
+    The Hessian is built from a neighbor list (calchessian_sparse). Six
+    coordinates that pin the rigid-body modes N are held fixed, so the
+    rest of the Hessian is positive definite and its inverse from a
+    Cholesky factorization (LAPACK potrf and potri, about a ninth of
+    the flops of eigh with eigenvectors) is a generalized inverse G of
+    the Hessian (H.G.H = H). Projecting the rigid-body modes out of it,
+    (I - N.N^T).G.(I - N.N^T), gives the same pseudo-inverse as the
+    dense eigendecomposition.
+
+    Input
+    -----
+    numres: int
+       number of residues
+    x,y,z: numpy
+       numpy array of coordinates
+    cutoff: float
+       distance cutoff for the Hessian
+    check: bool
+       verify the pseudo-inverse (H.invH.H = H) on a random probe
+       vector (default False)
+
+    Output
+    ------
+    invHRS: numpy
+       (3*numres,3*numres) matrix
+    """
+    gamma = 100
+    numcoords = 3 * numres
+    hess = calchessian_sparse(numres, x, y, z, gamma, cutoff).tocsr()
+    rigid = _rigidmodes(x, y, z)
+    pinned = LA.qr(rigid.T, mode='r', pivoting=True)[1][:6]
+    free = np.setdiff1d(np.arange(numcoords), pinned)
+
+    chol, info = LA.lapack.dpotrf(hess[free][:, free].toarray(),
+                                  lower=True, overwrite_a=True)
+    if info == 0:
+        invfree, info = LA.lapack.dpotri(chol, lower=True, overwrite_c=True)
+    if info != 0:
+        raise ValueError('the Hessian of cutoff %g has more than 6 zero '
+                         'modes' % cutoff)
+    del chol
+    invHrs = np.zeros((numcoords, numcoords))
+    invfree = np.tril(invfree)
+    invfree += np.tril(invfree, -1).T
+    invHrs[np.ix_(free, free)] = invfree
+    del invfree
+
+    # (I - NN^T)G(I - NN^T) = G - MN^T - NM^T, M = GN - N(N^T.G.N)/2
+    GN = np.dot(invHrs, rigid)
+    M = GN - 0.5 * np.dot(rigid, np.dot(rigid.T, GN))
+    invHrs -= np.dot(M, rigid.T)
+    invHrs -= np.dot(rigid, M.T)
+    if(check):
+        probe = np.random.RandomState(0).standard_normal(numcoords)
+        hprobe = hess.dot(probe)
+        assert np.allclose(hess.dot(np.dot(invHrs, hprobe)), hprobe), \
+            "Cholesky inverse didn't go well"
+    return invHrs
+
+
+def calc_covariance_lowrank(numres, x, y, z, nmodes, cutoff=None,
+                            Verbose=False):
+    """
+    Calculates a low-rank covariance matrix from the softest normal modes.
+
+    The nmodes lowest non-trivial eigenpairs of the Hessian are found
+    with ARPACK in shift-invert mode, which only needs a sparse
+    factorization of the Hessian when a cutoff is given. One extra mode
+    is computed to report the truncation error.
+
+    Input
+    -----
+    numres: int
+       number of residues
+    x,y,z: numpy
+       numpy array of coordinates
+    nmodes: int
+       number of non-trivial modes to keep
+    cutoff: float
+       distance cutoff for the Hessian, switches to a sparse
+       Hessian (default None)
+    Verbose: bool
+       flag for debugging
+
+    Output
+    ------
+    lowrank: LowRankCovariance
+       factor: (3*numres,nmodes) matrix F with invHrs ~ F.F^T
+       evals: the nmodes kept eigenvalues
+       truncerr: relative spectral norm error of the truncation,
+          evals[0] / (first dropped eigenvalue)
+    """
+    gamma = 100
+    numtrivial = 6
+    nev = nmodes + numtrivial + 1
+    if nev >= 3 * numres:
+        raise ValueError('nmodes=%d is too large for %d residues' %
+                         (nmodes, numres))
+    hess = calchessian(numres, x, y, z, gamma, cutoff=cutoff,
+                       sparse=bool(cutoff))
+    if sps.issparse(hess):
+        hess = hess.tocsc()
+
+    # shift slightly below zero so that H - sigma*I stays positive
+    # definite, the rigid-body modes then come out first
+    sigma = -1e-4 * np.mean(hess.diagonal())
+    w, V = eigsh(hess, k=nev, sigma=sigma, which='LM')
+    order = np.argsort(w)
+    w, V = w[order], V[:, order]
+
+    tol = 1e-6
+    singular = np.abs(w) < tol
+    assert np.sum(singular) == numtrivial, \
+        "# of near-singular eigenvals: %f" % np.sum(singular)
+    w, V = w[~singular], V[:, ~singular]
+    truncerr = w[0] / w[nmodes]
+    if(Verbose):
+        print("Kept %d modes, truncation error %e" % (nmodes, truncerr))
+    return LowRankCovariance(V[:, :nmodes] / np.sqrt(w[:nmodes]),
+                             w[:nmodes], truncerr)
+
+
+class DFIModel(object):
+    """
+    DFI Model
+    =========
+
+    Holds the normalized perturbation matrix, the chainresmap table and
+    the coordinates of a structure after one calculation, so that f-dfi
+    queries for any number of residue sets are column reductions of the
+    same matrix instead of new calculations.
+
+    Input
+    -----
+    ATOMS: ATOM object or AtomArray
+       CA atoms of the structure
+    invHrs: numpy or LowRankCovariance
+       (3N,3N) covariance matrix
+    direct: numpy
+       perturbation directions (default perturbdirections())
+    outfile, memlimit:
+       see calcperturbMat
+    perturbMat: numpy
+       perturbation matrix computed before (e.g., from a DFICache),
+       invHrs is not used then
+
+    Example
+    -------
+    ```
+    model = DFIModel.from_pdb('1l2y.pdb')
+    fdfi = model.fdfi(['A10'])
+    df_sets = model.fdfi_frame([['A10'], ['A19', 'A20']])
+    ```
+    """
+
+    def __init__(self, ATOMS, invHrs, direct=None, outfile=None,
+                 memlimit=None, perturbMat=None):
+        if direct is None:
+            direct = perturbdirections()
+        self.ATOMS = pdbio.AtomArray.from_atoms(ATOMS)
+        self.x, self.y, self.z = getcoords(ATOMS)
+        self.numres = len(ATOMS)
+        self.table = chainresmap(ATOMS)
+        if perturbMat is None:
+            perturbMat = calcperturbMat(invHrs, direct, self.numres,
+                                        outfile=outfile, memlimit=memlimit)
+        self.perturbMat = perturbMat
+        self.dfi = np.sum(self.perturbMat, axis=1)
+
+    @classmethod
+    def from_pdb(cls, pdbfile, covar=None, chain_name=None, cutoff=None,
+                 nmodes=None):
+        """
+        Builds the model from a pdb file and optionally a covariance
+        file, see calc_dfi for the inputs.
+        """
+        ATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=True, noalc=True,
+                                         chainA=False, chain_name=chain_name,
+                                         Verbose=False)
+        if covar is None:
+            x, y, z = getcoords(ATOMS)
+            invHrs = calc_covariance(len(ATOMS), x, y, z, cutoff=cutoff,
+                                     nmodes=nmodes)
+        else:
+            invHrs = covario.covar_reader(covar)
+        return cls(ATOMS, invHrs)
+
+    def fdfires(self, ls_reschain):
+        """Returns the sorted indices of the f-dfi residues"""
+        return np.unique(fdfiresf(sorted(set(ls_reschain)), self.table))
+
+    def _setmatrix(self, fdfisets):
+        """(N,S) sparse matrix averaging over the residues of each set"""
+        ls_ind = [self.fdfires(ls_reschain) for ls_reschain in fdfisets]
+        counts = np.array([len(ind) for ind in ls_ind])
+        if np.any(counts == 0):
+            raise ValueError('f-dfi set %d has no residues in the structure'
+                             % np.argmin(counts))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        weights = np.repeat(1. / counts, counts)
+        return sps.csc_matrix((weights, np.concatenate(ls_ind), indptr),
+                              shape=(self.numres, len(fdfisets)))
+
+    def fdfi(self, ls_reschain):
+        """
+        f-dfi profile of one set of residues (e.g., ['A19','A20'])
+        """
+        return self.fdfi_sets([ls_reschain])[0]
+
+    def fdfi_sets(self, fdfisets):
+        """
+        f-dfi profiles of many sets of residues at once
+
+        Output
+        ------
+        fdfi: numpy
+           (S,N) array, one f-dfi profile per set
+        """
+        fdfitop = self._setmatrix(fdfisets).T.dot(
+            np.asarray(self.perturbMat).T)
+        fdfibot = self.dfi / self.numres
+        return fdfitop / fdfibot
+
+    def distances(self, fdfisets):
+        """
+        Average and minimum distance of every residue to the residues
+        of each set, from one (N,n) block of distances per set of n
+        residues
+
+        Output
+        ------
+        ravg, rmin: numpy
+           (S,N) arrays
+        """
+        r = np.column_stack((self.x, self.y, self.z))
+        ravg = np.empty((len(fdfisets), self.numres))
+        rmin = np.empty((len(fdfisets), self.numres))
+        for k, ls_reschain in enumerate(fdfisets):
+            fdfires = self.fdfires(ls_reschain)
+            if len(fdfires) == 0:
+                raise ValueError('f-dfi set %d has no residues in the '
+                                 'structure' % k)
+            r_ij = fdfires_cords(fdfires, self.x, self.y, self.z)[None, :, :] \
+                - r[:, None, :]
+            dist = np.sqrt(np.sum(r_ij * r_ij, axis=2))
+            ravg[k] = dist.mean(axis=1)
+            rmin[k] = dist.min(axis=1)
+        return ravg, rmin
+
+    def fdfi_frame(self, fdfisets):
+        """
+        Tidy DataFrame of the f-dfi of every set with one row per set
+        and residue: fdfiset, ResI, ChainID, fdfi, pctfdfi, ravg, rmin
+        """
+        fdfi, relfdfi, pctfdfi, zscorefdfi = dfianal(
+            self.fdfi_sets(fdfisets), Array=True)
+        ravg, rmin = self.distances(fdfisets)
+        nsets = len(fdfisets)
+        df_sets = pd.DataFrame()
+        df_sets['fdfiset'] = np.repeat([' '.join(ls_reschain)
+                                        for ls_reschain in fdfisets],
+                                       self.numres)
+        df_sets['ResI'] = np.tile(np.char.strip(self.ATOMS.res_index), nsets)
+        df_sets['ChainID'] = np.tile(self.ATOMS.chainID, nsets)
+        df_sets['fdfi'] = fdfi.ravel()
+        df_sets['pctfdfi'] = pctfdfi.ravel()
+        df_sets['ravg'] = ravg.ravel()
+        df_sets['rmin'] = rmin.ravel()
+        return df_sets
+
+
+def _model_dfi(args):
+    """dfi profile of one model from its coordinates (pool worker)"""
+    x, y, z, cutoff, nmodes, memlimit = args
+    invHrs = calc_covariance(len(x), x, y, z, cutoff=cutoff, nmodes=nmodes)
+    dfi, fdfisum = calcperturbSums(invHrs, perturbdirections(), len(x),
+                                   memlimit=memlimit)
+    return dfi
+
+
+def calc_dfi_ensemble(pdbfile, pdbid=None, chain_name=None, cutoff=None,
+                      nmodes=None, memlimit=None, nprocs=None, blasthreads=1,
+                      writetofile=False, dfianalfile=None, Verbose=False):
+    """
+    DFI of every model of an (NMR) ensemble.
+
+    The models are read lazily in one pass over the file, must all have
+    the residues of the first model and are computed in parallel. The
+    perturbation matrix of a model is never built, only its dfi sums
+    (see calcperturbSums).
+
+    Inputs
+    ------
+    pdbfile: file
+       multi-model PDB File, or any input pdbio.openpdb takes
+    pdbid: str
+       4 character PDBID from PDB
+    chain_name: str
+       chain name (e.g., A) to pull out specific chain of the PDB
+    cutoff: float
+       distance cutoff for the Hessian (default None)
+    nmodes: int
+       use a low-rank covariance from the nmodes softest modes
+       (default None)
+    memlimit: float
+       memory budget in MB for the dfi sums (default None)
+    nprocs: int
+       number of processes, None for all cores and 1 to run serially
+    blasthreads: int
+       BLAS threads per process, see bulkdfi.blas_pool
+    writetofile: bool
+       If True will write out to pdbid-ensembledfi.csv
+    dfianalfile: str
+       Name of custom output file
+    Verbose: bool
+       Flag for Verbose Output
+
+    Output
+    ------
+    df_dfi: DataFrame
+       per-residue mean over the models of dfi and pctdfi (dfi and
+       pctdfi columns) and their standard deviations (dfi_std and
+       pctdfi_std)
+    """
+    if(not(pdbid)):
+        pdbid = pdbio.sourcename(pdbfile).split('.')[0]
+    if(not(dfianalfile)):
+        dfianalfile = pdbid + '-ensembledfi.csv'
+
+    ls_coords = []
+    for nmodel, ATOMS in enumerate(pdbio.pdb_models(
+            pdbfile, CAonly=True, noalc=True, chainA=False,
+            chain_name=chain_name)):
+        if nmodel == 0:
+            REFATOMS = ATOMS
+        elif not(np.array_equal(ATOMS.chainID, REFATOMS.chainID) and
+                 np.array_equal(ATOMS.res_index, REFATOMS.res_index)):
+            raise ValueError('Model %d does not have the residues of model 1'
+                             % (nmodel + 1))
+        x, y, z = getcoords(ATOMS)
+        ls_coords.append((x, y, z, cutoff, nmodes, memlimit))
+    if(Verbose):
+        print("Read %d models from %s" % (len(ls_coords), pdbfile))
+
+    if nprocs == 1:
+        ls_dfi = [_model_dfi(coords) for coords in ls_coords]
+    else:
+        pool = bulkdfi.blas_pool(nprocs, blasthreads)
+        try:
+            ls_dfi = pool.map(_model_dfi, ls_coords)
+        finally:
+            pool.close()
+            pool.join()
+
+    dfi, reldfi, pctdfi, zscoredfi = dfianal(np.array(ls_dfi), Array=True)
+    df_dfi = outputToDF(REFATOMS, dfi.mean(axis=0), pctdfi.mean(axis=0))
+    df_dfi['dfi_std'] = dfi.std(axis=0)
+    df_dfi['pctdfi_std'] = pctdfi.std(axis=0)
+    df_dfi['nmodels'] = len(ls_dfi)
+    if(writetofile):
+        df_dfi.to_csv(dfianalfile, index=False)
+        print("Wrote out to %s" % (dfianalfile))
+    return df_dfi
+
+
+def calc_dfi_windows(pdbfile, traj, window, stride=None, pdbid=None,
+                     chain_name=None, massweight=False, param='pctdfi',
+                     chunksize=100, writetofile=False, dfianalfile=None,
+                     Verbose=False):
+    """
+    Time resolved DFI: the DFI profile of every window of a trajectory.
+
+    The covariance of each window is updated from the one before by
+    taking out the frames that leave and adding the ones that enter,
+    see trajcovar.sliding_covariances.
+
+    Inputs
+    ------
+    pdbfile: file
+       PDB File of the CA atoms of the trajectory
+    traj: str or numpy
+       trajectory ((F,N,3) .npy coordinates or multi-model pdb), see
+       trajcovar.read_frames
+    window: int
+       number of frames per window
+    stride: int
+       number of frames between the starts of windows (default window)
+    pdbid: str
+       4 character PDBID from PDB
+    chain_name: str
+       chain name (e.g., A) to pull out specific chain of the PDB
+    massweight: bool or numpy
+       mass weight the covariance with the residue masses, or with
+       the given mass of every residue (see trajcovar.weightmasses)
+    param: str
+       'dfi' or 'pctdfi' (default) of the windows to output
+    chunksize: int
+       number of frames read at a time
+    writetofile: bool
+       If True will write out to pdbid-windowdfi.csv
+    dfianalfile: str
+       Name of custom output file
+    Verbose: bool
+       Flag for Verbose Output
+
+    Output
+    ------
+    df_dfi: DataFrame
+       one row per residue with its ResI, ChainID, Res and R and a
+       column param_start per window, start being the window's first
+       frame
+    """
+    if(not(pdbid)):
+        pdbid = pdbio.sourcename(pdbfile).split('.')[0]
+    if(not(dfianalfile)):
+        dfianalfile = pdbid + '-windowdfi.csv'
+
+    ATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=True, noalc=True,
+                                     chainA=False, chain_name=chain_name,
+                                     Verbose=False)
+    x, y, z = getcoords(ATOMS)
+    numres = len(ATOMS)
+    masses = trajcovar.weightmasses(ATOMS, massweight)
+    direct = perturbdirections()
+
+    ls_start = []
+    ls_dfi = []
+    for start, covar in trajcovar.sliding_covariances(
+            traj, window, stride=stride,
+            reference=np.column_stack((x, y, z)), masses=masses,
+            chunksize=chunksize):
+        if covar.shape != (3 * numres, 3 * numres):
+            raise ValueError('trajectory does not have the %d residues of '
+                             'the pdb' % numres)
+        dfi, fdfisum = calcperturbSums(covar, direct, numres)
+        ls_start.append(start)
+        ls_dfi.append(dfi)
+    if not(ls_dfi):
+        raise ValueError('trajectory is shorter than a window of %d frames'
+                         % window)
+    if(Verbose):
+        print("Computed DFI of %d windows" % len(ls_dfi))
+
+    dfi, reldfi, pctdfi, zscoredfi = dfianal(np.array(ls_dfi), Array=True)
+    values = {'dfi': dfi, 'pctdfi': pctdfi}[param]
+    df_dfi = outputToDF(ATOMS, dfi[0], pctdfi[0])[['ResI', 'ChainID', 'Res',
+                                                   'R']]
+    df_windows = pd.DataFrame(values.T, columns=['%s_%d' % (param, start)
+                                                 for start in ls_start])
+    df_dfi = pd.concat([df_dfi, df_windows], axis=1)
+    if(writetofile):
+        df_dfi.to_csv(dfianalfile, index=False)
+        print("Wrote out to %s" % (dfianalfile))
+    return df_dfi
+
+
+def stack_frame(ATOMS, stack, labels=None):
+    """
+    Tidy DataFrame of a DFIStack, one row per window and residue.
+
+    Input
+    -----
+    ATOMS: AtomArray or ls
+       CA atoms of the protein
+    stack: DFIStack
+       dfi profiles of the windows, see calc_dfi_stack
+    labels: ls
+       name of every window (default its index)
+
+    Output
+    ------
+    df_dfi: DataFrame
+       columns window, ResI, ChainID, Res, R, dfi and pctdfi, and fdfi
+       and pctfdfi with f-dfi residues
+    """
+    nwindows, numres = stack.dfi.shape
+    if labels is None:
+        labels = np.arange(nwindows)
+    df_res = outputToDF(ATOMS, stack.dfi[0], stack.pctdfi[0])
+    df_dfi = pd.DataFrame({'window': np.repeat(np.asarray(labels), numres)})
+    for column in ['ResI', 'ChainID', 'Res', 'R']:
+        df_dfi[column] = np.tile(df_res[column].values, nwindows)
+    for column in DFIStack._fields:
+        values = getattr(stack, column)
+        if values is not None:
+            df_dfi[column] = values.ravel()
+    return df_dfi
+
+
+def calc_dfi_stack(pdbfile, covars, ls_reschain=[], chain_name=None,
+                   pdbid=None, labels=None, writetofile=False,
+                   dfianalfile=None, memlimit=None):
+    """
+    DFI and f-DFI of many covariance matrices of the same protein (e.g.,
+    the time windows of an MD simulation). The pdb is read once and the
+    matrices are worked on in batches with one stacked product per
+    perturbation direction.
+
+    Inputs
+    ------
+    pdbfile: file
+       PDB File for dfi calculation
+    covars: numpy or ls
+       (W,3N,3N) stack of covariance matrices, or a list of covariance
+       files or arrays (see covario.covar_reader) that are read a
+       batch at a time
+    ls_reschain: ls
+       list of f-dfi residues by chain and index (e.g., ['A19','A20']
+    chain_name: str
+       chain name (e.g., A) to pull out specific chain of the PDB
+    pdbid: str
+       4 character PDBID from PDB
+    labels: ls
+       name of every window in the output (default its index)
+    writetofile: bool
+       If True will write the tidy output (see stack_frame) to
+       pdbid-stackdfi.csv
+    dfianalfile: str
+       Name of custom output file
+    memlimit: float
+       memory budget in MB for a batch of matrices (default None)
+
+    Output
+    ------
+    stack: DFIStack
+       (W,N) arrays of dfi, pctdfi, fdfi and pctfdfi; the f-dfi ones
+       are None without ls_reschain
+    """
+    if(not(pdbid)):
+        pdbid = pdbio.sourcename(pdbfile).split('.')[0]
+    if(not(dfianalfile)):
+        dfianalfile = pdbid + '-stackdfi.csv'
+
+    ATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=True, noalc=True,
+                                     chainA=False, chain_name=chain_name,
+                                     Verbose=False)
+    numres = len(ATOMS)
+    direct = perturbdirections()
+    fdfires = None
+    if ls_reschain:
+        fdfires = np.sort(fdfiresf(sorted(set(ls_reschain)),
+                                   chainresmap(ATOMS)))
+
+    batchsize = _stacksize(numres, memlimit)
+    ls_dfi = []
+    ls_fdfi = []
+    for start in range(0, len(covars), batchsize):
+        batch = covars[start:start + batchsize]
+        if not isinstance(batch, np.ndarray):
+            batch = np.array([covario.covar_reader(covar)
+                              for covar in batch])
+        if batch.shape[1:] != (3 * numres, 3 * numres):
+            raise ValueError('covariance matrices are not %dx%d' %
+                             (3 * numres, 3 * numres))
+        perturbMats = calcperturbMat_stack(batch, direct, numres)
+        dfi = np.sum(perturbMats, axis=2)
+        ls_dfi.append(dfi)
+        if fdfires is not None:
+            fdfitop = np.sum(perturbMats[:, :, fdfires], axis=2) / \
+                len(fdfires)
+            ls_fdfi.append(fdfitop / (dfi / numres))
+
+    dfi, reldfi, pctdfi, zscoredfi = dfianal(np.concatenate(ls_dfi),
+                                             Array=True)
+    fdfi = pctfdfi = None
+    if fdfires is not None:
+        fdfi, relfdfi, pctfdfi, zscorefdfi = dfianal(
+            np.concatenate(ls_fdfi), Array=True)
+    stack = DFIStack(dfi, pctdfi, fdfi, pctfdfi)
+
+    if(writetofile):
+        stack_frame(ATOMS, stack, labels=labels).to_csv(dfianalfile,
+                                                        index=False)
+        print("Wrote out to %s" % (dfianalfile))
+    return stack
+
+
+def _unsupported(mode, **options):
+    """Raises a ValueError naming the options set that mode ignores"""
+    given = sorted(name for name, value in options.items()
+                   if not(value is None or value is False or
+                          (isinstance(value, list) and not(value))))
+    if given:
+        raise ValueError('%s does not support %s' % (mode, ', '.join(given)))
+
+
 def calc_dfi(pdbfile, pdbid=None, covar=None, ls_reschain=[], chain_name=None,
              Verbose=False, writetofile=False, colorpdb=False,
-             dfianalfile=None):
+             dfianalfile=None, cutoff=None, nmodes=None, lowmem=False,
+             scratchdir=None, memlimit=None, fdfisets=None, ensemble=False,
+             nprocs=None, traj=None, massweight=False, window=None,
+             stride=None, cache=None, return_sets=False):
     """Main function for calculating DFI
 
     Inputs
     ------
     pdbfile: file
-       PDB File for dfi calculation
+       PDB File for dfi calculation; gzip, bz2 or xz compressed
+       files, bytes and file-like objects are read as streams
     pdbid: str
        4 character PDBID from PDB
-    covar: file
-       hessian file obtained from MD
+    covar: file or numpy
+       hessian file obtained from MD, ascii or binary (.npy, .npz,
+       .bin, .f32, .f64); binary files are memory mapped. An array is
+       used as is.
     ls_reschain: ls
        list of f-dfi residues by chain and index (e.g., ['A19','A20']
     chain_name: str
@@ -549,52 +1561,187 @@ def calc_dfi(pdbfile, pdbid=None, covar=None, ls_reschain=[], chain_name=None,
        Name of custom output file. This is useful for when you may
        want to number outputs using different covariance matrices
        that correspond to different time windows.
+    cutoff: float
+       distance cutoff for the Hessian (default None)
+    nmodes: int
+       use a low-rank covariance from the nmodes softest modes
+       instead of the full pseudo-inverse (default None)
+    lowmem: bool
+       only reduce the perturbation matrix to the dfi and f-dfi sums
+       block by block instead of building it (default False)
+    scratchdir: str
+       keep the covariance and perturbation matrices in .npy memory
+       maps in this directory instead of in memory (default None);
+       the dense eigendecomposition still needs memory for two 3Nx3N
+       matrices, use nmodes beyond that (see calc_covariance)
+    memlimit: float
+       memory budget in MB for the tiles of the out-of-core and
+       lowmem modes (default None)
+    fdfisets: ls
+       list of f-dfi residue sets (e.g., [['A10'], ['A19','A20']])
+       that are all scored from the same perturbation matrix and
+       written to pdbid-fdfisets.csv, see DFIModel.fdfi_frame and
+       return_sets
+    ensemble: bool
+       compute DFI for every model of the pdb in parallel and report
+       the per-residue mean and spread, see calc_dfi_ensemble; takes
+       cutoff, nmodes and memlimit, the options of a single structure
+       (covar, ls_reschain, fdfisets, traj, cache, scratchdir and
+       colorpdb) raise a ValueError
+    nprocs: int
+       number of processes for the ensemble mode
+    traj: str or numpy
+       trajectory of the CA atoms ((F,N,3) .npy coordinates or
+       multi-model pdb) whose covariance is used instead of covar,
+       computed in one pass, see trajcovar.traj_covariance
+    massweight: bool or numpy
+       mass weight the covariance of traj with the residue masses, or
+       with the given mass of every residue
+    window: int
+       with traj, compute the DFI of every window of window frames
+       instead, see calc_dfi_windows; the options of a single
+       covariance (covar, ls_reschain, fdfisets, cutoff, nmodes,
+       cache, scratchdir and colorpdb) raise a ValueError
+    stride: int
+       number of frames between the starts of windows
+    cache: str or DFICache
+       cache directory of the covariance and perturbation matrices
+       computed from the coordinates; a structure seen before is
+       memory mapped from it, see dficache
+    return_sets: bool
+       with fdfisets, also return the DataFrame of the f-dfi of every
+       set (default False)
 
     Output
     ------
     df_dfi: DataFrame
-       DataFrame object for DFI values
+       DataFrame object for DFI values, or (df_dfi, df_sets) with
+       return_sets
     """
     if(not(pdbid)):
-        pdbid = pdbfile.split('.')[0]
+        pdbid = pdbio.sourcename(pdbfile).split('.')[0]
     eigenfile = pdbid + '-eigenvalues.txt'
     invhessfile = pdbid + '-pinv_svd.debug'
+
+    if(ensemble):
+        _unsupported('ensemble', covar=covar, ls_reschain=ls_reschain,
+                     fdfisets=fdfisets, return_sets=return_sets,
+                     traj=traj, cache=cache,
+                     scratchdir=scratchdir, colorpdb=colorpdb)
+        df_dfi = calc_dfi_ensemble(pdbfile, pdbid=pdbid,
+                                   chain_name=chain_name, cutoff=cutoff,
+                                   nmodes=nmodes, memlimit=memlimit,
+                                   nprocs=nprocs, writetofile=writetofile,
+                                   dfianalfile=dfianalfile, Verbose=Verbose)
+        if not(writetofile):
+            return df_dfi
+        return
+
+    if traj is not None and window:
+        _unsupported('window', covar=covar, ls_reschain=ls_reschain,
+                     fdfisets=fdfisets, return_sets=return_sets,
+                     cutoff=cutoff, nmodes=nmodes,
+                     cache=cache, scratchdir=scratchdir, colorpdb=colorpdb)
+        df_dfi = calc_dfi_windows(pdbfile, traj, window, stride=stride,
+                                  pdbid=pdbid, chain_name=chain_name,
+                                  massweight=massweight,
+                                  writetofile=writetofile,
+                                  dfianalfile=dfianalfile, Verbose=Verbose)
+        if not(writetofile):
+            return df_dfi
+        return
+
     if(not(dfianalfile)):
         dfianalfile = pdbid + '-dfianalysis.csv'
+    if return_sets and not(fdfisets):
+        raise ValueError('return_sets needs fdfisets')
+    if fdfisets and lowmem:
+        raise ValueError('fdfisets need the perturbation matrix, '
+                         'it is not built with lowmem')
 
-    # read in the pdb file
-    ATOMS = pdbio.pdb_reader(pdbfile, CAonly=True, noalc=True, chainA=False,
-                             chain_name=chain_name, Verbose=False)
+    # read in the pdb file, all of it once when it is colored as well
+    if(colorpdb):
+        ALLATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=False,
+                                            noalc=True, chainA=False,
+                                            chain_name=chain_name,
+                                            Verbose=False)
+        ATOMS = ALLATOMS[np.char.strip(ALLATOMS.atom_name) == 'CA']
+    else:
+        ATOMS = pdbio.pdb_reader_columns(pdbfile, CAonly=True, noalc=True,
+                                         chainA=False, chain_name=chain_name,
+                                         Verbose=False)
     x, y, z = getcoords(ATOMS)
     numres = len(ATOMS)
 
+    covarfile = perturbfile = None
+    if(scratchdir):
+        scratchbase = os.path.join(scratchdir, os.path.basename(pdbid))
+        covarfile = scratchbase + '-covar.npy'
+        perturbfile = scratchbase + '-perturb.npy'
+
+    # matrices of a structure seen before come from the cache
+    direct = perturbdirections()
+    covarkey = perturbkey = perturbMat = None
+    if cache is not None and traj is None and covar is None:
+        if not isinstance(cache, dficache.DFICache):
+            cache = dficache.DFICache(cache)
+        covarkey = dficache.covar_key(ATOMS, chain_name=chain_name,
+                                      cutoff=cutoff, nmodes=nmodes)
+        perturbkey = dficache.perturb_key(covarkey, direct)
+        if not(lowmem):
+            perturbMat = cache.get(perturbkey)
+
     # create covariance matrix or read it in if provided
-    if not(covar):
-        invHrs = calc_covariance(numres, x, y, z, Verbose=False,
-                                 eigenfile=eigenfile,
-                                 invhessfile=invhessfile)
+    if perturbMat is not None:
+        invHrs = None
+    elif traj is not None:
+        masses = trajcovar.weightmasses(ATOMS, massweight)
+        invHrs = trajcovar.traj_covariance(
+            traj, reference=np.column_stack((x, y, z)), masses=masses)
+        if invHrs.shape != (3 * numres, 3 * numres):
+            raise ValueError('trajectory does not have the %d residues of '
+                             'the pdb' % numres)
+    elif covar is None:
+        invHrs = cache.get(covarkey) if covarkey else None
+        if invHrs is None:
+            invHrs = calc_covariance(numres, x, y, z, Verbose=False,
+                                     eigenfile=eigenfile,
+                                     invhessfile=invhessfile,
+                                     cutoff=cutoff, nmodes=nmodes,
+                                     outfile=covarfile, memlimit=memlimit)
+            # a low-rank covariance is cheap to recompute
+            if covarkey and isinstance(invHrs, np.ndarray):
+                cache.put(covarkey, invHrs)
     else:  # this is where we load the Hessian if provided
-        invHrs = np.loadtxt(covar)
+        invHrs = covario.covar_reader(covar)
 
     # RUN DFI
-    directions = np.vstack(([1, 0, 0], [0, 1, 0], [0, 0, 1], [
-                           1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]))
-    normL = np.linalg.norm(directions, axis=1)
-    direct = directions / normL[:, None]
-    nrmlperturbMat = calcperturbMat(invHrs, direct, numres)
-    dfi = np.sum(nrmlperturbMat, axis=1)
-    dfi, reldfi, pctdfi, zscoredfi = dfianal(dfi, Array=True)
-
-    # f-dfi
+    fdfires = None
     if ls_reschain:
         # find the f-dfi residues
         fdfiset = set(ls_reschain)
         ls_reschain = list(fdfiset)
         ls_reschain.sort()
         fdfires = np.sort(fdfiresf(ls_reschain, chainresmap(ATOMS)))
+
+    if(lowmem):
+        dfi, fdfisum = calcperturbSums(invHrs, direct, numres,
+                                       fdfires=fdfires, memlimit=memlimit)
+    else:
+        model = DFIModel(ATOMS, invHrs, direct=direct, outfile=perturbfile,
+                         memlimit=memlimit, perturbMat=perturbMat)
+        if perturbkey and perturbMat is None:
+            cache.put(perturbkey, model.perturbMat)
+        dfi = model.dfi
+        if fdfires is not None:
+            fdfisum = np.sum(model.perturbMat[:, fdfires], axis=1)
+    dfi, reldfi, pctdfi, zscoredfi = dfianal(dfi, Array=True)
+
+    # f-dfi
+    if ls_reschain:
         # calculate f-dfi
-        fdfitop = np.sum(nrmlperturbMat[:, fdfires], axis=1) / len(fdfires)
-        fdfibot = np.sum(nrmlperturbMat, axis=1) / len(nrmlperturbMat)
+        fdfitop = fdfisum / len(fdfires)
+        fdfibot = dfi / numres
         fdfi, relfdfi, pctfdfi, zscorefdfi = dfianal(
             fdfitop / fdfibot, Array=True)
         rlist = np.column_stack((x, y, z))  # dump into a list
@@ -613,17 +1760,25 @@ def calc_dfi(pdbfile, pdbid=None, covar=None, ls_reschain=[], chain_name=None,
         df_dfi = outputToDF(ATOMS, dfi, pctdfi,
                             outfile=dfianalfile, writetofile=writetofile)
 
+    if fdfisets:
+        df_sets = model.fdfi_frame(fdfisets)
+        if(writetofile):
+            fdfisetsfile = pdbid + '-fdfisets.csv'
+            df_sets.to_csv(fdfisetsfile, index=False)
+            print("Wrote out to %s" % (fdfisetsfile))
+
     # output to ColoredDFI Files
     if(colorpdb):
-        colordfi.colorbydfi(
-            dfianalfile, pdbfile, colorbyparam='pctdfi',
-            outfile=pdbid + '-dficolor.pdb')
-
+        colorbyparam = ['pctdfi']
+        outfiles = [pdbid + '-dficolor.pdb']
         if len(ls_reschain) > 0:
-            colordfi.colorbydfi(
-                dfianalfile, pdbfile, colorbyparam='pctfdfi',
-                outfile=pdbid + '-fdficolor.pdb')
+            colorbyparam.append('pctfdfi')
+            outfiles.append(pdbid + '-fdficolor.pdb')
+        colordfi.colorbydfi(df_dfi, ALLATOMS, colorbyparam=colorbyparam,
+                            outfile=outfiles)
 
+    if(return_sets):
+        return df_dfi, df_sets
     if not(writetofile):
         return df_dfi
 
@@ -632,6 +1787,14 @@ if __name__ == "__main__":
     pdbfile, pdbid, covar, ls_reschain, chain_name = check_args(
         sys.argv[1:])
     print("Processing %s" % pdbfile)
+    results = _argparser().parse_args(sys.argv[1:])
+    fdfisets = read_fdfisets(results.fdfifile) if results.fdfifile else None
     df_dfi = calc_dfi(pdbfile, pdbid, covar=covar, ls_reschain=ls_reschain,
-                      chain_name=chain_name,
-                      writetofile=True, colorpdb=True)
+                      chain_name=chain_name, fdfisets=fdfisets,
+                      ensemble=results.ensemble, traj=results.traj,
+                      massweight=results.massweight,
+                      window=results.window, stride=results.stride,
+                      cache=results.cache, cutoff=results.cutoff,
+                      nmodes=results.nmodes, writetofile=True,
+                      colorpdb=not(results.ensemble or
+                                   (results.traj and results.window)))
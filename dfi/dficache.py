@@ -0,0 +1,228 @@
+"""
+DFI Cache
+=========
+
+Description
+-----------
+Content addressed cache of covariance and perturbation matrices, so that
+repeated DFI calculations of the same structure become a memory mapped
+load. Entries are keyed by a sha256 hash of the CA coordinates, the
+chain selection and the model parameters and stored as .npy files.
+
+Entries are written to a temporary file and renamed into place, so
+readers never see a partial matrix and any number of processes can
+share a cache directory. The total size is bounded by evicting the
+least recently used entries, under a lock on POSIX systems.
+
+Example
+-------
+```
+cache = DFICache('dficache', maxsize=2048)
+df_dfi = calc_dfi('1l2y.pdb', cache=cache)
+```
+"""
+from __future__ import print_function
+import os
+import glob
+import hashlib
+import tempfile
+import contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks, e.g. on Windows
+    fcntl = None
+
+cache_version = 1  # bump when the stored matrices change meaning
+
+
+def _hashupdate(sha, value):
+    """Feeds an array, a string or the repr of anything else to sha"""
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        sha.update(str(value.dtype.str).encode('ascii'))
+        sha.update(str(value.shape).encode('ascii'))
+        sha.update(value.tobytes())
+    else:
+        sha.update(repr(value).encode('utf-8'))
+    sha.update(b'\0')
+
+
+def covar_key(ATOMS, chain_name=None, gamma=100, cutoff=None, nmodes=None):
+    """
+    Key of the covariance matrix of a structure.
+
+    Input
+    -----
+    ATOMS: AtomArray
+       CA atoms of the structure
+    chain_name: str
+       chain selection the atoms were read with
+    gamma: float
+       spring constant of the Hessian (see calc_covariance)
+    cutoff: float
+       distance cutoff for the Hessian
+    nmodes: int
+       number of modes of a low-rank covariance
+
+    Output
+    ------
+    key: str
+       sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    coords = np.column_stack([np.asarray(ATOMS.x, dtype=np.float64),
+                              np.asarray(ATOMS.y, dtype=np.float64),
+                              np.asarray(ATOMS.z, dtype=np.float64)])
+    for value in ('covar', cache_version, coords,
+                  list(ATOMS.chainID), list(ATOMS.res_index),
+                  chain_name, float(gamma), cutoff, nmodes):
+        _hashupdate(sha, value)
+    return sha.hexdigest()
+
+
+def perturb_key(covarkey, direct, Normalize=True):
+    """
+    Key of the perturbation matrix built from the covariance matrix of
+    covarkey with the perturbation directions direct.
+
+    Output
+    ------
+    key: str
+       sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    for value in ('perturb', cache_version, covarkey,
+                  np.asarray(direct, dtype=np.float64), bool(Normalize)):
+        _hashupdate(sha, value)
+    return sha.hexdigest()
+
+
+class DFICache(object):
+    """
+    DFI Cache
+    =========
+
+    Directory of cached matrices, one .npy file per key.
+
+    Input
+    -----
+    cachedir: str
+       directory of the cache, created if needed
+    maxsize: float
+       size bound of the cache in MB, None for no bound (default 1024)
+    """
+
+    def __init__(self, cachedir, maxsize=1024):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                if not os.path.isdir(cachedir):
+                    raise
+
+    def path(self, key):
+        """Returns the .npy file of key"""
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Exclusive lock on the cache directory across processes"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.cachedir, '.lock'), 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """
+        Memory maps the matrix of key read-only and marks it as recently
+        used. Returns None on a miss.
+        """
+        fname = self.path(key)
+        try:
+            os.utime(fname, None)
+            return np.load(fname, mmap_mode='r')
+        except (IOError, OSError):  # missing or evicted meanwhile
+            return None
+
+    def put(self, key, array):
+        """
+        Stores array under key, atomically, and evicts the least
+        recently used entries beyond maxsize.
+        """
+        fd, tmpname = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                np.lib.format.write_array(outfile, np.asanyarray(array))
+            os.replace(tmpname, self.path(key))
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Lists the entries of the cache.
+
+        Output
+        ------
+        entries: ls
+           (mtime, size, fname) of every entry, least recently used
+           first
+        """
+        entries = []
+        for fname in glob.glob(os.path.join(self.cachedir, '*.npy')):
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        entries.sort()
+        return entries
+
+    def size(self):
+        """Total size of the entries in MB"""
+        return sum(size for mtime, size, fname in self.entries()) / 1e6
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits in
+        maxsize, except for the entry of key keep.
+        """
+        if self.maxsize is None:
+            return
+        with self.lock():
+            entries = self.entries()
+            total = sum(size for mtime, size, fname in entries)
+            keepfile = self.path(keep) if keep else None
+            for mtime, size, fname in entries:
+                if total <= self.maxsize * 1e6:
+                    break
+                if fname == keepfile:
+                    continue
+                try:
+                    os.remove(fname)
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        """Removes all entries"""
+        with self.lock():
+            for mtime, size, fname in self.entries():
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
@@ -7,11 +7,196 @@ Description
 -----------
 Download pdb is suite of tools for interfacing
 with the protein data bank (PDB)
+
+Many structures are fetched at once with fetch_pdbs, over a pool of
+threads that each keep their connections to the server alive, into a
+local mirror sharded like the PDB (mirror/l2/1l2y.pdb). Structures
+already in the mirror are served from disk.
 """
 from __future__ import print_function
+import os
+import time
+import socket
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit, urljoin
+
+pdb_url = 'http://www.rcsb.org/pdb/files/%s.pdb'
+retry_status = (429, 500, 502, 503, 504)
+redirect_status = (301, 302, 303, 307, 308)
+retries_default = 3  # retries after the first attempt
+backoff_default = 0.5  # seconds before the first retry, doubling
+timeout_default = 30  # socket timeout in seconds
+
+_local = threading.local()  # keep-alive connections of each thread
+
+
+def _connection(scheme, netloc, timeout):
+    """Returns the keep-alive connection of this thread to netloc"""
+    conns = _local.__dict__.setdefault('conns', {})
+    conn = conns.get((scheme, netloc))
+    if conn is None:
+        if scheme == 'https':
+            conn = http_client.HTTPSConnection(netloc, timeout=timeout)
+        else:
+            conn = http_client.HTTPConnection(netloc, timeout=timeout)
+        conns[(scheme, netloc)] = conn
+    return conn
+
+
+def _dropconnection(scheme, netloc):
+    """Closes the connection of this thread to netloc, e.g. after errors"""
+    conn = _local.__dict__.get('conns', {}).pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+
+def http_get(url, retries=retries_default, backoff=backoff_default,
+             timeout=timeout_default, maxredirects=5):
+    """
+    Gets url over a keep-alive connection of this thread, following
+    redirects and retrying connection errors and busy servers (429,
+    5xx) with exponential backoff.
 
+    Input
+    -----
+    url: str
+       http or https url
+    retries: int
+       number of retries after the first attempt
+    backoff: float
+       seconds to wait before the first retry, doubled every retry
+    timeout: float
+       socket timeout in seconds
 
-def fetch_pdb(id, writetofile=True, Verbose=False):
+    Output
+    ------
+    data: bytes
+       body of the response
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        target = url
+        try:
+            for nredirect in range(maxredirects + 1):
+                parts = urlsplit(target)
+                path = parts.path or '/'
+                if parts.query:
+                    path += '?' + parts.query
+                conn = _connection(parts.scheme, parts.netloc, timeout)
+                try:
+                    conn.request('GET', path,
+                                 headers={'Connection': 'keep-alive'})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http_client.HTTPException, socket.error):
+                    _dropconnection(parts.scheme, parts.netloc)
+                    raise
+                if response.will_close:
+                    _dropconnection(parts.scheme, parts.netloc)
+                if response.status not in redirect_status:
+                    break
+                target = urljoin(target, response.getheader('Location'))
+            else:
+                raise IOError('%s: too many redirects' % url)
+        except (http_client.HTTPException, socket.error) as error:
+            status, reason = None, error
+        else:
+            if response.status == 200:
+                return data
+            status, reason = response.status, response.reason
+        if status is not None and status not in retry_status:
+            break
+    raise IOError('%s: %s %s' % (url, status or '', reason))
+
+
+def mirror_path(mirror, id):
+    """
+    Path of a pdb file in a mirror sharded by the middle two letters
+    of the id, as on the PDB (e.g., mirror/l2/1l2y.pdb)
+    """
+    id = id.lower()
+    return os.path.join(mirror, id[1:3], id + '.pdb')
+
+
+def _mirrorfetch(id, mirror, url=pdb_url, retries=retries_default,
+                 backoff=backoff_default, timeout=timeout_default):
+    """Downloads id into the mirror unless it is there, returns the path"""
+    fname = mirror_path(mirror, id)
+    if os.path.exists(fname):
+        return fname
+    data = http_get(url % id, retries=retries, backoff=backoff,
+                    timeout=timeout)
+    shard = os.path.dirname(fname)
+    if not os.path.isdir(shard):
+        try:
+            os.makedirs(shard)
+        except OSError:
+            if not os.path.isdir(shard):
+                raise
+    fd, tmpname = tempfile.mkstemp(dir=shard, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(tmpname, fname)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    return fname
+
+
+def fetch_pdbs(ids, mirror='pdbmirror', nthreads=8,
+               retries=retries_default, backoff=backoff_default,
+               url=pdb_url, timeout=timeout_default, Verbose=False):
+    """
+    Downloads many pdb files concurrently into a local mirror. Files
+    already in the mirror are not downloaded again.
+
+    Input
+    -----
+    ids: ls
+       4 letter pdb codes
+    mirror: str
+       directory of the mirror, see mirror_path
+    nthreads: int
+       number of concurrent downloads
+    retries, backoff, timeout:
+       see http_get
+    url: str
+       url of a pdb file with %s for the id (default the RCSB)
+    Verbose: bool
+       print every download and failure
+
+    Output
+    ------
+    fnames: dict
+       path in the mirror of every id, None for the ones that failed
+    """
+    ids = list(dict.fromkeys(ids))
+    fnames = {}
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        futures = [(id, executor.submit(_mirrorfetch, id, mirror, url=url,
+                                        retries=retries, backoff=backoff,
+                                        timeout=timeout))
+                   for id in ids]
+        for id, future in futures:
+            try:
+                fnames[id] = future.result()
+            except (IOError, OSError) as error:
+                fnames[id] = None
+                if(Verbose):
+                    print("Failed %s: %s" % (id, error))
+            else:
+                if(Verbose):
+                    print("Fetched %s" % fnames[id])
+    return fnames
+
+
+def fetch_pdb(id, writetofile=True, Verbose=False, mirror=None):
     """
     Download pdb file and write out to file id.pdb
 
@@ -21,25 +206,26 @@ def fetch_pdb(id, writetofile=True, Verbose=False):
        4 letter pdb code
     writetofile: bool
        Write out to file otherwise return file.
+    mirror: str
+       local mirror to take the file from or download it into, see
+       fetch_pdbs
     Output
     ------
     id.pdb: file
        filename id.pdb
     """
-    try:
-        from StringIO import StringIO as stream
-    except ImportError:
-        from io import BytesIO as stream
-    try:
-        from urllib.request import urlopen
-    except ImportError:
-        from urllib2 import urlopen
+    from io import BytesIO as stream
 
-    url = 'http://www.rcsb.org/pdb/files/%s.pdb' % id
+    if(mirror):
+        fname = _mirrorfetch(id, mirror)
+        with open(fname, 'rb') as infile:
+            data = infile.read()
+    else:
+        data = http_get(pdb_url % id)
     if(writetofile):
         with open(id + '.pdb', 'wb') as outfile:
-            outfile.write(urlopen(url).read())
+            outfile.write(data)
         if(Verbose):
             print("Wrote out %s.pdb" % (id))
     else:
-        return stream(urlopen(url).read())
+        return stream(data)
@@ -8,16 +8,25 @@ Description
 Downloads the fafsa sequence from the pdb and sees where the sequence begins in
 the fafsa sequence and adds it to the csv file.
 
+Every residue of the structure is mapped to its position in the fafsa
+sequence with an index of the k-mers of the sequence, so gaps and chain
+breaks of the structure are followed and no sequence is scanned twice.
+
 Usage
 -----
 ```
-fafsaseq.py DFICSVFILE
+fafsaseq.py DFICSVFILE [DFICSVFILE ...] [--fasta FASTAFILE]
 ```
 """
 from __future__ import print_function
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from dfi.datafiles import *
+from dfi.download_pdb import http_get
+import dfi.unipromap as unipromap
 
 mapres = {'ALA': 'A',
           'CYS': 'C',
@@ -41,8 +50,13 @@ mapres = {'ALA': 'A',
           'VAL': 'V',
           'HIE': 'H'}
 
+aminoacids = 'ACDEFGHIKLMNPQRSTVWY'
+_aacodes = np.full(256, len(aminoacids), dtype=np.int64)
+for _code, _aa in enumerate(aminoacids):
+    _aacodes[ord(_aa)] = _aacodes[ord(_aa.lower())] = _code
+
 
-def getuniprols(pdbid):
+def getuniprols(pdbid, mapping=None):
     """
     Insert PDB and get UNIPROTID(s) from table
 
@@ -50,20 +64,17 @@ def getuniprols(pdbid):
     -----
     pdbid: str
        4 letter code PDBID
+    mapping: UniproPDBMap
+       indexed table (default the one of data/unipropdb.csv)
 
     Returns
     ------
     ls_unipro: ls
        list of uniprotID(s) associated with PDBID
     """
-    import pandas as pd
-    pdbid = pdbid.upper()
-    mapdata = pd.read_csv(unipro_pdb, index_col='pdbID')
-    nids = len(mapdata.ix[pdbid].values)
-    if nids > 1:
-        return [unipro[0] for unipro in mapdata.ix[pdbid].values]
-    else:
-        return [unipro for unipro in mapdata.ix[pdbid].values]
+    if mapping is None:
+        mapping = unipromap.default_map()
+    return mapping.pdb_to_uniprot(pdbid)
 
 
 def get_fastaseq(ID):
@@ -80,15 +91,101 @@ def get_fastaseq(ID):
     fasta_seq: str
        fasta sequence
     """
-    import urllib2
-
     if len(ID) == 4:
         pdbURL = "http://www.rcsb.org/pdb/files/fasta.txt?structureIdList="
-        response = urllib2.urlopen(pdbURL + ID)
+        response = http_get(pdbURL + ID)
     else:
         uniproURL = "http://www.uniprot.org/uniprot/"
-        response = urllib2.urlopen(uniproURL + ID + '.fasta')
-    return response.read()
+        response = http_get(uniproURL + ID + '.fasta')
+    return response.decode('ascii')
+
+
+def fetch_fastaseqs(IDs, nthreads=8, Verbose=False):
+    """
+    Downloads the fasta sequences of many uniprotIDs and pdbIDs
+    concurrently, see get_fastaseq
+
+    Returns
+    -------
+    sequences: dict
+       sequence of every uniprotID and of every chain of a pdbID (see
+       parse_fasta); IDs that failed are left out
+    """
+    sequences = {}
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        futures = [(ID, executor.submit(get_fastaseq, ID)) for ID in IDs]
+        for ID, future in futures:
+            try:
+                text = future.result()
+            except (IOError, OSError) as error:
+                if(Verbose):
+                    print("Failed %s: %s" % (ID, error))
+                continue
+            entries = parse_fasta(text)
+            if len(ID) == 4:
+                sequences.update(entries)
+            if entries:
+                sequences[ID] = next(iter(entries.values()))
+    return sequences
+
+
+def fastaid(header):
+    """
+    ID of a fasta header: the accession of a uniprot header
+    (sp|P69441|KAD_ECOLI ...) and the first word otherwise
+    (e.g., 1L2Y:A for 1L2Y:A|PDBID|CHAIN|SEQUENCE)
+
+    Parameters
+    ----------
+    header: str
+       header line without the >
+    """
+    words = header.split()
+    if not words:
+        return ''
+    fields = words[0].split('|')
+    if fields[0] in ('sp', 'tr') and len(fields) > 1:
+        return fields[1]
+    return fields[0]
+
+
+def parse_fasta(lines):
+    """
+    Parses fasta text into its sequences
+
+    Parameters
+    ----------
+    lines: str or iterable
+       fasta text or its lines (e.g., an open file)
+
+    Returns
+    -------
+    sequences: OrderedDict
+       sequence of every entry by fastaid
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    sequences = OrderedDict()
+    ID, seq = None, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('>'):
+            if ID is not None:
+                sequences[ID] = ''.join(seq)
+            ID, seq = fastaid(line[1:]), []
+        elif line:
+            seq.append(line)
+    if ID is not None:
+        sequences[ID] = ''.join(seq)
+    return sequences
+
+
+def read_fasta(fname):
+    """
+    Reads a fasta file with any number of sequences, see parse_fasta
+    """
+    with open(fname, 'r') as infile:
+        return parse_fasta(infile)
 
 
 def parsefafstaurl(html,
@@ -104,112 +201,379 @@ def parsefafstaurl(html,
        bool of sequence
     """
     html = html.split('\n')
-    fseq = ''
-    for line in html:
-        if(Verbose):
+    if(Verbose):
+        for line in html:
             print(line)
-        if line.startswith('>') and seqonly:
-            continue
-        fseq = fseq + line
-    return fseq
+    return ''.join(line.strip() for line in html
+                   if not(seqonly and line.startswith('>')))
+
+
+def kmercodes(seq, k=4):
+    """
+    Integer codes of the k-mers of a sequence, in base 21 with unknown
+    residues as the 21st letter
+
+    Parameters
+    ----------
+    seq: str
+       one letter sequence
+    k: int
+       length of the k-mers
+
+    Returns
+    -------
+    kmers: numpy
+       code of the k-mer starting at every position, -1 for k-mers
+       with an unknown residue
+    """
+    codes = _aacodes[np.frombuffer(seq.encode('ascii'), dtype=np.uint8)]
+    nkmers = len(codes) - k + 1
+    if nkmers <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kmers = np.zeros(nkmers, dtype=np.int64)
+    unknown = np.zeros(nkmers, dtype=bool)
+    for j in range(k):
+        window = codes[j:j + nkmers]
+        kmers = kmers * (len(aminoacids) + 1) + window
+        unknown |= window == len(aminoacids)
+    kmers[unknown] = -1
+    return kmers
+
+
+def kmerlookup(index, qkmers):
+    """
+    Looks k-mers up in a sorted array of k-mer codes
+
+    Parameters
+    ----------
+    index: numpy
+       sorted k-mer codes
+    qkmers: numpy
+       k-mer codes to look up, -1 is never found
+
+    Returns
+    -------
+    qidx, ipos: numpy
+       every pair of a position in qkmers and a position in index with
+       the same k-mer, ordered by qidx and then ipos
+    """
+    lo = np.searchsorted(index, qkmers, side='left')
+    counts = np.searchsorted(index, qkmers, side='right') - lo
+    counts[qkmers < 0] = 0
+    qidx = np.repeat(np.arange(len(qkmers)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    ipos = np.arange(len(qidx)) - first + np.repeat(lo, counts)
+    return qidx, ipos
+
+
+def kmerhits(smallseq, fseq, k=4):
+    """
+    Positions of all k-mers of smallseq in fseq, found through a sorted
+    index of the k-mers of fseq
+
+    Returns
+    -------
+    qpos, tpos: numpy
+       start of every shared k-mer in smallseq and fseq, ordered by
+       qpos and then tpos
+    """
+    tkmers = kmercodes(fseq, k)
+    order = np.argsort(tkmers, kind='stable')
+    qpos, ipos = kmerlookup(tkmers[order], kmercodes(smallseq, k))
+    return qpos, order[ipos]
 
 
 def compareseq(smallseq, fseq, numseq=4):
-    "Compare sequence to find contiguous sequence"
-    for j in range(len(smallseq)):
-        for i in range(len(fseq)):
-            print(fseq[i:i + numseq], smallseq[j:j + numseq])
-            if smallseq[j:j + numseq] == fseq[i:i + numseq]:
-                match = i + 1
-                print("Found a match at %d" % (i + 1))
-                return j, match
-    print("No match")
-    return False
+    """
+    Compare sequence to find contiguous sequence
+
+    Returns
+    -------
+    j, match: int
+       first position of smallseq whose numseq residues are in fseq and
+       the position (from 1) of the first of them in fseq, False if no
+       numseq residues are shared
+    """
+    qpos, tpos = kmerhits(smallseq, fseq, k=numseq)
+    if not len(qpos):
+        return False
+    return int(qpos[0]), int(tpos[0]) + 1
 
 
-def parsefafsaseq(fname, uniprols=None):
+def align_residues(smallseq, fseq, k=4, minvotes=2):
+    """
+    Maps every residue of a structure sequence to its position in a
+    (uniprot) sequence.
+
+    The shared k-mers vote for the diagonals (offsets) between the two
+    sequences, and every residue takes the best supported diagonal of
+    the k-mers it is part of, so that the offset changes at gaps and
+    chain breaks of the structure. Residues that would map out of order
+    are dropped. Unmatched residues between two residues on the same
+    diagonal (point mutations) and up to k residues at the ends are
+    mapped along that diagonal.
+
+    Parameters
+    ----------
+    smallseq: str
+       one letter sequence of the structure
+    fseq: str
+       one letter sequence to map on
+    k: int
+       length of the k-mers
+    minvotes: int
+       k-mers a diagonal needs, unless no diagonal has that many
+
+    Returns
+    -------
+    mapping: numpy
+       position (from 0) in fseq of every residue of smallseq, -1 for
+       unmapped residues
+    """
+    nres = len(smallseq)
+    mapping = np.full(nres, -1, dtype=np.int64)
+    qpos, tpos = kmerhits(smallseq, fseq, k=k)
+    if not len(qpos):
+        return mapping
+
+    diag = tpos - qpos
+    diags, inverse, votes = np.unique(diag, return_inverse=True,
+                                      return_counts=True)
+    score = votes[inverse.ravel()]
+    keep = score >= min(minvotes, score.max())
+    qpos, diag, score = qpos[keep], diag[keep], score[keep]
+
+    # every residue of a k-mer takes the diagonal with the most votes
+    cover = (qpos[:, None] + np.arange(k)).ravel()
+    order = np.lexsort((np.repeat(score, k), cover))
+    cover, cdiag = cover[order], np.repeat(diag, k)[order]
+    best = np.r_[cover[1:] != cover[:-1], True]
+    mapping[cover[best]] = cover[best] + cdiag[best]
+
+    # drop the residues that map before a residue preceding them
+    mapped = np.flatnonzero(mapping >= 0)
+    tmapped = mapping[mapped]
+    before = np.maximum.accumulate(np.r_[-1, tmapped[:-1]])
+    mapping[mapped[tmapped <= before]] = -1
+
+    # fill in mutations and the ends along the diagonal of the neighbors
+    mapped = np.flatnonzero(mapping >= 0)
+    if not len(mapped):
+        return mapping
+    diag = mapping[mapped] - mapped
+    resi = np.arange(nres)
+    right = np.searchsorted(mapped, resi)
+    left = right - 1
+    dleft = diag[np.maximum(left, 0)]
+    dright = diag[np.minimum(right, len(mapped) - 1)]
+    start, end = left < 0, right >= len(mapped)
+    fill = np.where(start, mapped[0] - resi <= k,
+                    np.where(end, resi - mapped[-1] <= k, dleft == dright))
+    target = resi + np.where(start, dright, dleft)
+    fill &= (mapping < 0) & (target >= 0) & (target < len(fseq))
+    mapping[fill] = target[fill]
+    return mapping
+
+
+def structureseq(data):
+    """One letter sequence of the Res column of a dfi csv file"""
+    return ''.join(mapres.get(res, 'X') for res in
+                   np.asarray(data['Res'].values, dtype=str))
+
+
+def align_chains(data, fseqs, k=4):
+    """
+    Maps the residues of every chain of a dfi csv file on a sequence
+
+    Parameters
+    ----------
+    data: DataFrame
+       dfi csv file with the Res and ChainID columns
+    fseqs: str or dict
+       sequence to map all chains on, or the sequence of each chain by
+       chainID (chains without one are not mapped)
+
+    Returns
+    -------
+    mapping: numpy
+       position (from 0) of every residue in the sequence of its chain,
+       -1 for unmapped residues
+    """
+    smallseq = structureseq(data)
+    if 'ChainID' in data:
+        chains = np.asarray(data['ChainID'].values, dtype=str)
+    else:
+        chains = np.full(len(data), '', dtype=str)
+    mapping = np.full(len(data), -1, dtype=np.int64)
+    for chain in pd.unique(chains):
+        fseq = fseqs if isinstance(fseqs, str) else fseqs.get(chain)
+        if not fseq:
+            continue
+        rows = np.flatnonzero(chains == chain)
+        chainseq = ''.join(smallseq[row] for row in rows)
+        mapping[rows] = align_residues(chainseq, fseq, k=k)
+    return mapping
+
+
+def _pdbchainseqs(pdbname, sequences):
+    """Sequences of the chains of a pdb by chainID from its fasta entries"""
+    pdbname = pdbname.upper()
+    chainseqs = {}
+    for ID, seq in sequences.items():
+        if ID.upper().startswith(pdbname + ':'):
+            chainseqs[ID.split(':', 1)[1]] = seq
+    return chainseqs
+
+
+def parsefafsaseq(fname, uniprols=None, sequences=None, k=4,
+                  Verbose=False):
     """
     Parse the fafas seq using the csv filename and uniprotids.
     Returns a list of the outfile names
+
+    Parameters
+    ----------
+    fname: str
+       dfi csv file (pdbid-dfianalysis.csv)
+    uniprols: ls
+       uniprotIDs to map the residues on, otherwise the sequences of
+       the chains in the pdb are used
+    sequences: dict
+       sequences by uniprotID and pdbID:chain (e.g., from read_fasta);
+       the missing ones are downloaded
+    k: int
+       length of the k-mers of the alignment, see align_residues
+    Verbose: bool
+       print the outfiles
     """
     outfilels = []
     data = pd.read_csv(fname, index_col='ResI')
-
-    # convert three letter code to one letter code sequence
-    bigseq = np.array(data['Res'].values, dtype=str)
-    smallseq = ''
-    for threeseq in bigseq:
-        smallseq = smallseq + str(mapres[threeseq])
-
-    import urllib2
-    pdbURL = "http://www.pdb.org/pdb/files/fasta.txt?structureIdList="
-    uniproURL = "http://www.uniprot.org/uniprot/"
-
     pdbname = fname.split('-')[0]
+    if sequences is None:
+        sequences = {}
+    missing = [ID for ID in (uniprols or [pdbname])
+               if ID not in sequences]
+    if missing:
+        sequences = dict(sequences)
+        sequences.update(fetch_fastaseqs(missing, Verbose=Verbose))
 
     if uniprols:
         for uniproid in uniprols:
-            print(uniproid)
-            print(uniproURL + uniproid + '.fasta')
-            response = urllib2.urlopen(uniproURL + uniproid + '.fasta')
-            fseq = parsefafstaurl(response.read())
-            struc_match, seq_match = compareseq(smallseq, fseq, numseq=4)
-            if seq_match:
-                print("seq_match", seq_match)
-                print("struc_match", struc_match)
-                ind_match = seq_match - 1
-                matchseq = [f for f in fseq[ind_match - struc_match:]]
-                print('fseq', fseq)
-                print("---")
-                print('smallseq', smallseq)
-                print('nmatchseq', len(matchseq))
-                print('nsmallseq', len(smallseq))
-                if len(matchseq) < len(smallseq):
-                    ntimes = len(smallseq) - len(matchseq)
-                    for i in range(ntimes):
-                        matchseq.append('NA')
-
-                while len(matchseq) > len(smallseq):
-                    matchseq = matchseq[:-1]
-
-                print("fafalen:" + str(len(fseq)))
-                data['fafsa_seq'] = pd.Series(matchseq, index=data.index)
-                fafsa_ls = range(seq_match - struc_match,
-                                 len(smallseq) + seq_match - struc_match)
-                print("fafsa_ls", fafsa_ls)
-                data['fafsa_ind'] = pd.Series(fafsa_ls, index=data.index)
-                data['unipro'] = pd.Series([uniproid for i in range(
-                    seq_match, len(smallseq) + seq_match)], index=data.index)
-                outfile = pdbname + '-' + uniproid + '-dfianalysis.csv'
-                print("Writing out to: " + outfile)
-                data.to_csv(outfile)
-                outfilels.append(outfile)
-    else:
-        print("Taking from the PDB")
-        response = urllib2.urlopen(pdbURL + pdbname)
-        fseq = parsefafsaurl(response.read())
-        struc_match, seq_match = compareseq(smallseq, fseq, numseq=4)
-        if seq_match:
+            fseq = sequences.get(uniproid)
+            if not fseq:
+                continue
+            mapping = align_chains(data, fseq, k=k)
+            if not np.any(mapping >= 0):
+                continue
+            mapped = mapping >= 0
+            data['fafsa_seq'] = np.where(
+                mapped, np.array(list(fseq))[np.maximum(mapping, 0)], 'NA')
             data['fafsa_ind'] = pd.Series(
-                range(seq_match, len(smallseq) + seq_match), index=data.index)
-            outfile = pdbname + '-dfianalysis.csv'
+                np.where(mapped, mapping + 1, 0), index=data.index,
+                dtype='Int64').where(mapped)
+            data['unipro'] = uniproid
+            outfile = pdbname + '-' + uniproid + '-dfianalysis.csv'
+            if(Verbose):
+                print("Writing out to: " + outfile)
             data.to_csv(outfile)
             outfilels.append(outfile)
+    else:
+        if(Verbose):
+            print("Taking from the PDB")
+        fseqs = _pdbchainseqs(pdbname, sequences) or sequences.get(pdbname)
+        if fseqs:
+            mapping = align_chains(data, fseqs, k=k)
+            if np.any(mapping >= 0):
+                mapped = mapping >= 0
+                data['fafsa_ind'] = pd.Series(
+                    np.where(mapped, mapping + 1, 0), index=data.index,
+                    dtype='Int64').where(mapped)
+                outfile = pdbname + '-dfianalysis.csv'
+                data.to_csv(outfile)
+                outfilels.append(outfile)
 
     return outfilels
 
 
+def map_dfi_files(fnames, uniprols=None, sequences=None, k=4, nthreads=8,
+                  Verbose=False):
+    """
+    Maps the residues of many dfi csv files on their uniprot sequences.
+    The sequences are read or downloaded once, concurrently, and shared
+    by all files.
+
+    Parameters
+    ----------
+    fnames: ls
+       dfi csv files (pdbid-dfianalysis.csv)
+    uniprols: dict
+       uniprotIDs of every pdbID (default looked up in bulk, see
+       getuniprols)
+    sequences: dict or str
+       sequences by uniprotID or a fasta file with them (see
+       read_fasta); the missing ones are downloaded
+    k: int
+       length of the k-mers of the alignment, see align_residues
+    nthreads: int
+       number of concurrent downloads
+
+    Returns
+    -------
+    outfiles: dict
+       outfiles of every dfi csv file
+    """
+    if isinstance(sequences, str):
+        sequences = read_fasta(sequences)
+    sequences = dict(sequences or {})
+    pdbids = OrderedDict((fname, fname.split('-')[0]) for fname in fnames)
+    if uniprols is None:
+        uniprols = unipromap.default_map().bulk_pdb_to_uniprot(
+            set(pdbids.values()))
+
+    IDs = set()
+    for pdbid in pdbids.values():
+        IDs.update(uniprols.get(pdbid) or [pdbid])
+    missing = sorted(ID for ID in IDs if ID not in sequences)
+    if missing:
+        sequences.update(fetch_fastaseqs(missing, nthreads=nthreads,
+                                         Verbose=Verbose))
+
+    outfiles = OrderedDict()
+    for fname, pdbid in pdbids.items():
+        outfiles[fname] = parsefafsaseq(fname, uniprols=uniprols.get(pdbid),
+                                        sequences=sequences, k=k,
+                                        Verbose=Verbose)
+    return outfiles
+
+
+def check_args(args=None):
+    """
+    Parse command lines input
+
+    Returns
+    -------
+    fnames: ls
+       dfi csv files
+    fastafile: str
+       fasta file of the uniprot sequences
+    """
+    parser = argparse.ArgumentParser(
+        description='Map dfi csv files on their uniprot sequences')
+    parser.add_argument('fnames',
+                        help='dfi csv files (pdbid-dfianalysis.csv)',
+                        nargs='+')
+    parser.add_argument('--fasta',
+                        help='fasta file of the uniprot sequences, the '
+                        'missing ones are downloaded')
+    results = parser.parse_args(args)
+    return results.fnames, results.fasta
+
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) < 2:
         print(__doc__)
         sys.exit()
 
-    pdbid = sys.argv[1].split('-')[0]
-
-    uniprols = getuniprols(pdbid)
-    if uniprols:
-        parsefafsaseq(sys.argv[1], uniprols=uniprols)
-    else:
-        print("No UNIPRO IDs")
-        sys.exit()
+    fnames, fastafile = check_args(sys.argv[1:])
+    map_dfi_files(fnames, sequences=fastafile, Verbose=True)
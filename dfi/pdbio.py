@@ -1,7 +1,547 @@
 #!/usr/bin/env python
 # For reading and writing pdb files
 from __future__ import print_function
+import io
+import re
+import bz2
+import gzip
+import contextlib
+from itertools import compress
 from collections import namedtuple
+import numpy as np
+import six
+
+
+class ATOM(namedtuple('ATOM', ['atom_index', 'atom_name', 'alc',
+                               'res_name', 'chainID', 'res_index',
+                               'insert_code', 'x', 'y', 'z',
+                               'occupancy', 'temp_factor', 'atom_type'])):
+    """
+    ATOM entry of a pdb file. atom_index is an int; x, y, z, occupancy
+    and temp_factor are floats; the other fields are str.
+
+    occupancy used to be the raw text of its columns (e.g., ' 1.00')
+    and is now a float like temp_factor; blank fields read as 1.0.
+    """
+    __slots__ = ()
+
+
+_atomline = re.compile(r'^ATOM.*$', re.M)
+_ciftoken = re.compile(r"""'(.*?)'(?=\s)|"(.*?)"(?=\s)|(\S+)""")
+_cifext = ('.cif', '.mmcif')
+
+
+class AtomArray(object):
+    """
+    Atom Array
+    ==========
+
+    Columnar (struct of arrays) ATOM entries of a pdb file. Every field
+    of ATOM is a numpy array: floats for the coordinates, occupancy and
+    temp_factor, ints for atom_index and fixed width strings for the
+    rest.
+
+    It can be used like the ls of ATOM objects returned by pdb_reader:
+    len, iteration and integer indexing give ATOM objects, while
+    slices, masks and index arrays give a new AtomArray.
+    """
+    fields = ATOM._fields
+
+    def __init__(self, **columns):
+        for field in self.fields:
+            setattr(self, field, np.asarray(columns[field]))
+
+    @classmethod
+    def from_atoms(cls, ATOMS):
+        """Builds an AtomArray from an ls of ATOM objects"""
+        if isinstance(ATOMS, cls):
+            return ATOMS
+        if len(ATOMS) == 0:
+            return cls(**dict((field, []) for field in cls.fields))
+        return cls(**dict(zip(cls.fields, zip(*ATOMS))))
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, (int, np.integer)):
+            return ATOM._make(getattr(self, field)[ind].item()
+                              for field in self.fields)
+        return AtomArray(**dict((field, getattr(self, field)[ind])
+                                for field in self.fields))
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        """Returns the ls of ATOM objects"""
+        return [ATOM._make(row) for row in
+                zip(*[getattr(self, field).tolist()
+                      for field in self.fields])]
+
+    def copy(self, **columns):
+        """Returns a copy with the given columns replaced"""
+        new = dict((field, getattr(self, field)) for field in self.fields)
+        new.update(columns)
+        return AtomArray(**new)
+
+
+def _fixedpoint(block):
+    """
+    Parses a (nlines, width) block of fixed point numbers (e.g., %8.3f)
+    given as ascii codes. Returns None when the block does not have the
+    decimal point in the same column on every line.
+
+    The digits make an exact integer that is divided once by a power of
+    ten, which rounds exactly like float() on the text.
+    """
+    width = block.shape[1]
+    point = np.flatnonzero(block[0] == ord('.'))
+    if len(point) != 1 or not np.all(block[:, point[0]] == ord('.')):
+        return None
+    point = point[0]
+    digits = np.delete(block, point, axis=1)
+    isdigit = (digits >= ord('0')) & (digits <= ord('9'))
+    isminus = digits == ord('-')
+    if not np.all(isdigit | isminus | (digits == ord(' '))):
+        return None
+    powers = 10 ** np.arange(width - 2, -1, -1, dtype=np.int64)
+    mantissa = np.dot(np.where(isdigit, digits - ord('0'), 0), powers)
+    sign = np.where(isminus.any(axis=1), -1., 1.)
+    return sign * mantissa / float(10 ** (width - 1 - point))
+
+
+def _pdbcolumns(lines):
+    """
+    Parses the fixed width columns of the ATOM lines in bulk.
+
+    The lines are packed into one (nlines, 80) character array and every
+    field is a column slice of it, converted with one vectorized step.
+    """
+    nlines = len(lines)
+    codes = np.array(lines, dtype='S80').view(np.uint8)
+    codes = codes.reshape((nlines, 80))
+    # short lines are padded with nulls, newlines become blanks too
+    codes[codes < ord(' ')] = ord(' ')
+
+    def field(start, stop):
+        return np.ascontiguousarray(codes[:, start:stop]).view(
+            'S%d' % (stop - start)).ravel()
+
+    def text(start, stop):
+        # ascii codes widened to UCS4 are the unicode string array
+        return codes[:, start:stop].astype(np.uint32).view(
+            'U%d' % (stop - start)).ravel()
+
+    def number(start, stop, default=None):
+        col = _fixedpoint(codes[:, start:stop])
+        if col is None:
+            col = np.char.strip(field(start, stop))
+            if default is not None:
+                col[col == b''] = default
+            col = col.astype(float)
+        return col
+
+    return dict(atom_index=field(7, 11),
+                atom_name=text(12, 16),
+                alc=text(16, 17),
+                res_name=text(17, 20),
+                chainID=text(21, 22),
+                res_index=np.char.strip(text(22, 27)),
+                insert_code=text(26, 27),
+                x=number(31, 38),
+                y=number(39, 46),
+                z=number(47, 54),
+                occupancy=number(55, 60, b'1'),
+                temp_factor=number(61, 66, b'1'),
+                atom_type=text(77, 78))
+
+
+class _RawStream(io.RawIOBase):
+    """Raw binary view of a caller's stream, never closes it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.stream.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+def _decompress(stream):
+    """Wraps a buffered binary stream in the decompressor its magic
+    bytes call for (gzip, bz2 or xz)"""
+    magic = stream.peek(6)[:6]
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    elif magic.startswith(b'BZh'):
+        return bz2.BZ2File(stream)
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        import lzma
+        return lzma.LZMAFile(stream)
+    return stream
+
+
+def sourcename(source):
+    """Name of a pdb source for messages and default ids"""
+    if isinstance(source, six.string_types):
+        return source
+    name = getattr(source, 'name', None)
+    if isinstance(name, six.string_types):
+        return name
+    return 'bytes' if isinstance(source, (bytes, bytearray)) else 'stream'
+
+
+@contextlib.contextmanager
+def openpdb(source):
+    """
+    Opens a pdb for reading as text. gzip, bz2 and xz compressed input
+    is recognized by its magic bytes and decompressed as a stream, so
+    neither a temporary file nor the whole decompressed text is ever
+    made.
+
+    Input
+    -----
+    source: str, bytes or file
+       path of a (compressed) pdb, its contents as bytes or an open
+       text or binary file-like object. A file-like object is read
+       from its current position and left open.
+
+    Output
+    ------
+    pdb: file
+       text stream of the pdb
+    """
+    if isinstance(source, six.string_types):
+        stream = open(source, 'rb')
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        stream = io.BufferedReader(io.BytesIO(source))
+    elif isinstance(source.read(0), six.text_type):
+        yield source
+        return
+    else:
+        stream = io.BufferedReader(_RawStream(source))
+
+    pdb = io.TextIOWrapper(_decompress(stream))
+    try:
+        yield pdb
+    finally:
+        pdb.close()
+        stream.close()
+
+
+def _endmdl(text, start):
+    """Index of the next line starting with ENDMDL in text, or -1"""
+    if text.startswith('ENDMDL', start):
+        return start
+    end = text.find('\nENDMDL', start)
+    return end + 1 if end >= 0 else -1
+
+
+def _modellines(pdb, chunksize=1 << 22):
+    """
+    Yields the ATOM lines of every model of a pdb, in one pass over the
+    file. The file is read in chunks and the ATOM lines are picked out
+    with one regular expression per chunk. Along with the lines comes
+    whether the model was closed by an ENDMDL.
+    """
+    lines = []
+    tail = ''
+    while True:
+        chunk = pdb.read(chunksize)
+        text = tail + chunk
+        if chunk:
+            cut = text.rfind('\n') + 1
+            text, tail = text[:cut], text[cut:]
+        start = 0
+        end = _endmdl(text, start)
+        while end >= 0:
+            lines.extend(_atomline.findall(text, start, end))
+            yield lines, True
+            lines = []
+            start = end + len('ENDMDL')
+            end = _endmdl(text, start)
+        lines.extend(_atomline.findall(text, start))
+        if not chunk:
+            if lines:
+                yield lines, False
+            return
+
+
+def _atomarray(lines, CAonly=False, noalc=True, chainA=False,
+               chain_name='A'):
+    """Parses and filters ATOM lines into an AtomArray"""
+    if not(lines):
+        return AtomArray.from_atoms([])
+
+    columns = _pdbcolumns(lines)
+    mask = np.ones(len(lines), dtype=bool)
+    if CAonly:
+        mask &= np.char.strip(columns['atom_name']) == 'CA'
+    if noalc:
+        mask &= (columns['alc'] == ' ') | (columns['alc'] == 'A')
+    if chainA:
+        mask &= columns['chainID'] == chain_name
+    for field in columns:
+        columns[field] = columns[field][mask]
+    columns['atom_index'] = columns['atom_index'].astype(int)
+    return AtomArray(**columns)
+
+
+def pdb_reader_columns(filename, CAonly=False, noalc=True, chainA=False,
+                       chain_name='A', Verbose=False):
+    """
+    Reads in the ATOM entry of a pdb file into an AtomArray. In the case
+    of an NMR structure, the function reads in the first model.
+
+    The file is read in chunks and only its ATOM lines are kept, their
+    columns are then parsed and filtered in bulk.
+
+    Input
+    -----
+    See pdb_reader
+
+    Output
+    ------
+    ATOMS: AtomArray
+       columnar ATOM entries of the pdb
+    """
+    if _iscif(filename):
+        return cif_reader_columns(filename, CAonly=CAonly, noalc=noalc,
+                                  chainA=chainA, chain_name=chain_name,
+                                  Verbose=Verbose)
+    with openpdb(filename) as pdb:
+        lines, multimodel = next(_modellines(pdb), ([], False))
+    if multimodel and Verbose:
+        print("MULTIPLE MODELS...USING MODEL1")
+
+    ATOMS = _atomarray(lines, CAonly=CAonly, noalc=noalc, chainA=chainA,
+                       chain_name=chain_name)
+    print("Read %d atoms from the %s" % (len(ATOMS), sourcename(filename)))
+    return ATOMS
+
+
+def _ciftokens(text):
+    """Splits mmCIF loop text into its tokens, quoted or not"""
+    if "'" not in text and '"' not in text:
+        return text.split()
+    return [''.join(token) for token in _ciftoken.findall(text)]
+
+
+def _cifend(text):
+    """Index of the first line of text that ends a loop, or -1"""
+    starts = ('\n#', '\n_', '\nloop_', '\ndata_')
+    ends = [text.find(start) for start in starts]
+    ends = [end + 1 for end in ends if end >= 0]
+    if text.startswith(('#', '_', 'loop_', 'data_')):
+        ends.append(0)
+    return min(ends) if ends else -1
+
+
+def _cifloop(cif, category='_atom_site.', chunksize=1 << 22):
+    """
+    Finds the loop of an mmCIF category and returns its column names and
+    a generator over the loop's tokens, a block of rows at a time. The
+    file is read in chunks from the end of the header on.
+    """
+    names = []
+    line = cif.readline()
+    while line:
+        if line.startswith(category):
+            names.append(line.split()[0][len(category):])
+        elif names:
+            break
+        line = cif.readline()
+
+    def blocks():
+        tail = line
+        carry = []
+        chunk = line
+        while chunk:
+            chunk = cif.read(chunksize)
+            text = tail + chunk
+            if chunk:
+                cut = text.rfind('\n') + 1
+                text, tail = text[:cut], text[cut:]
+            stop = _cifend(text)
+            if stop >= 0:
+                text, chunk = text[:stop], ''
+            tokens = _ciftokens(text)
+            if carry:
+                tokens = carry + tokens
+            nrows = len(tokens) // len(names)
+            carry = tokens[nrows * len(names):]
+            yield tokens[:nrows * len(names)]
+    return names, blocks()
+
+
+def _cifcolumns(tokens, names, model=None, CAonly=False, noalc=True,
+                chainA=False, chain_name='A'):
+    """
+    Picks the ATOM fields out of a block of _atom_site tokens, preferring
+    the author (auth_) columns that match a pdb file. Rows are filtered
+    before their fields are converted; numbers are parsed in one go and
+    atom names are padded like in a pdb file (e.g., ' CA ').
+
+    Returns the columns of the kept rows (None if there are none), the
+    model number of the block's first row and whether other models
+    follow in the block; model, if given, keeps only the rows of that
+    model.
+    """
+    ncols = len(names)
+    nrows = len(tokens) // ncols
+
+    def column(*fields):
+        for field in fields:
+            if field in names:
+                return tokens[names.index(field)::ncols]
+        return ['?'] * nrows
+
+    if 'pdbx_PDB_model_num' in names:
+        models = np.array(column('pdbx_PDB_model_num'))
+        if model is None and nrows:
+            model = models[0]
+        mask = models == model
+    else:
+        mask = np.ones(nrows, dtype=bool)
+    endmodel = not np.all(mask)
+    mask &= np.array(column('group_PDB')) == 'ATOM'
+    atom_name = np.array(column('auth_atom_id', 'label_atom_id'))
+    alc = np.array(column('label_alt_id'))
+    chainID = np.array(column('auth_asym_id', 'label_asym_id'))
+    if CAonly:
+        mask &= atom_name == 'CA'
+    if noalc:
+        mask &= (alc == '.') | (alc == '?') | (alc == 'A')
+    if chainA:
+        mask &= chainID == chain_name
+    if not np.any(mask):
+        return None, model, endmodel
+
+    def kept(*fields):
+        return list(compress(column(*fields), mask))
+
+    def blank(values, default=' '):
+        values = np.asarray(values)
+        return np.where((values == '?') | (values == '.'), default, values)
+
+    def number(field, default, dtype=float):
+        values = kept(field)
+        if '?' in values or '.' in values:
+            values = blank(values, default).tolist()
+        return np.fromstring(' '.join(values), dtype=dtype, sep=' ',
+                             count=len(values))
+
+    atom_type = blank(kept('type_symbol'))
+    insert_code = blank(kept('pdbx_PDB_ins_code'))
+    # residue numbers carry the insertion code as in a pdb file (52A)
+    res_index = np.char.strip(np.char.add(
+        kept('auth_seq_id', 'label_seq_id'), insert_code))
+    atom_name = atom_name[mask]
+    pad = (np.char.str_len(atom_name) < 4) & \
+        (np.char.str_len(atom_type) == 1)
+    atom_name = np.where(pad, np.char.add(' ', atom_name), atom_name)
+    columns = dict(atom_index=number('id', '0', dtype=int),
+                   atom_name=np.char.ljust(atom_name, 4),
+                   alc=blank(alc[mask]),
+                   res_name=np.array(kept('auth_comp_id', 'label_comp_id')),
+                   chainID=chainID[mask],
+                   res_index=res_index,
+                   insert_code=insert_code,
+                   x=number('Cartn_x', '0'),
+                   y=number('Cartn_y', '0'),
+                   z=number('Cartn_z', '0'),
+                   occupancy=number('occupancy', '1'),
+                   temp_factor=number('B_iso_or_equiv', '1'),
+                   atom_type=atom_type)
+    return columns, model, endmodel
+
+
+def _iscif(source):
+    """Whether a pdb source is named like an mmCIF file"""
+    name = sourcename(source).lower()
+    for ext in ('.gz', '.bz2', '.xz'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name.endswith(_cifext)
+
+
+def cif_reader_columns(filename, CAonly=False, noalc=True, chainA=False,
+                       chain_name='A', Verbose=False):
+    """
+    Reads in the ATOM entries of the _atom_site loop of an mmCIF file
+    into an AtomArray. In the case of an NMR structure, the function
+    reads in the first model.
+
+    The loop is read in chunks that are tokenized in bulk; the fields
+    are then picked out and filtered as columns.
+
+    Input
+    -----
+    See pdb_reader
+
+    Output
+    ------
+    ATOMS: AtomArray
+       columnar ATOM entries of the mmCIF file
+    """
+    blocks = []
+    model = None
+    with openpdb(filename) as cif:
+        names, loop = _cifloop(cif)
+        if not(names):
+            raise ValueError('%s has no _atom_site loop' %
+                             sourcename(filename))
+        for tokens in loop:
+            if not(tokens):
+                continue
+            columns, model, endmodel = _cifcolumns(
+                tokens, names, model=model, CAonly=CAonly, noalc=noalc,
+                chainA=chainA, chain_name=chain_name)
+            if columns is not None:
+                blocks.append(columns)
+            if endmodel:
+                if(Verbose):
+                    print("MULTIPLE MODELS...USING MODEL1")
+                break
+    if not(blocks):
+        ATOMS = AtomArray.from_atoms([])
+    else:
+        ATOMS = AtomArray(**dict(
+            (field, np.concatenate([block[field] for block in blocks]))
+            for field in ATOM._fields))
+    print("Read %d atoms from the %s" % (len(ATOMS), sourcename(filename)))
+    return ATOMS
+
+
+def pdb_models(filename, CAonly=False, noalc=True, chainA=False,
+               chain_name='A', Verbose=False):
+    """
+    Generator over the models of a (NMR) pdb file. Every MODEL is read
+    lazily from a single pass over the file and yielded as an AtomArray;
+    a file without models yields one.
+
+    Input
+    -----
+    See pdb_reader
+
+    Output
+    ------
+    ATOMS: AtomArray
+       columnar ATOM entries of each model
+    """
+    with openpdb(filename) as pdb:
+        for nmodel, (lines, closed) in enumerate(_modellines(pdb)):
+            ATOMS = _atomarray(lines, CAonly=CAonly, noalc=noalc,
+                               chainA=chainA, chain_name=chain_name)
+            if(Verbose):
+                print("Read %d atoms from model %d of %s" %
+                      (len(ATOMS), nmodel + 1, sourcename(filename)))
+            yield ATOMS
 
 
 def pdb_reader(filename, CAonly=False, noalc=True, chainA=False,
@@ -13,7 +553,9 @@ def pdb_reader(filename, CAonly=False, noalc=True, chainA=False,
     Input
     -----
     filename: file
-       Filename of pdb file
+       Filename of pdb file, which may be gzip, bz2 or xz compressed,
+       or the pdb as bytes or a file-like object, see openpdb. Files
+       named .cif or .mmcif are read with cif_reader_columns.
     CAonly: bool
        Flag to only read the alpha-carbons.
     noalc: bool
@@ -28,96 +570,180 @@ def pdb_reader(filename, CAonly=False, noalc=True, chainA=False,
     Output
     ------
     ATOMS: ls
-       ls of ATOM objects that make up the pdb.
+       ls of ATOM objects that make up the pdb, see ATOM for the
+       types of their fields (occupancy is a float)
     """
+    return pdb_reader_columns(filename, CAonly=CAonly, noalc=noalc,
+                              chainA=chainA, chain_name=chain_name,
+                              Verbose=Verbose).tolist()
 
-    ATOM = namedtuple('ATOM', ['atom_index', 'atom_name', 'alc',
-                               'res_name', 'chainID', 'res_index',
-                               'insert_code', 'x', 'y', 'z',
-                               'occupancy', 'temp_factor', 'atom_type'])
 
-    ATOMS = []
-    readatoms = 0
-    with open(filename) as pdb:
-        for line in pdb:
-            if line.startswith('ENDMDL'):
-                if(Verbose):
-                    print("MULTIPLE MODELS...USING MODEL1")
-                return ATOMS
-
-            if line.startswith('ATOM'):
-                atom_index = int(line[7:11])
-                atom_name = line[12:16]
-                if CAonly and not(atom_name.strip() == 'CA'):
-                    continue
-                alc = line[16]  # alternate location
-                if noalc and not((alc == ' ' or alc == 'A')):
-                    continue
-                res_name = line[17:20]
-                chainID = line[21]
-                if chainA and not(chainID == chain_name):
-                    continue
-                res_index = line[22:27].strip(' ')
-                insert_code = line[26]
-                x = float(line[31:38])
-                y = float(line[39:46])
-                z = float(line[47:54])
-                if(len(line) > 54):
-                    occupancy = line[55:60]
-                    temp_factor = float(line[61:66])
-                    atom_type = line[77]
-                else:
-                    occupancy = 1.
-                    temp_factor = 1.
-                    atom_type = ' '
-                ATOMS.append(ATOM(atom_index, atom_name, alc,
-                                  res_name, chainID, res_index, insert_code,
-                                  x, y, z, occupancy, temp_factor, atom_type))
-                readatoms += 1
-
-    print("Read %d atoms from the %s" % (readatoms, filename))
-    return ATOMS
+_fmtspec = re.compile(r'%(-?)(\d+)(?:\.(\d+))?([dfs])')
+
+
+def _digits(values, width, decimals=0):
+    """
+    Formats numbers like '%8.3f' (or '%5d' for decimals=0) into a (n,
+    width) block of ascii codes. Returns None when a value does not fit
+    or lies too close to a rounding tie to be sure to round like %.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        scaled = values.astype(np.int64)
+        sign = scaled < 0
+    else:
+        values = values.astype(float)
+        product = values * 10. ** decimals
+        if not np.all(np.abs(product) < 2. ** 52):
+            return None
+        if np.any(np.abs(np.abs(product - np.trunc(product)) - 0.5) < 1e-6):
+            return None
+        scaled = np.round(product).astype(np.int64)
+        sign = np.signbit(values)
+    mag = np.abs(scaled)
+
+    # fill in the digits from the right, at least up to the units
+    block = np.full((len(values), width), ord(' '), dtype=np.uint8)
+    first = np.full(len(values), width, dtype=np.int64)
+    units = decimals + 1 if decimals else 0
+    for k in range(width):
+        col = width - 1 - k
+        if decimals and k == decimals:
+            block[:, col] = ord('.')
+            continue
+        write = (mag > 0) | (k <= units)
+        block[write, col] = ord('0') + mag[write] % 10
+        first[write] = col
+        mag //= 10
+    first -= 1
+    if np.any(mag > 0) or np.any(sign & (first < 0)):
+        return None
+    block[np.flatnonzero(sign), first[sign]] = ord('-')
+    return block
+
+
+def _fmtcolumn(fmt, column):
+    """
+    Formats a column like fmt % value. Returns a (n, width) block of
+    ascii codes when every line gets the width of fmt, otherwise the
+    formatted strings.
+    """
+    left, width, decimals, kind = _fmtspec.match(fmt).groups()
+    width = int(width)
+    column = np.asarray(column)
+    block = None
+    if kind in 'df' and column.dtype.kind in 'iubf':
+        block = _digits(column, width, int(decimals or 0))
+    elif kind == 's' and column.dtype.kind in 'US' and len(column):
+        text = column
+        if column.dtype.kind == 'U':
+            # narrow the code points of ascii text to bytes
+            nchars = column.dtype.itemsize // 4
+            codes = np.ascontiguousarray(column).view(np.uint32)
+            text = None
+            if nchars and codes.max() < 128:
+                text = codes.astype(np.uint8).view('S%d' % nchars)
+        if text is not None:
+            text = text.astype('S%d' % max(np.char.str_len(text).max(), 1))
+            if text.dtype.itemsize <= width:
+                text = np.char.ljust(text, width) if left else \
+                    np.char.rjust(text, width)
+                block = text.view(np.uint8).reshape((len(text), width))
+    if block is not None:
+        return block
+    return np.char.mod(fmt, column)
+
+
+def _joinlines(pieces, nlines):
+    """
+    Joins formatted columns (blocks of ascii codes, string arrays or
+    literal text) into the text of nlines lines.
+    """
+    if nlines == 0:
+        return ''
+    if all(not isinstance(piece, np.ndarray) or piece.ndim == 2
+           for piece in pieces):
+        blocks = [np.frombuffer(piece.encode('ascii'), dtype=np.uint8)
+                  [None, :].repeat(nlines, axis=0)
+                  if not isinstance(piece, np.ndarray) else piece
+                  for piece in pieces]
+        return np.concatenate(blocks, axis=1).tobytes().decode('ascii')
+    lines = ''
+    for piece in pieces:
+        if isinstance(piece, np.ndarray) and piece.ndim == 2:
+            piece = piece.view('S%d' % piece.shape[1]).ravel().astype(str)
+        lines = np.char.add(lines, piece)
+    return ''.join(lines.tolist())
+
+
+def _atomlines(ATOMS, atomoffset=0):
+    """
+    Formats the ATOM lines of the pdb column by column. Returns the
+    pieces of every line before and after its temp_factor, which is all
+    a recolored copy has to fill in.
+    """
+    head = ['ATOM  ',
+            _fmtcolumn('%5d', np.asarray(ATOMS.atom_index) + atomoffset),
+            ' ', _fmtcolumn('%4s', ATOMS.atom_name),
+            _fmtcolumn('%-1s', ATOMS.alc),
+            _fmtcolumn('%-3s', ATOMS.res_name), ' ',
+            _fmtcolumn('%-1s', ATOMS.chainID),
+            _fmtcolumn('%-4s', ATOMS.res_index),
+            _fmtcolumn('%-1s', ATOMS.insert_code), '   ',
+            _fmtcolumn('%8.3f', ATOMS.x), _fmtcolumn('%8.3f', ATOMS.y),
+            _fmtcolumn('%8.3f', ATOMS.z), '%6.2f' % 1.00]
+    tail = [_fmtcolumn('%12s', ATOMS.atom_type), '  \n']
+    return head, tail
+
+
+def pdb_writer_colored(ATOMS, colorings, msg="HEADER  FROM PDBIO\n",
+                       modelnum=1, atomoffset=0, mode="w"):
+    """
+    Writes several copies of a pdb that only differ in their temp_factor
+    (e.g., colored by pctdfi and pctfdfi). Everything else of the ATOM
+    lines is formatted once and shared by all of them.
+
+    Input
+    -----
+    ATOMS: AtomArray or ls
+       ATOM entries of the pdb
+    colorings: ls
+       (filename, temp_factor) pairs, temp_factor holding a value for
+       every atom
+    msg, modelnum, atomoffset, mode:
+       See pdb_writer
+    """
+    ATOMS = AtomArray.from_atoms(ATOMS)
+    head, tail = _atomlines(ATOMS, atomoffset=atomoffset)
+    for filename, temp_factor in colorings:
+        with open(filename, mode) as pdb:
+            pdb.write(msg + "MODEL %d\n" % modelnum + "PARENT N/A\n" +
+                      _joinlines(head + [_fmtcolumn('%6.2f', temp_factor)] +
+                                 tail, len(ATOMS)) + "TER\nEND\n")
+        print("Wrote out to file, %s" % filename)
 
 
 def pdb_writer(ATOMS, msg="HEADER  FROM PDBIO\n", filename="out.pdb",
                modelnum=1, atomoffset=0, residueoffset=0, mode="w"):
+    """
+    Writes the ATOM entries to a pdb file. The lines are formatted a
+    column at a time and written in one call.
 
-    with open(filename, mode) as pdb:
-        pdb.write(msg)
-        pdb.write("MODEL %d\n" % modelnum)
-        pdb.write("PARENT N/A\n")
-        for atom in ATOMS:
-            record = 'ATOM  '
-            atom_index = atom.atom_index + atomoffset
-            atom_name = atom.atom_name
-            alc = atom.alc
-            res_name = atom.res_name
-            chainID = atom.chainID
-            res_index = atom.res_index
-            iCode = atom.insert_code
-            x = atom.x
-            y = atom.y
-            z = atom.z
-            occupancy = 1.00
-            temp_factor = atom.temp_factor
-            atom_type = atom.atom_type
-            atom1 = "{}{:5d} {:>4s}{:<1s}{:3s} {:<1s}{:4s}{:<1s}".format(
-                record,
-                atom_index,
-                atom_name,
-                alc,
-                res_name,
-                chainID,
-                res_index,
-                iCode)
-            atom2 = "   {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}{:>12s}  \n".format(
-                x,
-                y,
-                z,
-                occupancy,
-                temp_factor,
-                atom_type)
-            pdb.write(atom1 + atom2)
-        pdb.write("TER\n")
-        pdb.write("END\n")
-    print("Wrote out to file, %s" % filename)
+    Input
+    -----
+    ATOMS: AtomArray or ls
+       ATOM entries of the pdb
+    msg: str
+       Header of the file
+    filename: str
+       Name of pdb file
+    modelnum: int
+       Number of the MODEL record
+    atomoffset: int
+       Offset added to the atom indices
+    mode: str
+       "w" to write a new file or "a" to append
+    """
+    ATOMS = AtomArray.from_atoms(ATOMS)
+    pdb_writer_colored(ATOMS, [(filename, ATOMS.temp_factor)], msg=msg,
+                       modelnum=modelnum, atomoffset=atomoffset, mode=mode)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Sequence Search
+===============
+
+Description
+-----------
+Offline search of uniprot sequences against the chains of the PDB, as a
+local stand-in for the blastp search of unipro_blast_to_pdb.py.
+
+The chains of a PDB seqres fasta file (pdb_seqres.txt) are indexed by
+their k-mers. A query only scores the chains that share the most k-mers
+with it, aligned with fastaseq.align_residues for the identity and
+coverage of the hit. The hits are written in the table of
+parseBlastFile:
+
+Uniprot|PDBid|chain|query_to|query_from|IterQueryLen|e-value|QueryCov|SeqId
+
+The k-mer search has no e-values, that column is left empty.
+
+Usage
+-----
+```
+seqsearch.py SEQRESFILE QUERYFASTA [--nprocs NPROCS]
+```
+
+Output
+-------
+- Uniprot.csv for every sequence in QUERYFASTA
+"""
+from __future__ import print_function, division
+import sys
+import argparse
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import dfi.fastaseq as fastaseq
+
+hit_columns = ['Uniprot', 'PDBid', 'chain', 'query_to', 'query_from',
+               'IterQueryLen', 'e-value', 'QueryCov', 'SeqId']
+
+_INDEX = None  # the SeqresIndex of a worker
+
+
+def _chainid(header):
+    """pdbID and chain of a seqres header (101m_A, 1L2Y:A|PDBID|...)"""
+    ID = fastaseq.fastaid(header)
+    for sep in ('_', ':'):
+        if sep in ID:
+            pdbid, chain = ID.split(sep, 1)
+            return pdbid.upper(), chain
+    return ID.upper(), ''
+
+
+def read_seqres(fname):
+    """
+    Reads the protein chains of a PDB seqres fasta file, entries marked
+    as mol:na are skipped
+
+    Output
+    ------
+    chains: ls
+       (pdbid, chain, sequence) of every protein chain
+    """
+    chains = []
+    with open(fname, 'r') as infile:
+        for header, seq in _fastaentries(infile):
+            if seq and 'mol:na' not in header.split():
+                chains.append(_chainid(header) + (seq,))
+    return chains
+
+
+def _fastaentries(lines):
+    """Yields the header and sequence of every fasta entry"""
+    header, seq = None, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('>'):
+            if header is not None:
+                yield header, ''.join(seq)
+            header, seq = line[1:], []
+        elif line:
+            seq.append(line)
+    if header is not None:
+        yield header, ''.join(seq)
+
+
+class SeqresIndex(object):
+    """
+    Seqres Index
+    ============
+
+    Sorted k-mer index of the distinct sequences of the PDB chains.
+
+    Input
+    -----
+    chains: str or ls
+       seqres fasta file or (pdbid, chain, sequence) of the chains
+    k: int
+       length of the k-mers
+    """
+
+    def __init__(self, chains, k=4):
+        if isinstance(chains, str):
+            chains = read_seqres(chains)
+        self.k = k
+        # identical chains (e.g., of homo-oligomers) are scored once
+        members = OrderedDict()
+        for pdbid, chain, seq in chains:
+            members.setdefault(seq.upper(), []).append((pdbid, chain))
+        self.seqs = list(members)
+        self.members = list(members.values())
+
+        lengths = np.array([len(seq) for seq in self.seqs], dtype=np.int64)
+        self.starts = np.r_[0, np.cumsum(lengths + 1)[:-1]]
+        kmers = fastaseq.kmercodes('X'.join(self.seqs), k)
+        positions = np.flatnonzero(kmers >= 0)
+        order = np.argsort(kmers[positions], kind='stable')
+        self.kmers = kmers[positions[order]]
+        self.positions = positions[order]
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def candidates(self, query, maxcandidates=50, minkmers=2):
+        """
+        Sequences that share the most distinct k-mers with query
+
+        Output
+        ------
+        seqids, nshared: numpy
+           index of the candidate sequences and the number of k-mers
+           they share with query, most shared first
+        """
+        qkmers = fastaseq.kmercodes(query.upper(), self.k)
+        qidx, ipos = fastaseq.kmerlookup(self.kmers, qkmers)
+        seqids = np.searchsorted(self.starts, self.positions[ipos],
+                                 side='right') - 1
+        pairs = np.unique(seqids * len(qkmers) + qidx)
+        nshared = np.bincount(pairs // max(len(qkmers), 1),
+                              minlength=len(self.seqs))
+        seqids = np.flatnonzero(nshared >= minkmers)
+        order = np.argsort(-nshared[seqids], kind='stable')[:maxcandidates]
+        return seqids[order], nshared[seqids[order]]
+
+    def score(self, query, seqid):
+        """
+        Aligns query on a sequence of the index
+
+        Output
+        ------
+        query_from, query_to: int
+           first and last aligned residue of query (from 1)
+        identity: float
+           percent of identical residues over the aligned columns,
+           gaps included
+        """
+        query = query.upper()
+        target = self.seqs[seqid]
+        mapping = fastaseq.align_residues(query, target, k=self.k)
+        mapped = np.flatnonzero(mapping >= 0)
+        if not len(mapped):
+            return None
+        qfrom, qto = mapped[0], mapped[-1]
+        columns = (qto - qfrom + 1) + (mapping[qto] - mapping[qfrom] + 1) \
+            - len(mapped)
+        qres = np.frombuffer(query.encode('ascii'), dtype=np.uint8)
+        tres = np.frombuffer(target.encode('ascii'), dtype=np.uint8)
+        identities = np.sum(qres[mapped] == tres[mapping[mapped]])
+        return qfrom + 1, qto + 1, 100. * identities / columns
+
+    def search(self, code, query, maxcandidates=50, minkmers=2):
+        """
+        Top hits of a query in the PDB chains
+
+        Input
+        -----
+        code: str
+           uniprotID of the query
+        query: str
+           sequence of the query
+        maxcandidates: int
+           number of distinct sequences that are aligned
+        minkmers: int
+           k-mers a sequence has to share with query to be aligned
+
+        Output
+        ------
+        hits: DataFrame
+           hits in the columns of parseBlastFile, best first
+        """
+        rows = []
+        seqids, nshared = self.candidates(query, maxcandidates, minkmers)
+        for seqid in seqids:
+            scored = self.score(query, seqid)
+            if scored is None:
+                continue
+            qfrom, qto, identity = scored
+            coverage = round(100. * (qto - qfrom) / len(query), 0)
+            for pdbid, chain in self.members[seqid]:
+                rows.append((code, pdbid, chain, qto, qfrom, len(query),
+                             np.nan, coverage, int(round(identity, 0))))
+        hits = pd.DataFrame(rows, columns=hit_columns)
+        return hits.sort_values(by=['SeqId', 'QueryCov'], ascending=False,
+                                kind='stable').reset_index(drop=True)
+
+
+def _initworker(index):
+    """Pool initializer: keeps the index in the worker"""
+    global _INDEX
+    _INDEX = index
+
+
+def _searchworker(args):
+    """Searches one query and writes it out like parseBlastFile"""
+    code, query, maxcandidates, writetofile = args
+    hits = _INDEX.search(code, query, maxcandidates=maxcandidates)
+    if(writetofile):
+        hits.to_csv(code + '.csv', index=False)
+    return code, hits
+
+
+def search_batch(queries, index, nprocs=None, maxcandidates=50,
+                 writetofile=True, Verbose=False):
+    """
+    Searches many uniprot sequences in a pool of processes that share
+    the index.
+
+    Input
+    -----
+    queries: dict or str
+       sequence of every uniprotID, or a fasta file with them
+    index: SeqresIndex or str
+       index or the seqres fasta file to build it from
+    nprocs: int
+       number of processes, None for all cores and 1 to run serially
+       in this process
+    maxcandidates: int
+       number of distinct sequences aligned per query
+    writetofile: bool
+       write the hits of every query to Uniprot.csv
+    Verbose: bool
+       print every query as it finishes
+
+    Output
+    ------
+    hits: OrderedDict
+       DataFrame of the hits of every query, see SeqresIndex.search
+    """
+    if isinstance(queries, str):
+        queries = fastaseq.read_fasta(queries)
+    if not isinstance(index, SeqresIndex):
+        index = SeqresIndex(index)
+    tasks = [(code, query, maxcandidates, writetofile)
+             for code, query in queries.items()]
+
+    hits = OrderedDict((code, None) for code in queries)
+    if nprocs == 1:
+        _initworker(index)
+        results = map(_searchworker, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(nprocs, initializer=_initworker,
+                                    initargs=(index,))
+        results = pool.imap_unordered(_searchworker, tasks)
+    try:
+        for code, df in results:
+            hits[code] = df
+            if(Verbose):
+                print("%s: %d hits" % (code, len(df)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return hits
+
+
+def check_args(args=None):
+    """
+    Parse command lines input
+
+    Output
+    ------
+    seqres: str
+       seqres fasta file of the PDB
+    fastafile: str
+       fasta file of the uniprot sequences
+    nprocs: int
+       number of processes
+    """
+    parser = argparse.ArgumentParser(
+        description='Search uniprot sequences in the PDB offline')
+    parser.add_argument('seqres',
+                        help='PDB seqres fasta file (pdb_seqres.txt)')
+    parser.add_argument('fastafile',
+                        help='fasta file of the uniprot sequences')
+    parser.add_argument('--nprocs',
+                        help='number of processes (default all cores)',
+                        type=int)
+    results = parser.parse_args(args)
+    return results.seqres, results.fastafile, results.nprocs
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit()
+    seqres, fastafile, nprocs = check_args(sys.argv[1:])
+    search_batch(fastafile, seqres, nprocs=nprocs, Verbose=True)
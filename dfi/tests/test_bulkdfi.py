@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import shutil
+import numpy as np
+import pandas as pd
+import dfi.bulkdfi
+import dfi.dfi_calc
+from dfi.datafiles import example_pdb, example_covar
+
+
+def test_bulk_dfi(tmp_path, monkeypatch):
+    covar = np.loadtxt(example_covar)
+    shutil.copy(example_covar, str(tmp_path / 'w0_mwcovarmat.dat'))
+    np.save(str(tmp_path / 'w1_mwcovarmat.npy'), 2. * covar)
+    np.save(str(tmp_path / 'w2_mwcovarmat.npy'), covar + np.eye(60))
+    monkeypatch.chdir(tmp_path)
+
+    dfi.bulkdfi.bulk_dfi(example_pdb, nprocs=2)
+    for window in ['w0', 'w1', 'w2']:
+        covar = [name for name in ['_mwcovarmat.dat', '_mwcovarmat.npy']
+                 if (tmp_path / (window + name)).exists()][0]
+        df_bulk = pd.read_csv(window + '-dfianalysis.csv')
+        df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, covar=window + covar)
+        assert np.allclose(df_bulk.dfi, df_dfi.dfi)
+        assert np.all(df_bulk.pctdfi == df_dfi.pctdfi)
+
+    # a window converted to binary is only computed once
+    covar = np.loadtxt(example_covar)
+    np.save(str(tmp_path / 'w0_mwcovarmat.npy'), covar)
+    covar.tofile(str(tmp_path / 'w3_mwcovarmat.raw'))
+    assert dfi.bulkdfi._covar_files() == ['w0_mwcovarmat.npy',
+                                          'w1_mwcovarmat.npy',
+                                          'w2_mwcovarmat.npy',
+                                          'w3_mwcovarmat.raw']
+
+    results = list(dfi.bulkdfi.bulk_dfi_iter(
+        example_pdb, ['w1_mwcovarmat.npy'], ['serial.csv'], nprocs=1))
+    assert results == [('w1_mwcovarmat.npy', 'serial.csv')]
+    assert pd.read_csv('serial.csv').equals(
+        pd.read_csv('w1-dfianalysis.csv'))
+
+
+def test_bulk_dfi_stack(tmp_path, monkeypatch):
+    covar = np.loadtxt(example_covar)
+    np.save(str(tmp_path / 'w0_mwcovarmat.npy'), covar)
+    np.save(str(tmp_path / 'w1_mwcovarmat.npy'), covar + np.eye(60))
+    monkeypatch.chdir(tmp_path)
+
+    stack = dfi.bulkdfi.bulk_dfi_stack(example_pdb, ls_reschain=['A10'])
+    df_stack = pd.read_csv('bulk-stackdfi.csv')
+    assert list(df_stack.window.unique()) == ['w0', 'w1']
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, covar=covar + np.eye(60),
+                                   ls_reschain=['A10'])
+    assert np.allclose(df_stack[df_stack.window == 'w1'].fdfi, df_dfi.fdfi)
+    assert np.allclose(stack.dfi[1], df_dfi.dfi)
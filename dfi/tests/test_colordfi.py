@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import numpy as np
+import dfi.dfi_calc
+import dfi.colordfi
+import dfi.pdbio
+from dfi.datafiles import example_pdb
+
+
+def test_colorbydfi(tmp_path):
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb)
+    outfile = str(tmp_path / '1l2y-dficolor.pdb')
+    ATOMS = dfi.colordfi.colorbydfi(df_dfi, example_pdb, outfile=outfile)
+    assert len(ATOMS) == 305
+
+    # every atom carries the value of its residue, the stray chain B
+    # atom has no residue in the analysis
+    pctdfi = dict(zip(df_dfi.ResI, df_dfi.pctdfi))
+    for atom in ATOMS:
+        if atom.chainID == 'A':
+            assert atom.temp_factor == pctdfi[atom.res_index]
+        else:
+            assert atom.temp_factor == 0.
+
+    colored = dfi.pdbio.pdb_reader_columns(outfile)
+    assert np.allclose(colored.temp_factor, np.round(ATOMS.temp_factor, 2))
+
+
+def test_colorbydfi_variants(tmp_path):
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, ls_reschain=['A10'])
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_pdb)
+    outfiles = [str(tmp_path / 'dfi.pdb'), str(tmp_path / 'fdfi.pdb')]
+    COLORED = dfi.colordfi.colorbydfi(df_dfi, ATOMS,
+                                      colorbyparam=['pctdfi', 'pctfdfi'],
+                                      outfile=outfiles)
+    for param, outfile, COLOR in zip(['pctdfi', 'pctfdfi'], outfiles,
+                                     COLORED):
+        single = str(tmp_path / 'single.pdb')
+        dfi.colordfi.colorbydfi(df_dfi, ATOMS, colorbyparam=param,
+                                outfile=single)
+        with open(outfile) as variant, open(single) as alone:
+            assert variant.read() == alone.read()
+    assert not np.allclose(COLORED[0].temp_factor, COLORED[1].temp_factor)
+
+
+def test_colorbydfi_name(tmp_path):
+    import shutil
+    import pytest
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb)
+    pdbfile = str(tmp_path / '1l2y.pdb')
+    shutil.copy(example_pdb, pdbfile)
+    dfi.colordfi.colorbydfi(df_dfi, pdbfile)
+    assert (tmp_path / '1l2y-dficolor.pdb').exists()
+    with pytest.raises(ValueError, match='outfile is needed'):
+        dfi.colordfi.colorbydfi(df_dfi, dfi.pdbio.pdb_reader_columns(pdbfile))
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+import dfi
+from dfi.datafiles import example_pdb
+from scipy import linalg as LA
+
+
+def _getxyz():
+    ATOMS = dfi.pdbio.pdb_reader(example_pdb, CAonly=True)
+    return dfi.dfi_calc.getcoords(ATOMS)
+
+
+def test_covariance_matches_svd():
+    x, y, z = _getxyz()
+    numres = len(x)
+    hess = dfi.dfi_calc.calchessian(numres, x, y, z, 100)
+    U, w, Vt = LA.svd(hess)
+    invw = np.where(w < 1e-6, 0., 1 / w)
+    svdinv = np.dot(np.dot(U, np.diag(invw)), Vt)
+
+    invHrs = dfi.dfi_calc.calc_covariance(numres, x, y, z, check=True)
+    assert invHrs.shape == (3 * numres, 3 * numres)
+    assert np.allclose(invHrs, svdinv)
+
+
+def test_covariance_sparse():
+    x, y, z = _getxyz()
+    numres = len(x)
+    for cutoff in [10., 15.]:
+        dense = dfi.dfi_calc.calc_covariance(numres, x, y, z, cutoff=cutoff,
+                                             sparse=False)
+        invHrs = dfi.dfi_calc.calc_covariance(numres, x, y, z,
+                                              cutoff=cutoff, check=True)
+        assert np.allclose(invHrs, dense)
+    with pytest.raises(ValueError, match='more than 6 zero modes'):
+        dfi.dfi_calc.calc_covariance(numres, x, y, z, cutoff=8.)
+
+    results = dfi.dfi_calc._argparser().parse_args(
+        ['--pdb', example_pdb, '--cutoff', '10', '--nmodes', '20'])
+    assert (results.cutoff, results.nmodes) == (10., 20)
+
+
+def test_covariance_lowrank():
+    x, y, z = _getxyz()
+    numres = len(x)
+    nmodes = 20
+    w, V = LA.eigh(dfi.dfi_calc.calchessian(numres, x, y, z, 100))
+    soft = V[:, 6:6 + nmodes] / np.sqrt(w[6:6 + nmodes])
+    truncated = np.dot(soft, soft.T)
+
+    lowrank = dfi.dfi_calc.calc_covariance(numres, x, y, z, nmodes=nmodes)
+    assert lowrank.factor.shape == (3 * numres, nmodes)
+    assert np.allclose(lowrank.evals, w[6:6 + nmodes])
+    assert np.isclose(lowrank.truncerr, w[6] / w[6 + nmodes])
+    assert np.allclose(np.dot(lowrank.factor, lowrank.factor.T), truncated)
+
+    direct = np.eye(3)
+    assert np.allclose(
+        dfi.dfi_calc.calcperturbMat(lowrank, direct, numres),
+        dfi.dfi_calc.calcperturbMat(truncated, direct, numres))
+
+    sparse = dfi.dfi_calc.calc_covariance(numres, x, y, z, nmodes=nmodes,
+                                          cutoff=10.)
+    assert np.all(np.diff(sparse.evals) >= 0)
+    assert 0 < sparse.truncerr < 1
+
+
+def test_covariance_outofcore(tmpdir):
+    x, y, z = _getxyz()
+    numres = len(x)
+    invHrs = dfi.dfi_calc.calc_covariance(numres, x, y, z)
+    outfile = str(tmpdir.join('covar.npy'))
+    mapped = dfi.dfi_calc.calc_covariance(numres, x, y, z, outfile=outfile,
+                                          memlimit=0.005)
+    assert isinstance(mapped, np.memmap)
+    assert np.allclose(np.load(outfile), invHrs)
+
+    direct = np.eye(3)
+    perturbMat = dfi.dfi_calc.calcperturbMat(invHrs, direct, numres)
+    perturbfile = str(tmpdir.join('perturb.npy'))
+    mapped = dfi.dfi_calc.calcperturbMat(mapped, direct, numres,
+                                         outfile=perturbfile, memlimit=0.005)
+    assert np.isfortran(mapped)
+    assert np.allclose(np.load(perturbfile), perturbMat)
+
+
+def test_covariance_tiles(tmpdir):
+    rs = np.random.RandomState(0)
+    V = rs.normal(size=(700, 700))
+    scale = rs.uniform(size=700)
+    covar = np.dot(V * scale, V.T)
+    # 0.1 MB gives uneven tiles of 9 rows, no memlimit tiles of 256
+    for memlimit in [0.1, None]:
+        outfile = str(tmpdir.join('covar%s.npy' % memlimit))
+        mapped = dfi.dfi_calc._covariance_tofile(outfile, V, scale,
+                                                 memlimit)
+        assert np.allclose(np.load(outfile), covar)
+    assert dfi.dfi_calc._tilesize(700, 0.1) == 9
+    assert dfi.dfi_calc._tilesize(700, None) == 256
+
+    x, y, z = _getxyz()
+    lowrank = dfi.dfi_calc.calc_covariance(len(x), x, y, z, nmodes=10)
+    mapped = dfi.dfi_calc.calc_covariance(len(x), x, y, z, nmodes=10,
+                                          outfile=str(tmpdir.join('lr.npy')),
+                                          memlimit=0.005)
+    assert np.allclose(mapped, np.dot(lowrank.factor, lowrank.factor.T))
+
+
+def test_calc_dfi_outofcore(tmpdir):
+    df_dfi = dfi.calc_dfi(example_pdb, ls_reschain=['A10'])
+    df_ooc = dfi.calc_dfi(example_pdb, ls_reschain=['A10'],
+                          scratchdir=str(tmpdir), memlimit=0.005)
+    assert np.allclose(df_dfi.dfi.values, df_ooc.dfi.values)
+    assert np.allclose(df_dfi.fdfi.values, df_ooc.fdfi.values)
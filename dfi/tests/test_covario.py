@@ -0,0 +1,60 @@
+import numpy as np
+import dfi
+from dfi.covario import covar_reader, covar_converter
+from dfi.datafiles import example_covar, example_pdb
+
+
+def test_covar_formats(tmpdir):
+    covar = np.loadtxt(example_covar)
+    assert np.all(covar_reader(example_covar) == covar)
+
+    npyfile = str(tmpdir.join('1l2y_mwcovarmat.npy'))
+    covar_converter(example_covar, npyfile)
+    mapped = covar_reader(npyfile)
+    assert isinstance(mapped, np.memmap)
+    assert np.all(mapped == covar)
+
+    npzfile = str(tmpdir.join('1l2y_mwcovarmat.npz'))
+    np.savez(npzfile, covar=covar)
+    mapped = covar_reader(npzfile)
+    assert isinstance(mapped, np.memmap)
+    assert np.all(mapped == covar)
+    np.savez_compressed(npzfile, covar=covar)
+    assert np.all(covar_reader(npzfile, key='covar') == covar)
+
+    rawfile = str(tmpdir.join('1l2y_mwcovarmat.f32'))
+    covar_converter(example_covar, rawfile, dtype=np.float32)
+    mapped = covar_reader(rawfile)
+    assert mapped.dtype == np.float32
+    assert np.allclose(mapped, covar)
+
+    # a header and blank lines are skipped like np.loadtxt does
+    txtfile = str(tmpdir.join('header.dat'))
+    np.savetxt(txtfile, covar, header='covariance\n\n3N x 3N')
+    with open(txtfile) as infile:
+        text = infile.read()
+    with open(txtfile, 'w') as outfile:
+        outfile.write('\n' + text.replace('\n', '\n\n', 3))
+    covar_converter(txtfile, npyfile)
+    assert np.all(covar_reader(npyfile) == covar)
+
+
+def test_covar_npz_member(tmpdir):
+    # the second member starts past 64 KiB into the archive
+    npzfile = str(tmpdir.join('windows.npz'))
+    rs = np.random.RandomState(0)
+    first, second = rs.normal(size=(2, 120, 120))
+    np.savez(npzfile, first=first, second=second)
+    mapped = covar_reader(npzfile, key='second')
+    assert isinstance(mapped, np.memmap)
+    assert np.all(mapped == second)
+
+
+def test_calc_dfi_npy_covar(tmpdir):
+    npyfile = str(tmpdir.join('1l2y_mwcovarmat.npy'))
+    covar_converter(example_covar, npyfile)
+    df_ascii = dfi.calc_dfi(example_pdb, covar=example_covar,
+                            ls_reschain=['A10'])
+    df_npy = dfi.calc_dfi(example_pdb, covar=npyfile, ls_reschain=['A10'])
+    assert np.allclose(df_ascii.dfi.values, df_npy.dfi.values)
+    assert np.allclose(df_ascii.fdfi.values, df_npy.fdfi.values)
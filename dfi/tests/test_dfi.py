@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 import dfi
 from dfi.datafiles import example_pdb
 from dfi.dfi_calc import check_args
@@ -25,3 +26,133 @@ def test_comlineargs():
     assert pdbfile == example_pdb
     assert covar == 'mwcovar.dat'
     assert np.all(ls_reschain == np.array(['A19', 'A10']))
+
+
+def test_perturbmat():
+    from dfi.datafiles import example_covar
+
+    invHrs = np.loadtxt(example_covar)
+    resnum = len(invHrs) // 3
+    direct = np.vstack(([1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0],
+                        [1, 0, 1], [0, 1, 1], [1, 1, 1]))
+    direct = direct / np.linalg.norm(direct, axis=1)[:, None]
+    loopMat = np.zeros((resnum, resnum))
+    for peturbDir in direct:
+        for j in range(resnum):
+            delforce = np.zeros(3 * resnum)
+            delforce[3 * j:3 * j + 3] = peturbDir
+            delXperbMat = np.dot(invHrs, delforce).reshape((resnum, 3))
+            loopMat[:, j] += np.linalg.norm(delXperbMat, axis=1)
+    loopMat /= np.sum(loopMat)
+
+    perturbMat = dfi.dfi_calc.calcperturbMat(invHrs, direct, resnum)
+    assert np.allclose(perturbMat, loopMat)
+
+
+def test_perturbsums():
+    from dfi.datafiles import example_covar
+
+    invHrs = np.loadtxt(example_covar)
+    resnum = len(invHrs) // 3
+    direct = np.eye(3)
+    fdfires = np.array([2, 9, 15])
+    perturbMat = dfi.dfi_calc.calcperturbMat(invHrs, direct, resnum)
+    dfisum, fdfisum = dfi.dfi_calc.calcperturbSums(
+        invHrs, direct, resnum, fdfires=fdfires, blocksize=7)
+    assert np.allclose(dfisum, np.sum(perturbMat, axis=1))
+    assert np.allclose(fdfisum, np.sum(perturbMat[:, fdfires], axis=1))
+
+
+def test_lowmem_calc_dfi():
+    df_dfi = dfi.calc_dfi(example_pdb, ls_reschain=['A10'])
+    df_low = dfi.calc_dfi(example_pdb, ls_reschain=['A10'], lowmem=True)
+    assert np.allclose(df_dfi.dfi.values, df_low.dfi.values)
+    assert np.allclose(df_dfi.fdfi.values, df_low.fdfi.values)
+
+
+def test_pctrank_ties():
+    a = np.random.RandomState(0).randint(0, 10, size=50)
+    lena = float(len(a))
+    for inverse in [False, True]:
+        if inverse:
+            loop = [np.sum(a >= m) / lena for m in a]
+        else:
+            loop = [np.sum(a <= m) / lena for m in a]
+        assert np.all(dfi.dfi_calc.pctrank(a, inverse=inverse) ==
+                      np.array(loop))
+
+
+def test_dfianal_profiles():
+    profiles = np.random.RandomState(1).rand(4, 25)
+    dfis, dfirels, dfipercs, dfizscores = dfi.dfi_calc.dfianal(
+        profiles, Array=True)
+    assert dfipercs.shape == profiles.shape
+    for k, profile in enumerate(profiles):
+        row = dfi.dfi_calc.dfianal(profile, Array=True)
+        assert np.allclose(dfirels[k], row[1])
+        assert np.all(dfipercs[k] == row[2])
+        assert np.allclose(dfizscores[k], row[3])
+
+
+def test_ensemble(capsys):
+    df_serial = dfi.dfi_calc.calc_dfi_ensemble(example_pdb, nprocs=1)
+    assert capsys.readouterr().out == ''
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, ensemble=True, nprocs=2,
+                                   Verbose=True)
+    assert 'Read 38 models' in capsys.readouterr().out
+    assert len(df_dfi) == 20
+    assert np.all(df_dfi.nmodels == 38)
+    assert np.allclose(df_dfi.dfi, df_serial.dfi)
+    assert np.all(df_dfi.dfi_std > 0)
+
+    ATOMS = dfi.pdbio.pdb_models(example_pdb, CAonly=True)
+    x, y, z = dfi.dfi_calc.getcoords(next(ATOMS))
+    dfi1 = dfi.dfi_calc._model_dfi((x, y, z, None, None, None))
+    df_first = dfi.dfi_calc.calc_dfi(example_pdb)
+    assert np.allclose(dfi1, df_first.dfi)
+
+    for options in [{'ls_reschain': ['A10']}, {'covar': np.eye(60)},
+                    {'cache': 'cachedir'}, {'colorpdb': True}]:
+        with pytest.raises(ValueError, match='ensemble does not support'):
+            dfi.dfi_calc.calc_dfi(example_pdb, ensemble=True, nprocs=1,
+                                  **options)
+    df_lowrank = dfi.dfi_calc.calc_dfi(example_pdb, ensemble=True, nprocs=1,
+                                       nmodes=20, memlimit=0.01)
+    assert not np.allclose(df_lowrank.dfi, df_serial.dfi)
+
+
+def test_calc_dfi_stream():
+    import io
+    import gzip
+    with open(example_pdb, 'rb') as infile:
+        stream = io.BytesIO(gzip.compress(infile.read()))
+    df_dfi = dfi.dfi_calc.calc_dfi(stream)
+    assert np.allclose(df_dfi.dfi, dfi.dfi_calc.calc_dfi(example_pdb).dfi)
+
+
+def test_calc_dfi_stack():
+    from dfi.datafiles import example_covar
+    covar = np.loadtxt(example_covar)
+    rs = np.random.RandomState(0)
+    noise = rs.normal(size=(3, 60, 60))
+    covars = covar + 0.01 * np.matmul(noise, noise.transpose((0, 2, 1)))
+    stack = dfi.dfi_calc.calc_dfi_stack(example_pdb, covars,
+                                        ls_reschain=['A10', 'A12'],
+                                        memlimit=0.2)
+    assert stack.dfi.shape == (3, 20)
+    for window in range(3):
+        df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, covar=covars[window],
+                                       ls_reschain=['A10', 'A12'])
+        assert np.allclose(stack.dfi[window], df_dfi.dfi)
+        assert np.allclose(stack.fdfi[window], df_dfi.fdfi)
+        assert np.all(stack.pctfdfi[window] == df_dfi.pctfdfi)
+
+    stack = dfi.dfi_calc.calc_dfi_stack(example_pdb, [example_covar, covar])
+    assert stack.fdfi is None
+    assert np.all(stack.dfi[0] == stack.dfi[1])
+    df_stack = dfi.dfi_calc.stack_frame(
+        dfi.pdbio.pdb_reader_columns(example_pdb, CAonly=True), stack,
+        labels=['a', 'b'])
+    assert len(df_stack) == 40
+    assert list(df_stack.columns) == ['window', 'ResI', 'ChainID', 'Res',
+                                      'R', 'dfi', 'pctdfi']
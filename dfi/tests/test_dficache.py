@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+import dfi.dfi_calc
+import dfi.dficache
+import dfi.pdbio
+from dfi.datafiles import example_pdb
+
+
+def test_cache_keys():
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_pdb, CAonly=True)
+    key = dfi.dficache.covar_key(ATOMS)
+    assert key == dfi.dficache.covar_key(ATOMS.copy())
+    assert key != dfi.dficache.covar_key(ATOMS, cutoff=10.)
+    assert key != dfi.dficache.covar_key(ATOMS.copy(x=ATOMS.x + 1e-3))
+    direct = dfi.dfi_calc.perturbdirections()
+    assert (dfi.dficache.perturb_key(key, direct) !=
+            dfi.dficache.perturb_key(key, direct[:3]))
+
+
+def test_cache_eviction(tmp_path):
+    cache = dfi.dficache.DFICache(str(tmp_path), maxsize=0.03)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, np.full((40, 40), i, dtype=np.float64))
+        os.utime(cache.path(key), (i, i))
+    assert 'a' not in cache
+    assert cache.get('b') is not None
+    cache.put('d', np.zeros((40, 40)))
+    assert 'c' not in cache and 'b' in cache and 'd' in cache
+    assert np.all(cache.get('b') == 1)
+    assert cache.get('a') is None
+    assert not [fname for fname in os.listdir(str(tmp_path))
+                if fname.endswith('.tmp')]
+
+
+def test_calc_dfi_cache(tmp_path):
+    cachedir = str(tmp_path / 'cache')
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, ls_reschain=['A10'])
+    df_first = dfi.dfi_calc.calc_dfi(example_pdb, ls_reschain=['A10'],
+                                     cache=cachedir)
+    cache = dfi.dficache.DFICache(cachedir)
+    assert len(cache.entries()) == 2
+    df_cached = dfi.dfi_calc.calc_dfi(example_pdb, ls_reschain=['A10'],
+                                      cache=cache)
+    assert len(cache.entries()) == 2
+    for df in [df_first, df_cached]:
+        assert np.allclose(df.dfi, df_dfi.dfi)
+        assert np.allclose(df.fdfi, df_dfi.fdfi)
+    df_lowmem = dfi.dfi_calc.calc_dfi(example_pdb, lowmem=True,
+                                      cache=cache)
+    assert np.allclose(df_lowmem.dfi, df_dfi.dfi)
+    dfi.dfi_calc.calc_dfi(example_pdb, cutoff=12., cache=cache)
+    assert len(cache.entries()) == 4
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import dfi
+from dfi.datafiles import example_pdb
+
+
+def test_fdfi_queries():
+    df_dfi = dfi.calc_dfi(example_pdb, ls_reschain=['A10', 'A19'])
+    model = dfi.DFIModel.from_pdb(example_pdb)
+    assert np.allclose(model.dfi, df_dfi.dfi.values)
+    assert np.allclose(model.fdfi(['A19', 'A10']), df_dfi.fdfi.values)
+
+    fdfisets = [['A3'], ['A10', 'A19'], ['A1', 'A2', 'A20']]
+    fdfi = model.fdfi_sets(fdfisets)
+    assert fdfi.shape == (3, model.numres)
+    assert np.allclose(fdfi[1], df_dfi.fdfi.values)
+
+    df_sets = model.fdfi_frame(fdfisets)
+    df_set = df_sets[df_sets.fdfiset == 'A10 A19']
+    for col in ['fdfi', 'pctfdfi', 'ravg', 'rmin']:
+        assert np.allclose(df_set[col].values, df_dfi[col].values)
+
+
+def test_fdfisets_file(tmpdir):
+    setsfile = tmpdir.join('sets.txt')
+    setsfile.write("# binding sites\nA10\nA19, A20\n\nA1 A2 A3\n")
+    fdfisets = dfi.dfi_calc.read_fdfisets(str(setsfile))
+    assert fdfisets == [['A10'], ['A19', 'A20'], ['A1', 'A2', 'A3']]
+
+    pdbid = str(tmpdir.join('1l2y'))
+    dfi.calc_dfi(example_pdb, pdbid=pdbid, fdfisets=fdfisets,
+                 writetofile=True)
+    df_sets = pd.read_csv(pdbid + '-fdfisets.csv')
+    assert len(df_sets) == 3 * 20
+
+    df_dfi, df_returned = dfi.calc_dfi(example_pdb, fdfisets=fdfisets,
+                                       return_sets=True)
+    assert len(df_dfi) == 20 and not df_dfi.attrs
+    assert list(df_returned.columns) == list(df_sets.columns)
+    assert np.all(df_returned.ResI.astype(int) == df_sets.ResI)
+    assert np.allclose(df_returned.fdfi, df_sets.fdfi)
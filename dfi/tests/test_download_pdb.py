@@ -14,3 +14,80 @@ class TestPDBDownloader():
     def test_pdb_file(self):
         pdbid = TestPDBDownloader.pdbid
         fetch_pdb(pdbid, writetofile=True, Verbose=True)
+
+
+def _pdbserver(failures):
+    """Local stand-in for the PDB that counts requests and connections"""
+    import threading
+    from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+    from six.moves.socketserver import ThreadingMixIn, TCPServer
+    from dfi.datafiles import example_pdb
+    with open(example_pdb, 'rb') as infile:
+        pdbdata = infile.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            id = self.path.rsplit('/', 1)[-1].split('.')[0]
+            with server.lock:
+                server.requests.append(id)
+                server.clients.add(self.client_address)
+                fail = failures.get(id, 0)
+                failures[id] = fail - 1
+            if id == 'none':
+                status, body = 404, b''
+            elif fail > 0:
+                status, body = 503, b''
+            else:
+                status, body = 200, pdbdata
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.clients = set()
+    server.pdbdata = pdbdata
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/files/%%s.pdb' % server.server_address[1]
+    return server, url
+
+
+def test_fetch_pdbs_mirror(tmp_path):
+    import os
+    from dfi.download_pdb import fetch_pdbs, mirror_path
+    server, url = _pdbserver({'2abc': 2})
+    mirror = str(tmp_path / 'mirror')
+    ids = ['1l2y', '2abc', 'none'] + ['%dxy%d' % (i, i) for i in range(20)]
+    try:
+        fnames = fetch_pdbs(ids + ['1l2y'], mirror=mirror, nthreads=4,
+                            backoff=0.01, url=url)
+        assert fnames['none'] is None
+        for id in ids[:2] + ids[3:]:
+            assert fnames[id] == mirror_path(mirror, id)
+            with open(fnames[id], 'rb') as infile:
+                assert infile.read() == server.pdbdata
+        assert os.path.exists(os.path.join(mirror, 'l2', '1l2y.pdb'))
+        assert server.requests.count('2abc') == 3
+        assert server.requests.count('1l2y') == 1
+        # connections are kept alive across downloads of a thread
+        assert len(server.clients) <= 4
+
+        nrequests = len(server.requests)
+        fnames = fetch_pdbs(ids, mirror=mirror, url=url)
+        assert len(server.requests) == nrequests + 1  # only the missing one
+    finally:
+        server.shutdown()
+        server.server_close()
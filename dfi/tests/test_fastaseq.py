@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+import pandas as pd
+import dfi.fastaseq
+from dfi.datafiles import example_fasta
+
+
+def _adk():
+    return dfi.fastaseq.read_fasta(example_fasta)['P69441']
+
+
+def test_read_fasta():
+    sequences = dfi.fastaseq.parse_fasta(
+        ">1L2Y:A|PDBID|CHAIN|SEQUENCE\nNLYIQ\nWLKDG\n>sp|P1|X_Y Z\nAC\n")
+    assert list(sequences.items()) == [('1L2Y:A', 'NLYIQWLKDG'),
+                                       ('P1', 'AC')]
+    fseq = _adk()
+    assert len(fseq) == 214 and fseq.startswith('MRIILLGAPG')
+
+
+def test_compareseq():
+    fseq = _adk()
+    assert dfi.fastaseq.compareseq(fseq[20:50], fseq) == (0, 21)
+    assert dfi.fastaseq.compareseq('WWWW' + fseq[20:50], fseq) == (4, 21)
+    assert dfi.fastaseq.compareseq('WWWWW', fseq) is False
+
+
+def test_align_residues():
+    fseq = _adk()
+    # residues 3-60 and 70-180 with two point mutations
+    smallseq = fseq[2:60] + fseq[69:180]
+    smallseq = smallseq[:1] + 'W' + smallseq[2:40] + 'A' + smallseq[41:]
+    mapping = dfi.fastaseq.align_residues(smallseq, fseq)
+    expected = np.r_[np.arange(2, 60), np.arange(69, 180)]
+    assert np.all(mapping == expected)
+    assert np.all(dfi.fastaseq.align_residues('WWWWW', fseq) == -1)
+
+
+def test_map_dfi_files(tmp_path):
+    fseq = _adk()
+    rows = np.r_[np.arange(0, 30), np.arange(40, 60)]
+    inv = dict((one, three) for three, one in dfi.fastaseq.mapres.items()
+               if three != 'HIE')
+    data = pd.DataFrame({'ResI': np.r_[rows, rows] + 1,
+                         'ChainID': ['A'] * 50 + ['B'] * 50,
+                         'Res': [inv[fseq[row]] for row in rows] * 2,
+                         'pctdfi': np.linspace(0, 1, 100)})
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    try:
+        data.to_csv('4ake-dfianalysis.csv', index=False)
+        outfiles = dfi.fastaseq.map_dfi_files(
+            ['4ake-dfianalysis.csv'], uniprols={'4ake': ['P69441']},
+            sequences=example_fasta)
+        assert outfiles == {'4ake-dfianalysis.csv':
+                            ['4ake-P69441-dfianalysis.csv']}
+        mapped = pd.read_csv('4ake-P69441-dfianalysis.csv')
+    finally:
+        os.chdir(cwd)
+    assert np.all(mapped.fafsa_ind == mapped.ResI)
+    assert ''.join(mapped.fafsa_seq) == ''.join(fseq[row] for row in rows) * 2
+    assert np.all(mapped.unipro == 'P69441')
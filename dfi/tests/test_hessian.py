@@ -19,3 +19,57 @@ def test_hessian():
     gamma = 100
     hess = dfi.dfi_calc.calchessian(resnum, x, y, z, gamma)
     assert np.all(test_hess == hess)
+
+
+def _loop_hessian(resnum, x, y, z, gamma, cutoff=None):
+    """Pair-by-pair reference Hessian to check the batched builder."""
+    import numpy as np
+
+    hess = np.zeros((3 * resnum, 3 * resnum))
+    for i in range(resnum):
+        for j in range(resnum):
+            if i == j:
+                continue
+            d = np.array([x[i] - x[j], y[i] - y[j], z[i] - z[j]])
+            r = d[0] * d[0] + d[1] * d[1] + d[2] * d[2]
+            sprngcnst = (gamma * gamma * gamma) / (r * r * r)
+            if cutoff and np.sqrt(r) > cutoff:
+                sprngcnst = 0.
+            for a in range(3):
+                for b in range(3):
+                    val = sprngcnst * (d[a] * d[b] / r)
+                    hess[3 * i + a, 3 * i + b] += val
+                    hess[3 * i + a, 3 * j + b] -= val
+    return hess
+
+
+def test_hessian_1l2y():
+
+    import dfi
+    import numpy as np
+    from dfi.datafiles import example_pdb
+
+    ATOMS = dfi.pdbio.pdb_reader(example_pdb, CAonly=True)
+    x, y, z = dfi.dfi_calc.getcoords(ATOMS)
+    resnum = len(x)
+    for cutoff in [None, 7.0]:
+        hess = dfi.dfi_calc.calchessian(resnum, x, y, z, 100, cutoff=cutoff)
+        assert np.array_equal(hess, _loop_hessian(resnum, x, y, z, 100,
+                                                  cutoff=cutoff))
+
+
+def test_hessian_sparse():
+
+    import dfi
+    import numpy as np
+    from dfi.datafiles import example_pdb
+
+    ATOMS = dfi.pdbio.pdb_reader(example_pdb, CAonly=True)
+    x, y, z = dfi.dfi_calc.getcoords(ATOMS)
+    resnum = len(x)
+    hess = dfi.dfi_calc.calchessian(resnum, x, y, z, 100, cutoff=7.0)
+    spr = dfi.dfi_calc.calchessian(resnum, x, y, z, 100, cutoff=7.0,
+                                   sparse=True)
+    assert spr.blocksize == (3, 3)
+    assert spr.nnz < hess.size
+    assert np.allclose(spr.toarray(), hess)
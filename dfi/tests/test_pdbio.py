@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import dfi.pdbio
 import numpy as np
-from dfi.datafiles import example_pdb, test_pdb
+from dfi.datafiles import example_pdb, example_cif, test_pdb
 
 
 class TestPDBIO():
@@ -32,3 +32,132 @@ class TestPDBIO():
         assert 'CA' == ATOMS[0].atom_name.strip()
         assert 'ASN' == ATOMS[0].res_name
         assert 'A' == ATOMS[0].chainID
+
+
+def test_columns():
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_pdb)
+    assert isinstance(ATOMS, dfi.pdbio.AtomArray)
+    assert len(ATOMS) == 305
+    assert ATOMS.x.dtype == float
+    assert np.isclose(ATOMS.x[1], -8.608)
+    assert ATOMS[1] == dfi.pdbio.pdb_reader(example_pdb)[1]
+    assert ATOMS[1].atom_name == ' CA '
+    assert isinstance(ATOMS[1], dfi.pdbio.ATOM)
+    assert ATOMS[1].occupancy == 1. and isinstance(ATOMS[1].occupancy, float)
+
+    # a line that stops after the coordinates gets the default B-factor
+    assert ATOMS[304].atom_name.strip() == 'HG'
+    assert ATOMS.temp_factor[304] == 1.
+
+    CA = ATOMS[np.char.strip(ATOMS.atom_name) == 'CA']
+    assert isinstance(CA, dfi.pdbio.AtomArray)
+    assert CA.tolist() == dfi.pdbio.pdb_reader(example_pdb, CAonly=True)
+    assert dfi.dfi_calc.chainresmap(CA) == \
+        dfi.dfi_calc.chainresmap(CA.tolist())
+
+
+def test_fixedpoint():
+    block = np.array([list(b' -8.608'), list(b'-10.100'),
+                      list(b'  0.000'), list(b'  12.5 ')], dtype=np.uint8)
+    assert dfi.pdbio._fixedpoint(block) is None
+    values = dfi.pdbio._fixedpoint(block[:3])
+    assert np.all(values == np.array([-8.608, -10.1, 0.]))
+
+
+def test_models():
+    models = list(dfi.pdbio.pdb_models(example_pdb, CAonly=True))
+    assert len(models) == 38
+    assert all(len(ATOMS) == 20 for ATOMS in models)
+    assert models[0].tolist() == dfi.pdbio.pdb_reader(example_pdb,
+                                                      CAonly=True)
+    assert not np.allclose(models[0].x, models[1].x)
+    assert len(list(dfi.pdbio.pdb_models(test_pdb))) == 1
+
+
+def test_compressed(tmp_path):
+    import io
+    import gzip
+    import bz2
+    ATOMS = dfi.pdbio.pdb_reader(example_pdb)
+    with open(example_pdb, 'rb') as infile:
+        raw = infile.read()
+    for ext, compress in [('.gz', gzip.compress), ('.bz2', bz2.compress)]:
+        fname = str(tmp_path / ('1l2y.pdb' + ext))
+        with open(fname, 'wb') as outfile:
+            outfile.write(compress(raw))
+        assert dfi.pdbio.pdb_reader(fname) == ATOMS
+        assert dfi.pdbio.pdb_reader(compress(raw)) == ATOMS
+        with open(fname, 'rb') as infile:
+            assert dfi.pdbio.pdb_reader(infile) == ATOMS
+            assert not infile.closed
+    assert dfi.pdbio.pdb_reader(raw) == ATOMS
+    assert dfi.pdbio.pdb_reader(io.StringIO(raw.decode())) == ATOMS
+    assert len(list(dfi.pdbio.pdb_models(gzip.compress(raw)))) == 38
+
+
+def test_cif():
+    import io
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_cif)
+    assert ATOMS.tolist() == dfi.pdbio.pdb_reader(example_pdb)
+    CA = dfi.pdbio.pdb_reader(example_cif, CAonly=True, chainA=True)
+    assert CA == dfi.pdbio.pdb_reader(example_pdb, CAonly=True,
+                                      chainA=True)
+
+    with open(example_cif) as infile:
+        header = infile.read().split('ATOM ')[0]
+    loop = header + ('ATOM 1 C "C5\'" . DA B 1 4 ? 1.0 2.0 3.0 1 0 ? 4 DA B '
+                     '"C5\'" 1\n'
+                     'ATOM 2 C CA B ALA B 1 5 ? 1.5 2.5 3.5 0.5 ? ? 5 ALA B '
+                     'CA 1\n')
+    ATOMS = dfi.pdbio.cif_reader_columns(io.StringIO(loop))
+    assert len(ATOMS) == 1
+    assert ATOMS[0].atom_name == " C5'"
+    assert ATOMS.temp_factor[0] == 0.
+
+
+def test_cif_insertion_codes():
+    import io
+    import dfi.dfi_calc
+    pdb = ''.join(
+        'ATOM  %5d  CA  %3s A%4s%1s   %8.3f%8.3f%8.3f  1.00  0.00'
+        '           C\n' % (i + 1, res, resi, icode, i, 2. * i, 0.)
+        for i, (res, resi, icode) in enumerate(
+            [('GLY', 51, ' '), ('ALA', 52, ' '), ('SER', 52, 'A'),
+             ('VAL', 53, ' ')]))
+    with open(example_cif) as infile:
+        header = infile.read().split('ATOM ')[0]
+    cif = header + ''.join(
+        'ATOM %d C CA . %s A 1 %d %s %.3f %.3f 0.000 1.00 0.00 ? %d %s A '
+        'CA 1\n' % (i + 1, res, i + 1, icode, i, 2. * i, resi, res)
+        for i, (res, resi, icode) in enumerate(
+            [('GLY', 51, '?'), ('ALA', 52, '?'), ('SER', 52, 'A'),
+             ('VAL', 53, '.')]))
+    ATOMS = dfi.pdbio.pdb_reader_columns(io.StringIO(pdb))
+    CIFATOMS = dfi.pdbio.cif_reader_columns(io.StringIO(cif))
+    assert CIFATOMS.tolist() == ATOMS.tolist()
+    assert dfi.dfi_calc.chainresmap(CIFATOMS) == \
+        {'A51': 0, 'A52': 1, 'A52A': 2, 'A53': 3}
+
+
+def test_writer_format(tmp_path):
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_pdb)
+    rs = np.random.RandomState(0)
+    ATOMS = ATOMS.copy(temp_factor=rs.uniform(-50, 200, len(ATOMS)))
+    ATOMS.temp_factor[:4] = [0.005, -0.0001, 2.675, 1e7]
+    outfile = str(tmp_path / 'out.pdb')
+    dfi.pdbio.pdb_writer(ATOMS, filename=outfile, atomoffset=3)
+
+    # line by line formatting of the atoms
+    lines = ["HEADER  FROM PDBIO\n", "MODEL 1\n", "PARENT N/A\n"]
+    for atom in ATOMS:
+        lines.append(
+            "{}{:5d} {:>4s}{:<1s}{:3s} {:<1s}{:4s}{:<1s}".format(
+                'ATOM  ', atom.atom_index + 3, atom.atom_name, atom.alc,
+                atom.res_name, atom.chainID, atom.res_index,
+                atom.insert_code) +
+            "   {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}{:>12s}  \n".format(
+                atom.x, atom.y, atom.z, 1.00, atom.temp_factor,
+                atom.atom_type))
+    lines += ["TER\n", "END\n"]
+    with open(outfile) as pdb:
+        assert pdb.read() == ''.join(lines)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+import pandas as pd
+import dfi.fastaseq
+import dfi.seqsearch
+from dfi.datafiles import example_fasta
+
+
+def _seqres(fname):
+    """Writes a small seqres file around adenylate kinase"""
+    fseq = dfi.fastaseq.read_fasta(example_fasta)['P69441']
+    rs = np.random.RandomState(0)
+    mutant = np.array(list(fseq[10:200]))
+    sites = rs.choice(len(mutant), 15, replace=False)
+    mutant[sites] = [('A' if res != 'A' else 'G') for res in mutant[sites]]
+    mutant = ''.join(mutant)
+    mutant = mutant[:90] + mutant[95:]  # a deletion
+    shuffled = ''.join(rs.permutation(list(fseq)))
+    entries = [('4ake_A mol:protein length:214  ADENYLATE KINASE', fseq),
+               ('4ake_B mol:protein length:214  ADENYLATE KINASE', fseq),
+               ('1xyz_A mol:protein length:185  MUTANT', mutant),
+               ('2abc_A mol:protein length:214  SHUFFLED', shuffled),
+               ('3nab_C mol:na length:214  DNA', fseq)]
+    with open(fname, 'w') as outfile:
+        for header, seq in entries:
+            outfile.write('>%s\n' % header)
+            for start in range(0, len(seq), 80):
+                outfile.write(seq[start:start + 80] + '\n')
+
+
+def test_seqres_index(tmp_path):
+    seqres = str(tmp_path / 'pdb_seqres.txt')
+    _seqres(seqres)
+    index = dfi.seqsearch.SeqresIndex(seqres)
+    assert len(index) == 3
+    assert index.members[0] == [('4AKE', 'A'), ('4AKE', 'B')]
+
+    fseq = dfi.fastaseq.read_fasta(example_fasta)['P69441']
+    hits = index.search('P69441', fseq)
+    assert list(hits.columns) == dfi.seqsearch.hit_columns
+    assert list(hits.PDBid) == ['4AKE', '4AKE', '1XYZ']
+    top = hits.iloc[0]
+    assert (top.query_from, top.query_to, top.SeqId) == (1, 214, 100)
+    assert top.QueryCov == 100
+    mutant = hits.iloc[2]
+    assert mutant.query_from == 11 and 195 <= mutant.query_to <= 200
+    assert 85 <= mutant.SeqId < 95
+
+
+def test_search_batch(tmp_path):
+    seqres = str(tmp_path / 'pdb_seqres.txt')
+    _seqres(seqres)
+    fseq = dfi.fastaseq.read_fasta(example_fasta)['P69441']
+    queries = {'P69441': fseq, 'PART': fseq[100:], 'NONE': 'WWWWWWWW'}
+    serial = dfi.seqsearch.search_batch(queries, seqres, nprocs=1,
+                                        writetofile=False)
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    try:
+        pooled = dfi.seqsearch.search_batch(queries, seqres, nprocs=2)
+        written = pd.read_csv('P69441.csv')
+    finally:
+        os.chdir(cwd)
+    for code in queries:
+        pd.testing.assert_frame_equal(serial[code], pooled[code])
+    assert len(serial['NONE']) == 0
+    assert serial['PART'].QueryCov.iloc[0] == 99  # (to - from) / length
+    assert list(written.columns) == dfi.seqsearch.hit_columns
+    assert written.PDBid.iloc[0] == '4AKE'
+
+
+def test_gettophit(tmp_path):
+    import pytest
+    pytest.importorskip('Bio')
+    import dfi.unipro_blast_to_pdb as uni
+    seqres = str(tmp_path / 'pdb_seqres.txt')
+    _seqres(seqres)
+    fseq = dfi.fastaseq.read_fasta(example_fasta)['P69441']
+    hits = dfi.seqsearch.SeqresIndex(seqres).search('P69441', fseq)
+    csvfile = str(tmp_path / 'P69441.csv')
+    hits.to_csv(csvfile, index=False)
+    assert uni._gettophit(csvfile) == '4AKE'
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import numpy as np
+import pytest
+import dfi.dfi_calc
+import dfi.pdbio
+import dfi.trajcovar
+from dfi.datafiles import example_pdb, xyz_npy
+
+
+def _models():
+    return np.array([np.column_stack((ATOMS.x, ATOMS.y, ATOMS.z))
+                     for ATOMS in dfi.pdbio.pdb_models(example_pdb,
+                                                       CAonly=True)])
+
+
+def test_superimpose():
+    frames = _models()
+    angle = 0.7
+    rot = np.array([[np.cos(angle), -np.sin(angle), 0.],
+                    [np.sin(angle), np.cos(angle), 0.],
+                    [0., 0., 1.]])
+    moved = np.dot(frames[0], rot) + 5.
+    aligned = dfi.trajcovar.superimpose(moved[None], frames[0])
+    assert np.allclose(aligned[0], frames[0])
+
+
+def test_traj_covariance(tmp_path):
+    frames = _models()
+    aligned = dfi.trajcovar.superimpose(frames, frames[0])
+    rows = aligned.reshape((len(frames), -1))
+    covar = np.cov(rows.T, bias=True)
+
+    # chunks of the pdb, the .npy stack in either layout and a far away
+    # origin all give the covariance of the whole trajectory
+    assert np.allclose(dfi.trajcovar.traj_covariance(example_pdb,
+                                                     chunksize=7), covar)
+    npyfile = str(tmp_path / 'traj.npy')
+    np.save(npyfile, frames.transpose((0, 2, 1)))
+    assert np.allclose(dfi.trajcovar.traj_covariance(npyfile, chunksize=5,
+                                                     layout='3N'), covar)
+    with pytest.raises(ValueError, match='not in the N3 layout'):
+        dfi.trajcovar.traj_covariance(npyfile)
+    assert np.allclose(dfi.trajcovar.traj_covariance(frames + 1e6,
+                                                     chunksize=3), covar)
+
+    masses = np.arange(1., 21.)
+    aligned = dfi.trajcovar.superimpose(frames, frames[0], weights=masses)
+    rows = (aligned * np.sqrt(masses)[:, None]).reshape((len(frames), -1))
+    assert np.allclose(dfi.trajcovar.traj_covariance(frames, masses=masses),
+                       np.cov(rows.T, bias=True))
+
+    # a single (3,N) frame has no fluctuations
+    assert np.allclose(dfi.trajcovar.traj_covariance(xyz_npy, layout='3N'),
+                       0.)
+
+    # three atoms are taken in the layout given, whatever the shape
+    three = frames[:, :3]
+    covar = dfi.trajcovar.traj_covariance(three)
+    assert np.allclose(dfi.trajcovar.traj_covariance(
+        three.transpose((0, 2, 1)), layout='3N'), covar)
+    assert not np.allclose(dfi.trajcovar.traj_covariance(
+        three.transpose((0, 2, 1))), covar)
+
+
+def test_calc_dfi_traj():
+    covar = dfi.trajcovar.traj_covariance(example_pdb)
+    df_traj = dfi.dfi_calc.calc_dfi(example_pdb, traj=example_pdb)
+    df_covar = dfi.dfi_calc.calc_dfi(example_pdb, covar=covar)
+    assert np.allclose(df_traj.dfi, df_covar.dfi)
+
+
+def test_calc_dfi_massweight():
+    # 1l2y mixes residues from GLY (57 Da) to TRP (186 Da)
+    ATOMS = dfi.pdbio.pdb_reader_columns(example_pdb, CAonly=True)
+    masses = dfi.trajcovar.residuemasses(ATOMS)
+    assert masses.min() < 60 and masses.max() > 180
+    df_plain = dfi.dfi_calc.calc_dfi(example_pdb, traj=example_pdb)
+    df_weighted = dfi.dfi_calc.calc_dfi(example_pdb, traj=example_pdb,
+                                        massweight=True)
+    assert not np.allclose(df_weighted.dfi, df_plain.dfi)
+    assert not np.all(df_weighted.pctdfi == df_plain.pctdfi)
+    df_masses = dfi.dfi_calc.calc_dfi(example_pdb, traj=example_pdb,
+                                      massweight=masses)
+    assert np.allclose(df_masses.dfi, df_weighted.dfi)
+    # equal masses only scale the covariance
+    df_equal = dfi.dfi_calc.calc_dfi(example_pdb, traj=example_pdb,
+                                     massweight=np.full(len(ATOMS), 12.))
+    assert np.allclose(df_equal.dfi, df_plain.dfi)
+
+
+def test_sliding_covariances():
+    frames = _models()
+    rows = dfi.trajcovar.superimpose(frames, frames[0])
+    rows = rows.reshape((len(frames), -1))
+    for window, stride in [(10, 3), (10, 12), (5, 1)]:
+        starts = []
+        for start, covar in dfi.trajcovar.sliding_covariances(
+                frames, window, stride=stride, chunksize=4, refresh=3):
+            starts.append(start)
+            assert np.allclose(covar, np.cov(
+                rows[start:start + window].T, bias=True))
+        assert starts == list(range(0, len(frames) - window + 1, stride))
+
+
+def test_calc_dfi_windows(tmp_path):
+    frames = _models()
+    df_dfi = dfi.dfi_calc.calc_dfi(example_pdb, traj=frames, window=20,
+                                   stride=6)
+    assert list(df_dfi.columns[4:]) == ['pctdfi_0', 'pctdfi_6',
+                                        'pctdfi_12', 'pctdfi_18']
+    covar = dfi.trajcovar.traj_covariance(frames[6:26], reference=frames[0])
+    df_covar = dfi.dfi_calc.calc_dfi(example_pdb, covar=covar)
+    assert np.allclose(df_dfi.pctdfi_6, df_covar.pctdfi)
+    with pytest.raises(ValueError, match='window does not support nmodes'):
+        dfi.dfi_calc.calc_dfi(example_pdb, traj=frames, window=20, nmodes=20)
+
+    outfile = str(tmp_path / 'windows.csv')
+    dfi.dfi_calc.calc_dfi_windows(example_pdb, example_pdb, 19,
+                                  writetofile=True, dfianalfile=outfile)
+    with open(outfile) as infile:
+        assert infile.readline().strip() == \
+            'ResI,ChainID,Res,R,pctdfi_0,pctdfi_19'
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import os
+import shutil
+import dfi.fastaseq
+import dfi.unipromap
+from dfi.datafiles import unipro_pdb
+
+
+def test_unipromap(tmp_path):
+    mapping = dfi.unipromap.UniproPDBMap(str(tmp_path / 'map.sqlite'))
+    assert mapping.pdb_to_uniprot('3cmm') == ['A0AVT1', 'P22314', 'P41226']
+    assert dfi.fastaseq.getuniprols('3CMM', mapping=mapping) == \
+        ['A0AVT1', 'P22314', 'P41226']
+    assert mapping.uniprot_to_pdb('A0AVT1')[:3] == ['4NNJ', '3CMM', '4II2']
+    assert mapping.pdb_to_uniprot('0XXX') == []
+    bulk = mapping.bulk_pdb_to_uniprot(['4nnj', '0XXX', '3CMM'])
+    assert list(bulk) == ['4nnj', '0XXX', '3CMM']
+    assert bulk['4nnj'] == bulk['3CMM'] and bulk['0XXX'] == []
+    assert mapping.update() == 0
+    mapping.close()
+
+
+def test_unipromap_update(tmp_path):
+    csvfile = str(tmp_path / 'unipropdb.csv')
+    dbfile = str(tmp_path / 'map.sqlite')
+    shutil.copy(unipro_pdb, csvfile)
+    mapping = dfi.unipromap.UniproPDBMap(dbfile, csvfile=csvfile)
+    nrows = mapping.conn.execute('SELECT count(*) FROM mapping').fetchone()
+
+    # appended rows are loaded on their own
+    with open(csvfile, 'a') as outfile:
+        outfile.write('P69441,4ake\nP69441,1AKE\n')
+    os.utime(csvfile, (1, 1))
+    reopened = dfi.unipromap.UniproPDBMap(dbfile, csvfile=csvfile)
+    assert mapping.uniprot_to_pdb('P69441') == ['4AKE', '1AKE']
+    assert reopened.conn.execute('SELECT count(*) FROM mapping').fetchone() \
+        == (nrows[0] + 2,)
+
+    # any other change rebuilds the store
+    with open(csvfile, 'w') as outfile:
+        outfile.write('pdbID,uniprotID\n4AKE,P69441\n')
+    assert mapping.update() == 1
+    assert mapping.pdb_to_uniprot('4ake') == ['P69441']
+    assert mapping.pdb_to_uniprot('3CMM') == []
+
+    # so does an edit far before the end, even with rows appended
+    shutil.copy(unipro_pdb, csvfile)
+    nread = mapping.update()
+    with open(csvfile) as infile:
+        text = infile.read()
+    assert text.startswith('uniprotID,pdbID\nA0AVT1,4NNJ\n')
+    with open(csvfile, 'w') as outfile:
+        outfile.write(text.replace('A0AVT1,4NNJ', 'A0AVT9,4NNJ', 1) +
+                      'P69441,4AKE\n')
+    os.utime(csvfile, (2, 2))
+    assert mapping.update() == nread + 1
+    assert mapping.uniprot_to_pdb('A0AVT9') == ['4NNJ']
+
+
+def test_unipromap_default(tmp_path, monkeypatch):
+    blocked = tmp_path / 'home'
+    blocked.write_text(u'not a directory')
+    monkeypatch.setattr(dfi.unipromap, 'dbfile_default',
+                        str(blocked / '.dfi' / 'unipropdb.sqlite'))
+    mapping = dfi.unipromap.UniproPDBMap()
+    assert mapping.dbfile == ':memory:'
+    assert mapping.pdb_to_uniprot('3cmm') == ['A0AVT1', 'P22314', 'P41226']
+    mapping.close()
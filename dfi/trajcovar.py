@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+"""
+Trajectory Covariance
+=====================
+
+Description
+-----------
+Computes the 3Nx3N positional covariance matrix of a trajectory in one
+pass. Frames are read in chunks, superimposed onto a reference and
+merged into a running mean and covariance, so the memory needed is
+O((3N)^2) for any number of frames. With masses the covariance is mass
+weighted, like the _mwcovarmat.dat files used by bulkdfi.
+
+Trajectories are .npy coordinate stacks of shape (F,N,3) or a single
+(N,3) frame, or with layout='3N' of shape (F,3,N) or a single (3,N)
+frame like dfi.dfi_calc.getcoords, or multi-model pdb files (CA
+atoms). The layout is never guessed from the shape, which is ambiguous
+for three atoms.
+
+Usage
+-----
+```
+trajcovar.py TRAJFILE [OUTFILE] [--chunksize 100] [--massweight]
+             [--layout N3]
+```
+
+Writes the covariance of TRAJFILE to OUTFILE (default
+TRAJFILE_covarmat.npy, or TRAJFILE_mwcovarmat.npy when mass weighted).
+"""
+from __future__ import print_function
+import sys
+import argparse
+import six
+import numpy as np
+import dfi.pdbio as pdbio
+
+
+if __name__ == "__main__" and len(sys.argv) < 2:
+    print(__doc__)
+    exit()
+
+# average masses of the amino acid residues in a chain (Da), the
+# masses of coarse-grained CA sites
+resmass = {'ALA': 71.079, 'ARG': 156.188, 'ASN': 114.104, 'ASP': 115.089,
+           'CYS': 103.145, 'GLN': 128.131, 'GLU': 129.116, 'GLY': 57.052,
+           'HIS': 137.141, 'ILE': 113.160, 'LEU': 113.160, 'LYS': 128.174,
+           'MET': 131.193, 'PHE': 147.177, 'PRO': 97.117, 'SER': 87.078,
+           'THR': 101.105, 'TRP': 186.213, 'TYR': 163.176, 'VAL': 99.133,
+           'HIE': 137.141, 'HID': 137.141, 'HIP': 138.149, 'MSE': 178.05}
+
+
+def residuemasses(ATOMS):
+    """
+    Masses of the residues of CA atoms (coarse-grained sites), from
+    their res_name.
+
+    Input
+    -----
+    ATOMS: AtomArray or ls
+       CA atoms of the pdb
+
+    Output
+    ------
+    masses: numpy
+       mass of the residue of every atom
+    """
+    ATOMS = pdbio.AtomArray.from_atoms(ATOMS)
+    res_name = np.char.upper(np.char.strip(ATOMS.res_name.astype(str)))
+    unknown = sorted(set(res_name.tolist()) - set(resmass))
+    if unknown:
+        raise ValueError('no residue mass for %s, pass the masses '
+                         'instead' % ', '.join(unknown))
+    return np.array([resmass[res] for res in res_name.tolist()])
+
+
+def weightmasses(ATOMS, massweight):
+    """
+    Masses for a mass weighted covariance of CA atoms.
+
+    Input
+    -----
+    ATOMS: AtomArray or ls
+       CA atoms of the pdb
+    massweight: bool or numpy
+       True for the residue masses (see residuemasses) or the mass of
+       every atom; False or None for no weighting
+
+    Output
+    ------
+    masses: numpy
+       mass of every atom, None without weighting
+    """
+    if massweight is None or massweight is False:
+        return None
+    if massweight is True:
+        return residuemasses(ATOMS)
+    masses = np.asarray(massweight, dtype=float)
+    if masses.shape != (len(ATOMS),):
+        raise ValueError('%d masses for %d atoms' % (len(masses),
+                                                     len(ATOMS)))
+    return masses
+
+
+layouts = ['N3', '3N']
+
+
+def _framestack(coords, layout='N3'):
+    """
+    Brings (F,N,3) or (N,3) coordinates, or (F,3,N) or (3,N) ones with
+    layout '3N', to (F,N,3)
+    """
+    if layout not in layouts:
+        raise ValueError('layout is one of %s, not %r' % (
+            ', '.join(layouts), layout))
+    coords = np.asarray(coords, dtype=float)
+    if coords.ndim == 2:
+        coords = coords[None]
+    if layout == '3N' and coords.ndim == 3:
+        coords = coords.transpose((0, 2, 1))
+    if coords.ndim != 3 or coords.shape[-1] != 3:
+        raise ValueError('coordinates of shape %s are not in the %s '
+                         'layout' % (np.shape(coords), layout))
+    return coords
+
+
+def read_frames(traj, chunksize=100, layout='N3'):
+    """
+    Generator over the frames of a trajectory, chunksize frames at a
+    time.
+
+    Input
+    -----
+    traj: str or numpy
+       .npy coordinate stack, an array of coordinates or a multi-model
+       pdb (its CA atoms are used)
+    chunksize: int
+       number of frames per chunk
+    layout: str
+       'N3' (default) for (F,N,3) or (N,3) coordinates, '3N' for
+       (F,3,N) or (3,N) ones; pdbs are read as they are
+
+    Output
+    ------
+    frames: numpy
+       (B,N,3) coordinates of the next B <= chunksize frames
+    """
+    if isinstance(traj, np.ndarray) or (
+            isinstance(traj, six.string_types) and traj.endswith('.npy')):
+        if not isinstance(traj, np.ndarray):
+            traj = np.load(traj, mmap_mode='r')
+        if traj.ndim == 2:
+            yield _framestack(traj, layout)
+            return
+        for start in range(0, len(traj), chunksize):
+            yield _framestack(traj[start:start + chunksize], layout)
+        return
+
+    frames = []
+    for ATOMS in pdbio.pdb_models(traj, CAonly=True):
+        frames.append(np.column_stack((ATOMS.x, ATOMS.y, ATOMS.z)))
+        if len(frames) == chunksize:
+            yield np.array(frames)
+            frames = []
+    if frames:
+        yield np.array(frames)
+
+
+def superimpose(frames, reference, weights=None):
+    """
+    Superimposes frames onto a reference with the Kabsch algorithm, all
+    frames of the chunk at once.
+
+    Input
+    -----
+    frames: numpy
+       (B,N,3) coordinates
+    reference: numpy
+       (N,3) coordinates to fit onto
+    weights: numpy
+       per atom weights of the fit (e.g., masses), default equal
+
+    Output
+    ------
+    aligned: numpy
+       (B,N,3) frames after the rotation and translation that minimize
+       the (weighted) rmsd to the reference
+    """
+    if weights is None:
+        weights = np.ones(frames.shape[1])
+    weights = np.asarray(weights, dtype=float) / np.sum(weights)
+    refcenter = np.dot(weights, reference)
+    centered = frames - np.einsum('n,bni->bi', weights, frames)[:, None]
+    H = np.einsum('bni,nj->bij', centered * weights[:, None],
+                  reference - refcenter)
+    U, S, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(np.matmul(U, Vt)))
+    U[:, :, 2] *= d[:, None]
+    return np.matmul(centered, np.matmul(U, Vt)) + refcenter
+
+
+class CovarianceAccumulator(object):
+    """
+    Covariance Accumulator
+    ======================
+
+    Running mean and covariance of superimposed frames. Every chunk of
+    frames is reduced to its own mean and scatter matrix and merged in
+    with the pairwise update of Chan et al., which stays accurate over
+    long trajectories where the textbook sum of squares does not.
+
+    Frames can also be taken back out (downdate), which is what lets
+    sliding_covariances move a window along a trajectory.
+
+    Usage
+    -----
+    ```
+    acc = CovarianceAccumulator(reference)
+    for frames in read_frames('traj.npy'):
+        acc.update(frames)
+    covar = acc.covariance
+    ```
+    """
+
+    def __init__(self, reference, masses=None):
+        """
+        Input
+        -----
+        reference: numpy
+           (N,3) coordinates the frames are superimposed onto
+        masses: numpy
+           masses of the N atoms, for a mass weighted fit and
+           covariance (default None)
+        """
+        self.reference = _framestack(reference)[0]
+        numres = len(self.reference)
+        self.masses = None if masses is None else np.asarray(masses, float)
+        self.nframes = 0
+        self.mean = np.zeros(3 * numres)
+        self.scatter = np.zeros((3 * numres, 3 * numres))
+
+    def _rows(self, frames):
+        """Superimposed, (mass weighted) frames as (B,3N) rows"""
+        frames = _framestack(frames)
+        if frames.shape[1:] != self.reference.shape:
+            raise ValueError('frames of %d atoms do not match the %d '
+                             'atoms of the reference' %
+                             (frames.shape[1], len(self.reference)))
+        rows = superimpose(frames, self.reference, weights=self.masses)
+        if self.masses is not None:
+            rows = rows * np.sqrt(self.masses)[:, None]
+        return rows.reshape((len(rows), -1))
+
+    def add_rows(self, rows):
+        """
+        Merges (B,3N) rows of superimposed frames into the mean and
+        covariance.
+        """
+        nchunk = len(rows)
+        if nchunk == 0:
+            return
+        chunkmean = rows.mean(axis=0)
+        dev = rows - chunkmean
+        ntotal = self.nframes + nchunk
+        delta = chunkmean - self.mean
+        self.scatter += np.dot(dev.T, dev)
+        self.scatter += np.outer(delta, delta) * \
+            (self.nframes * nchunk / float(ntotal))
+        self.mean += delta * (nchunk / float(ntotal))
+        self.nframes = ntotal
+
+    def remove_rows(self, rows):
+        """
+        Takes (B,3N) rows that were added before back out of the mean
+        and covariance, the inverse of add_rows.
+        """
+        nchunk = len(rows)
+        if nchunk == 0:
+            return
+        nleft = self.nframes - nchunk
+        if nleft <= 0:
+            self.reset()
+            return
+        chunkmean = rows.mean(axis=0)
+        dev = rows - chunkmean
+        leftmean = (self.nframes * self.mean - nchunk * chunkmean) / nleft
+        delta = chunkmean - leftmean
+        self.scatter -= np.dot(dev.T, dev)
+        self.scatter -= np.outer(delta, delta) * \
+            (nleft * nchunk / float(self.nframes))
+        self.mean = leftmean
+        self.nframes = nleft
+
+    def reset(self):
+        """Forgets all frames"""
+        self.nframes = 0
+        self.mean[:] = 0.
+        self.scatter[:] = 0.
+
+    def update(self, frames):
+        """
+        Adds a chunk of (B,N,3) frames to the mean and covariance.
+        """
+        self.add_rows(self._rows(frames))
+
+    def downdate(self, frames):
+        """
+        Removes a chunk of (B,N,3) frames that were added before.
+        """
+        self.remove_rows(self._rows(frames))
+
+    @property
+    def covariance(self):
+        """(3N,3N) covariance of the frames so far (divided by nframes)"""
+        return self.scatter / self.nframes
+
+
+def sliding_covariances(traj, window, stride=None, reference=None,
+                        masses=None, chunksize=100, refresh=50,
+                        layout='N3'):
+    """
+    Generator over the covariance matrices of windows of a trajectory.
+    Moving from one window to the next removes the frames that leave
+    and adds the ones that enter, so overlapping windows share their
+    work; only the frames of one window are held in memory.
+
+    Input
+    -----
+    traj: str or numpy
+       trajectory, see read_frames
+    window: int
+       number of frames per window
+    stride: int
+       number of frames between the starts of windows (default window)
+    reference: numpy
+       (N,3) coordinates to superimpose onto (default the first
+       frame)
+    masses: numpy
+       atom masses for a mass weighted covariance (default None)
+    chunksize: int
+       number of frames read at a time
+    refresh: int
+       recompute the covariance from the frames of the window every
+       refresh windows, which bounds the round-off of the updates
+    layout: str
+       layout of a coordinate traj, see read_frames
+
+    Output
+    ------
+    start: int
+       index of the first frame of the window
+    covar: numpy
+       (3N,3N) covariance matrix of the window
+    """
+    stride = stride or window
+    acc = None
+    rows = []  # frames from the start of the window on
+    start = 0  # first frame of the window
+    nread = 0  # frames read so far
+    nwindows = 0
+    for frames in read_frames(traj, chunksize=chunksize, layout=layout):
+        if acc is None:
+            acc = CovarianceAccumulator(
+                frames[0] if reference is None else reference,
+                masses=masses)
+        chunkrows = acc._rows(frames)
+        skip = max(0, start - nread)  # frames before the next window
+        rows.extend(chunkrows[skip:])
+        nread += len(chunkrows)
+        while len(rows) >= window:
+            if acc.nframes == 0 or nwindows % refresh == 0:
+                acc.reset()
+                acc.add_rows(np.array(rows[:window]))
+            else:
+                acc.add_rows(np.array(rows[window - min(stride, window):
+                                           window]))
+            yield start, acc.covariance
+            nwindows += 1
+
+            # slide: the first stride frames leave the window
+            if stride < window:
+                acc.remove_rows(np.array(rows[:stride]))
+            else:
+                acc.reset()
+            rows = rows[stride:]
+            start += stride
+
+
+def traj_covariance(traj, reference=None, masses=None, chunksize=100,
+                    outfile=None, layout='N3', Verbose=False):
+    """
+    Covariance matrix of a trajectory in one pass over its frames.
+
+    Input
+    -----
+    traj: str or numpy
+       trajectory, see read_frames
+    reference: numpy
+       (N,3) coordinates to superimpose onto (default the first
+       frame)
+    masses: numpy
+       atom masses for a mass weighted covariance (default None)
+    chunksize: int
+       number of frames held in memory at a time
+    outfile: str
+       write the covariance to a .npy file, or ascii for any other
+       extension (default None)
+    layout: str
+       layout of a coordinate traj, see read_frames
+    Verbose: bool
+       flag for debugging
+
+    Output
+    ------
+    covar: numpy
+       (3N,3N) covariance matrix
+    """
+    acc = None
+    for frames in read_frames(traj, chunksize=chunksize, layout=layout):
+        if acc is None:
+            acc = CovarianceAccumulator(
+                frames[0] if reference is None else reference,
+                masses=masses)
+        acc.update(frames)
+        if(Verbose):
+            print("Read %d frames" % acc.nframes)
+    if acc is None:
+        raise ValueError('no frames in the trajectory')
+
+    covar = acc.covariance
+    if(outfile):
+        if outfile.endswith('.npy'):
+            np.save(outfile, covar)
+        else:
+            np.savetxt(outfile, covar)
+        print("Wrote out to %s" % outfile)
+    return covar
+
+
+def check_args(args=None):
+    """
+    Parse command lines input
+
+    Output
+    ------
+    results: Namespace
+       traj, outfile, chunksize, massweight and layout
+    """
+    parser = argparse.ArgumentParser(
+        description='Covariance matrix of a trajectory')
+    parser.add_argument('traj',
+                        help='.npy coordinates or multi-model pdb')
+    parser.add_argument('outfile',
+                        help='.npy or ascii covariance file',
+                        nargs='?')
+    parser.add_argument('--chunksize',
+                        help='frames read at a time (default 100)',
+                        type=int, default=100)
+    parser.add_argument('--massweight',
+                        help='mass weight the fit and covariance with '
+                        'the residue masses',
+                        action='store_true')
+    parser.add_argument('--layout',
+                        help='N3 for (F,N,3) .npy coordinates (default), '
+                        '3N for (F,3,N) ones',
+                        choices=layouts, default='N3')
+
+    results = parser.parse_args(args)
+    if not(results.outfile):
+        suffix = '_mwcovarmat.npy' if results.massweight else \
+            '_covarmat.npy'
+        results.outfile = results.traj.rsplit('.', 1)[0] + suffix
+    return results
+
+
+if __name__ == "__main__":
+    results = check_args(sys.argv[1:])
+    masses = None
+    if results.massweight:
+        if results.traj.endswith('.npy'):
+            raise ValueError('--massweight needs the atoms of a pdb')
+        masses = residuemasses(next(pdbio.pdb_models(results.traj,
+                                                     CAonly=True)))
+    traj_covariance(results.traj, masses=masses,
+                    chunksize=results.chunksize, outfile=results.outfile,
+                    layout=results.layout, Verbose=True)
@@ -11,6 +11,9 @@ Given a Uniprot code will run blastp to retreive fasta sequence
 
 Uniprot|PDBid|chain|query_to|query_from|IterQueryLen|e-value|QueryCoverage|SequenceIdentity
 
+Without network access, seqsearch.py writes the same table from a local
+k-mer search of the PDB seqres file.
+
 Usage
 -----
 
@@ -122,8 +125,8 @@ def parseBlastFile(xmlfil):
 
     with open(outfilname, "w") as out_file:
         print("Writing output to %s" % (outfilname))
-        out_file.write("""Uniprot, PDBid, chain, query_to, query_from,
-        IterQueryLen, e - value, QueryCov, SeqId\n""")
+        out_file.write("Uniprot,PDBid,chain,query_to,query_from,"
+                       "IterQueryLen,e-value,QueryCov,SeqId\n")
         sequencequeryLength = blast_record.query_length
         for alignment in blast_record.alignments:
             for hsp in alignment.hsps:
@@ -186,7 +189,8 @@ def _gettophit(csvfile):
     if data[mask].shape[0] == 0:
         return None
     else:
-        return data[mask].sort_values(by=['QueryCov', 'SeqId']).PDBid[0]
+        return data[mask].sort_values(by=['QueryCov', 'SeqId'],
+                                      ascending=False).PDBid.iloc[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+"""
+UniProt PDB Map
+===============
+
+Description
+-----------
+Indexed store of the mapping between pdbIDs and uniprotIDs
+(data/unipropdb.csv). The csv file is loaded once into a SQLite
+database with an index on either column, so lookups in both directions,
+one at a time or in bulk, do not read the csv file again. When rows are
+appended to the csv file only the new rows are loaded; any other change,
+found from a sha1 of the whole part of the file loaded before, rebuilds
+the database. The default database lives in ~/.dfi, or in memory when
+that directory cannot be written.
+
+Example
+-------
+```
+mapping = UniproPDBMap()
+mapping.pdb_to_uniprot('4ake')
+mapping.bulk_uniprot_to_pdb(['P69441', 'A0AVT1'])
+```
+"""
+from __future__ import print_function
+import os
+import csv
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from dfi.datafiles import unipro_pdb
+
+dbfile_default = os.path.join(os.path.expanduser('~'), '.dfi',
+                              'unipropdb.sqlite')
+_maxparams = 900  # below the 999 host parameters of older SQLite
+_readbytes = 2**20  # bytes hashed at a time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS mapping (
+    uniprotID TEXT NOT NULL,
+    pdbID TEXT NOT NULL,
+    UNIQUE (uniprotID, pdbID));
+CREATE INDEX IF NOT EXISTS mapping_pdb ON mapping (pdbID);
+CREATE TABLE IF NOT EXISTS source (
+    csvfile TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    offset INTEGER,
+    prefixhash TEXT);
+"""
+
+
+def _prefixhash(infile, offset):
+    """sha1 object of the bytes of infile before offset"""
+    digest = hashlib.sha1()
+    infile.seek(0)
+    while infile.tell() < offset:
+        chunk = infile.read(min(_readbytes, offset - infile.tell()))
+        if not(chunk):
+            break
+        digest.update(chunk)
+    return digest
+
+
+def _writable(dbfile):
+    """True if dbfile, and its directory if needed, can be written"""
+    dbdir = os.path.dirname(dbfile)
+    try:
+        if dbdir and not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+    except OSError:
+        if not os.path.isdir(dbdir):
+            return False
+    if os.path.exists(dbfile):
+        return os.access(dbfile, os.W_OK)
+    return os.access(dbdir or os.curdir, os.W_OK)
+
+
+class UniproPDBMap(object):
+    """
+    UniProt PDB Map
+    ===============
+
+    SQLite store of the uniprotID, pdbID pairs of a csv file with the
+    uniprotID and pdbID columns, one csv file per database.
+
+    Input
+    -----
+    dbfile: str
+       SQLite database, created if needed (default
+       ~/.dfi/unipropdb.sqlite, or ':memory:' when it cannot be
+       written)
+    csvfile: str
+       mapping csv file (default data/unipropdb.csv)
+    update: bool
+       load the rows of csvfile that are not in the database yet
+    """
+
+    def __init__(self, dbfile=None, csvfile=unipro_pdb, update=True):
+        if dbfile is None:
+            dbfile = dbfile_default
+            if not(_writable(dbfile)):
+                dbfile = ':memory:'
+        dbdir = os.path.dirname(dbfile)
+        if dbdir and not os.path.isdir(dbdir):
+            try:
+                os.makedirs(dbdir)
+            except OSError:
+                if not os.path.isdir(dbdir):
+                    raise
+        self.dbfile = dbfile
+        self.csvfile = os.path.abspath(csvfile)
+        self.conn = sqlite3.connect(dbfile, timeout=60,
+                                    isolation_level=None)
+        self.conn.executescript(_schema)
+        if(update):
+            self.update()
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, Verbose=False):
+        """
+        Loads the rows appended to the csv file since the last update,
+        or all rows when the csv file was changed otherwise.
+
+        Output
+        ------
+        nrows: int
+           number of rows read from the csv file
+        """
+        stat = os.stat(self.csvfile)
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')  # one process updates at a time
+        try:
+            source = conn.execute(
+                'SELECT size, mtime, offset, prefixhash FROM source '
+                'WHERE csvfile = ?', (self.csvfile,)).fetchone()
+            if source and source[:2] == (stat.st_size, stat.st_mtime):
+                conn.execute('COMMIT')
+                return 0
+            with open(self.csvfile, 'rb') as infile:
+                offset = 0
+                if source and source[2] <= stat.st_size:
+                    digest = _prefixhash(infile, source[2])
+                    if digest.hexdigest() == source[3]:
+                        offset = source[2]
+                if offset == 0:
+                    digest = hashlib.sha1()
+                    conn.execute('DELETE FROM mapping')
+                    conn.execute('DELETE FROM source')
+                nrows, offset = self._load(infile, offset, digest)
+            conn.execute('INSERT OR REPLACE INTO source VALUES '
+                         '(?, ?, ?, ?, ?)', (self.csvfile, stat.st_size,
+                                             stat.st_mtime, offset,
+                                             digest.hexdigest()))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if(Verbose):
+            print("Loaded %d rows of %s" % (nrows, self.csvfile))
+        return nrows
+
+    def _load(self, infile, offset, digest):
+        """
+        Inserts the rows of infile after offset, digest being the sha1
+        of the bytes before it
+        """
+        infile.seek(0)
+        headline = infile.readline()
+        header = next(csv.reader([headline.decode('utf-8')]))
+        header = [name.strip() for name in header]
+        iuni, ipdb = header.index('uniprotID'), header.index('pdbID')
+        if offset < len(headline):
+            offset = len(headline)
+            digest.update(headline)
+        infile.seek(offset)
+        text = infile.read()
+        digest.update(text)
+        offset += len(text)
+        rows = [(row[iuni].strip(), row[ipdb].strip().upper())
+                for row in csv.reader(text.decode('utf-8').splitlines())
+                if len(row) > max(iuni, ipdb)]
+        self.conn.executemany('INSERT OR IGNORE INTO mapping VALUES (?, ?)',
+                              rows)
+        return len(rows), offset
+
+    def _bulk(self, column, other, IDs):
+        """Looks up many IDs in column, _maxparams at a time"""
+        IDs = list(IDs)
+        result = OrderedDict((ID, []) for ID in IDs)
+        keys = OrderedDict()
+        for ID in IDs:
+            key = ID.upper() if column == 'pdbID' else ID
+            keys.setdefault(key, []).append(ID)
+        keylist = list(keys)
+        for start in range(0, len(keylist), _maxparams):
+            chunk = keylist[start:start + _maxparams]
+            query = ('SELECT %s, %s FROM mapping WHERE %s IN (%s) '
+                     'ORDER BY rowid' % (column, other, column,
+                                         ','.join('?' * len(chunk))))
+            for key, value in self.conn.execute(query, chunk):
+                for ID in keys[key]:
+                    result[ID].append(value)
+        return result
+
+    def bulk_pdb_to_uniprot(self, pdbids):
+        """
+        uniprotIDs of many pdbIDs
+
+        Output
+        ------
+        uniprols: OrderedDict
+           list of uniprotIDs of every pdbID, empty if it is not mapped
+        """
+        return self._bulk('pdbID', 'uniprotID', pdbids)
+
+    def bulk_uniprot_to_pdb(self, uniprotids):
+        """
+        pdbIDs of many uniprotIDs
+
+        Output
+        ------
+        pdbls: OrderedDict
+           list of pdbIDs of every uniprotID, empty if it is not mapped
+        """
+        return self._bulk('uniprotID', 'pdbID', uniprotids)
+
+    def pdb_to_uniprot(self, pdbid):
+        """uniprotIDs of a pdbID"""
+        return self.bulk_pdb_to_uniprot([pdbid])[pdbid]
+
+    def uniprot_to_pdb(self, uniprotid):
+        """pdbIDs of a uniprotID"""
+        return self.bulk_uniprot_to_pdb([uniprotid])[uniprotid]
+
+
+_default = None
+
+
+def default_map():
+    """The UniproPDBMap of data/unipropdb.csv, opened once per process"""
+    global _default
+    if _default is None:
+        _default = UniproPDBMap()
+    return _default
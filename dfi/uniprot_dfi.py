@@ -10,19 +10,23 @@ Description
 Given a list of uniprot IDs:
 dfi.py will find do a blast search on the NCBI
 to find the highest hit PDB and calculate the DFI profile
-of that pdb
+of that pdb. With a PDB seqres file and a fasta file of the
+uniprot sequences the search runs offline (see seqsearch.py).
 
 Example
 --------
-./dfi.py P42771
+./dfi.py P42771 [--seqres pdb_seqres.txt --fasta uniprot.fasta]
 
 """
 from __future__ import print_function
 import sys
+import argparse
 import dfi.unipro_blast_to_pdb as uni
+import dfi.seqsearch as seqsearch
+import dfi.fastaseq as fastaseq
 
 
-def uniproDFI(uniprotcodes):
+def uniproDFI(uniprotcodes, seqres=None, fastafile=None, nprocs=None):
     """
     uniproDFI take a list of uniprot codes,
     finds the top pdb hit and then computes
@@ -32,8 +36,20 @@ def uniproDFI(uniprotcodes):
     -----
     uniprotcodes: ls
        ls of uniprot codes to run DFI on
+    seqres: str
+       PDB seqres fasta file to search offline instead of blasting
+    fastafile: str
+       fasta file of the uniprot sequences for the offline search
+    nprocs: int
+       number of processes of the offline search
 
     """
+    if(seqres):
+        sequences = fastaseq.read_fasta(fastafile)
+        queries = dict((code, sequences[code]) for code in uniprotcodes)
+        seqsearch.search_batch(queries, seqres, nprocs=nprocs, Verbose=True)
+        return
+
     for code in uniprotcodes:
         blastfile = code + '_blast.xml'
         print("Blasting")
@@ -42,8 +58,20 @@ def uniproDFI(uniprotcodes):
         uni.parseBlastFile(blastfile)
 
 
-if __name__ == "__main__" and len(sys.argv) < 2:
-    print(__doc__)
-else:
-    uniprotcodes = sys.argv[1:]
-    uniproDFI(uniprotcodes)
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit()
+    parser = argparse.ArgumentParser(description='DFI of uniprot IDs')
+    parser.add_argument('uniprotcodes', nargs='+')
+    parser.add_argument('--seqres',
+                        help='PDB seqres fasta file to search offline')
+    parser.add_argument('--fasta',
+                        help='fasta file of the uniprot sequences')
+    parser.add_argument('--nprocs', type=int,
+                        help='number of processes of the offline search')
+    results = parser.parse_args(sys.argv[1:])
+    if results.seqres and not results.fasta:
+        parser.error('--seqres needs --fasta')
+    uniproDFI(results.uniprotcodes, seqres=results.seqres,
+              fastafile=results.fasta, nprocs=results.nprocs)
@@ -48,7 +48,10 @@ setup(name='dfi',
       packages=['dfi'],
       scripts=['./dfi/dfi_calc.py',
                './dfi/uniprot_dfi.py',
-               './dfi/fastaseq.py'],
+               './dfi/fastaseq.py',
+               './dfi/covario.py',
+               './dfi/trajcovar.py',
+               './dfi/seqsearch.py'],
       license='BSD',
       long_description=open('README.md').read(),
       install_requires=parse_requirements('requirements.txt')